@@ -1,3 +1,4 @@
+import atexit
 from datetime import datetime, timedelta
 
 from flask import Flask
@@ -7,6 +8,7 @@ from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from config import config
 from .core.app_manager import AppManager
+from .src.utils.workflow import WorkflowProvider
 from flask_apscheduler import APScheduler
 
 bootstrap = Bootstrap()
@@ -33,6 +35,9 @@ def create_app(config_name):
         scheduler.init_app(app)
         scheduler.add_job(func=app_manager._restore_session, id='load_session',
                           run_date=datetime.now() + timedelta(seconds=30))
+        scheduler.add_job(func=app_manager._maintain_partitions, id='maintain_partitions', trigger='interval',
+                          hours=app.config['PARTITION_MAINTENANCE_INTERVAL'],
+                          next_run_time=datetime.now() + timedelta(seconds=60))
         scheduler.start()
 
     from .core import main as main_blueprint
@@ -48,3 +53,6 @@ def setup_app_manager(app):
 
     app_manager.init_app()
     app_manager.dataManager._store_permanent()
+    app_manager.dataManager.load_latest_data()
+    atexit.register(app_manager.dataManager.end)
+    atexit.register(WorkflowProvider.stop)
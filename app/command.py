@@ -33,8 +33,8 @@ class Command:
 
     def save_command_to_db(self, event=1):
         if not self._saved:
-            event = DBevent(dev_id=self.device_id, event_type=event, time=self.time_executed, args=str(self.args),
-                            command=self.command_id, response=str(self.response))
+            event = DBevent(dev_id=self.device_id, event_type=event, time=self.time_executed, args=self.args,
+                            command=self.command_id, response=self.response)
             app_manager.dataManager.save_event(event)
         self._saved = True
 
@@ -47,8 +47,8 @@ class Command:
                               var_id=variable, attribute=channel, note=note)
                 app_manager.dataManager.save_value(value)
         else:
-            event = DBevent(dev_id=self.device_id, event_type=2, time=self.time_executed, args=str(self.args),
-                            command=self.command_id, response=str(self.response))
+            event = DBevent(dev_id=self.device_id, event_type=2, time=self.time_executed, args=self.args,
+                            command=self.command_id, response=self.response)
             app_manager.dataManager.save_event(event)
 
     def to_dict(self) -> dict:
@@ -1,8 +1,13 @@
+from math import isfinite
+
+from flask import current_app
+
 from app.src.utils.logger import log_initialise, log_terminate, log_terminate_all
 from app.src.utils.response import Response
 from app.src.utils import Log
-from app.src.utils.errors import IdError
-from app.src.utils.time import time_from_string
+from app.src.utils.errors import IdError, BusyError
+from app.src.utils.time import time_from_string, time_to_string
+from app.src.utils.columnar import to_npz
 
 
 def validate_attributes(required, attributes, class_name):
@@ -14,6 +19,72 @@ def validate_attributes(required, attributes, class_name):
                 raise AttributeError('The attribute {} of class {} cannot be None'.format(att, class_name))
 
 
+def parse_int(value, name):
+    if value is not None:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise SyntaxError('Invalid {} has been provided: {}'.format(name, value))
+
+
+def parse_values(rows, max_size):
+    """
+    Validates and converts values given as lists [device_id, variable_id, time <YYYYmmddHHMMSSfff>, value, attribute],
+    the attribute is optional. The values are processed column by column and all invalid rows are reported at once.
+
+    :param rows: list of values
+    :param max_size: maximal number of values
+    :return: list of dictionaries with the dev_id, var_id, time, value and attribute of values
+    """
+    if not isinstance(rows, list) or not rows:
+        raise SyntaxError('No values have been provided')
+    if len(rows) > max_size:
+        raise SyntaxError('Too many values have been provided: {} (at most {})'.format(len(rows), max_size))
+
+    errors = {}  # {row: the first error}
+    columns = [[], [], [], [], []]
+    for i, row in enumerate(rows):
+        if not isinstance(row, (list, tuple)) or len(row) not in (4, 5):
+            errors[i] = 'expected [device_id, variable_id, time, value, attribute]'
+            row = ()
+        for column, item in zip(columns, tuple(row) + (None, ) * (5 - len(row))):
+            column.append(item)
+
+    def convert(column, name, function):
+        result = []
+        for i, item in enumerate(column):
+            try:
+                result.append(None if i in errors else function(item))
+            except (TypeError, ValueError, SyntaxError):
+                errors.setdefault(i, 'invalid {}: {}'.format(name, item))
+                result.append(None)
+        return result
+
+    def identifier(item):
+        if not isinstance(item, str) or not item:
+            raise ValueError()
+        return item
+
+    def number(item):
+        item = float(item)
+        if not isfinite(item):
+            raise ValueError()
+        return item
+
+    dev_ids = convert(columns[0], 'device_id', identifier)
+    var_ids = convert(columns[1], 'variable_id', identifier)
+    times = convert(columns[2], 'time', lambda item: time_from_string(identifier(item)))
+    values = convert(columns[3], 'value', number)
+    attributes = convert(columns[4], 'attribute', lambda item: None if item in (None, '') else int(item))
+
+    if errors:
+        raise SyntaxError('Invalid values have been provided: {}{}'.format(
+            '; '.join('row {}: {}'.format(i, errors[i]) for i in sorted(errors)[:10]),
+            ' and {} more'.format(len(errors) - 10) if len(errors) > 10 else ''))
+    return [{'dev_id': dev_id, 'var_id': var_id, 'time': time, 'value': value, 'attribute': attribute, 'note': None}
+            for dev_id, var_id, time, value, attribute in zip(dev_ids, var_ids, times, values, attributes)]
+
+
 class AppManager:
     """
     Defines entry points to the application.
@@ -145,7 +216,10 @@ class AppManager:
         """
         return Response(True, {
             'devices': self.deviceManager.ping(),
-            'tasks': self.taskManager.ping()
+            'tasks': self.taskManager.ping(),
+            'commands': self.deviceManager.command_stats(),
+            'data_cache': self.dataManager.query_cache.stats(),
+            'buffered_values': self.dataManager.buffered_values
         }, None)
 
     def get_data(self, config: dict) -> Response:
@@ -153,29 +227,221 @@ class AppManager:
         Retrieves data in supported format (see
         `details <https://github.com/SmartBioTech/DeviceControl/wiki/End-Points#get-data>`__).
 
+        Data of several devices are retrieved at once by "device_ids" (a comma separated list) instead of
+        "device_id", grouped by device. Then the range may be also limited by "until" in format <YYYYmmddHHMMSSfff>
+        (included) and the values by "variables", a comma separated list, but "format" is not supported. At most
+        "limit" (capped by DATA_PAGE_SIZE_MAX) items of each device are retrieved, the following ones by "cursor"
+        returned as "next_cursor".
+
         :param config: A dictionary with pre-defined keys
         :return: Response object
         """
         try:
-            validate_attributes(['device_id', 'type'], config, 'GetData')
+            validate_attributes(['type'], config, 'GetData')
             
             device_id = config.get('device_id')
             data_type = config.get('type')  # (events/values)
-            log_id = config.get('log_id', None)
+            log_id = parse_int(config.get('log_id', None), 'log_id')
             time = config.get('time', None)
+            limit = parse_int(config.get('limit', None), 'limit')
+            cursor = config.get('cursor', None)
+            data_format = config.get('format', 'json')
 
             time = time_from_string(time)
 
+            device_ids = config.get('device_ids', None)
+            if device_ids is not None:
+                if not device_ids:
+                    raise SyntaxError('Invalid device_ids have been provided: {}'.format(device_ids))
+                if data_format != 'json':
+                    raise SyntaxError('Data of several devices are retrieved only in JSON')
+                until = time_from_string(config.get('until', None))
+                variables = config.get('variables', None)
+                variables = variables.split(',') if variables else None
+                data, next_cursor = self.dataManager.get_data_of_devices(device_ids.split(','), data_type, log_id,
+                                                                         time, until, variables, limit, cursor)
+                return Response(True, data, None, extra={'next_cursor': next_cursor})
+            validate_attributes(['device_id'], config, 'GetData')
+
+            if data_format == 'ndjson':
+                return Response(True, self.dataManager.iter_data(log_id, time, device_id, data_type), None)
+
+            if limit is not None or cursor is not None:
+                data, next_cursor = self.dataManager.get_data_page(log_id, time, device_id, data_type, limit, cursor)
+                return Response(True, data, None, extra={'next_cursor': next_cursor})
+
             return Response(True, self.dataManager.get_data(log_id, time, device_id, data_type), None)
             
         except (IdError, AttributeError, SyntaxError) as e:
             Log.error(e)
             return Response(False, None, e)
 
+    def wait_for_data(self, config: dict) -> Response:
+        """
+        Retrieves new data of a device, waiting until they are stored.
+
+        Required keys are "device_id" and "type". The position is given by "cursor" (as returned by this method or
+        by paginated get_data without "time") or "log_id", defaults to the newest stored data. Optional keys are
+        "timeout" in seconds and "limit".
+
+        :param config: A dictionary with the specified keys
+        :return: Response object, with empty data if the timeout expired. If too many requests are waiting,
+                 the cause is BusyError.
+        """
+        try:
+            validate_attributes(['device_id', 'type'], config, 'WaitForData')
+            device_id = config.get('device_id')
+            data_type = config.get('type')  # (events/values)
+            log_id = parse_int(config.get('log_id', None), 'log_id')
+            cursor = config.get('cursor', None)
+            timeout = parse_int(config.get('timeout', None), 'timeout')
+            limit = parse_int(config.get('limit', None), 'limit')
+
+            data, next_cursor = self.dataManager.wait_for_data(device_id, data_type, log_id, cursor, timeout, limit)
+            return Response(True, data, None, extra={'next_cursor': next_cursor})
+
+        except (IdError, AttributeError, SyntaxError, BusyError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
+    def stream_data(self, config: dict) -> Response:
+        """
+        Subscribes to data of a device as they are saved.
+
+        Required key is "device_id", optional "type" limits the data to "values" or "events".
+
+        :param config: A dictionary with the specified keys
+        :return: Response object with an iterator of messages. If too many streams are open, the cause is BusyError.
+        """
+        try:
+            validate_attributes(['device_id'], config, 'StreamData')
+            device_id = config.get('device_id')
+            data_type = config.get('type', None)
+            if data_type not in (None, 'values', 'events'):
+                raise SyntaxError('Invalid type has been provided: {}'.format(data_type))
+            data_types = ('values', 'events') if data_type is None else (data_type, )
+
+            return Response(True, self.dataManager.stream_data(device_id, data_types), None)
+
+        except (IdError, AttributeError, SyntaxError, BusyError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
+    def get_aggregated_data(self, config: dict) -> Response:
+        """
+        Retrieves values of a device aggregated into time buckets (count, min, max, mean and last value per bucket).
+
+        Required keys are "device_id" and "bucket" (width of a bucket in seconds). The range may be limited by
+        "time" (included) and "until" (excluded) in format <YYYYmmddHHMMSSfff> and the variables by "variables",
+        a comma separated list.
+
+        :param config: A dictionary with the specified keys
+        :return: Response object
+        """
+        try:
+            validate_attributes(['device_id', 'bucket'], config, 'GetAggregatedData')
+            device_id = config.get('device_id')
+            bucket = parse_int(config.get('bucket'), 'bucket')
+            start = time_from_string(config.get('time', None))
+            until = time_from_string(config.get('until', None))
+            variables = config.get('variables', None)
+            variables = variables.split(',') if variables else None
+
+            return Response(True, self.dataManager.get_aggregated_data(device_id, bucket, start, until, variables),
+                            None)
+
+        except (IdError, AttributeError, SyntaxError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
+    def export_data(self, config: dict) -> Response:
+        """
+        Retrieves values of a device in a columnar binary format (a NumPy .npz archive with arrays
+        '<variable>/time', '<variable>/value' and '<variable>/attribute').
+
+        Either "experiment_id" or "device_id" has to be specified. For a device, the range may be limited by
+        "time" (included) and "until" (excluded) in format <YYYYmmddHHMMSSfff> and the variables by "variables",
+        a comma separated list.
+
+        :param config: A dictionary with the specified keys
+        :return: Response object
+        """
+        try:
+            experiment_id = parse_int(config.get('experiment_id', None), 'experiment_id')
+            if experiment_id is not None:
+                experiment = self.dataManager.get_experiment(experiment_id)
+                if experiment is None:
+                    raise IdError('Experiment with given ID: %s was not found' % experiment_id)
+                device_id, start, until = experiment.dev_id, experiment.start, experiment.end
+            else:
+                validate_attributes(['device_id'], config, 'ExportData')
+                device_id = config.get('device_id')
+                start = time_from_string(config.get('time', None))
+                until = time_from_string(config.get('until', None))
+            variables = config.get('variables', None)
+            variables = variables.split(',') if variables else None
+
+            return Response(True, to_npz(self.dataManager.export_values(device_id, start, until, variables)), None)
+
+        except (IdError, AttributeError, SyntaxError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
+    def save_values(self, config: dict) -> Response:
+        """
+        Saves many values at once, e.g. measured by sensors which are not connected as devices or backfilled from logs.
+
+        Required key is "values", a list of at most BULK_SIZE_MAX values [device_id, variable_id,
+        time <YYYYmmddHHMMSSfff>, value, attribute], the attribute is optional. The devices must exist, unknown
+        variables are registered. Either all values are saved, or none if any of them is invalid.
+
+        :param config: A dictionary with the specified keys
+        :return: Response object with the number of saved values
+        """
+        try:
+            validate_attributes(['values'], config, 'SaveValues')
+            rows = parse_values(config.get('values'), current_app.config.get('BULK_SIZE_MAX', 100000))
+
+            return Response(True, {'saved': self.dataManager.save_values(rows)}, None)
+
+        except (IdError, AttributeError, SyntaxError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
+    def get_events(self, config: dict) -> Response:
+        """
+        Retrieves events of a device filtered on the server.
+
+        Required key is "device_id". The events may be limited by "event_types" and "commands" (comma separated
+        lists) and by "time" (included) and "until" (excluded) in format <YYYYmmddHHMMSSfff>.
+
+        :param config: A dictionary with the specified keys
+        :return: Response object
+        """
+        try:
+            validate_attributes(['device_id'], config, 'GetEvents')
+            device_id = config.get('device_id')
+            event_types = config.get('event_types', None)
+            event_types = [parse_int(event_type, 'event_types') for event_type in event_types.split(',')] \
+                if event_types else None
+            commands = config.get('commands', None)
+            commands = commands.split(',') if commands else None
+            start = time_from_string(config.get('time', None))
+            until = time_from_string(config.get('until', None))
+
+            return Response(True, self.dataManager.get_events(device_id, event_types, commands, start, until), None)
+
+        except (IdError, AttributeError, SyntaxError) as e:
+            Log.error(e)
+            return Response(False, None, e)
+
     def get_latest_data(self, config) -> Response:
         """
         Retrieves the last data entry for specified Device ID and Data Type.
 
+        Optional "variables" retrieves the last value of every listed variable (a comma separated list),
+        "*" stands for all variables.
+
         :param config: A dictionary which specifies the "device_id": string and "type": string
         :return: Response object
         """
@@ -183,7 +449,16 @@ class AppManager:
             validate_attributes(['device_id', 'type'], config, 'GetData')
             device_id = config.get('device_id')
             data_type = config.get('type')  # (events/values)
-            return Response(True, self.dataManager.get_latest_data(device_id, data_type), None)
+            variables = config.get('variables', None)
+            if variables is None:
+                data = self.dataManager.get_latest_data(device_id, data_type)
+                if data is not None:
+                    data = {column.key: getattr(data, column.key) for column in data.__table__.columns}
+                    data['time'] = time_to_string(data['time'])
+                return Response(True, data, None)
+
+            variables = None if variables == '*' else variables.split(',')
+            return Response(True, self.dataManager.get_latest_data(device_id, data_type, True, variables), None)
 
         except (IdError, AttributeError) as e:
             Log.error(e)
@@ -199,6 +474,7 @@ class AppManager:
         """
         self.taskManager.end()
         self.deviceManager.end()
+        self.dataManager.flush()
         return Response(True, None, None)
 
     @staticmethod
@@ -206,6 +482,12 @@ class AppManager:
         from ..command import Command
         return Command(device_id, command_id, eval(args), source)
 
+    def _maintain_partitions(self):
+        try:
+            self.dataManager.maintain_partitions()
+        except Exception as e:
+            Log.error(e)
+
     def _restore_session(self):
         # first start devices
         tasks = []
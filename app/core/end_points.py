@@ -57,6 +57,57 @@ def get_data():
     from .. import app_manager
     args = dict(request.args)
     response = app_manager.get_data(args)
+    if args.get('format') == 'ndjson':
+        return response.to_ndjson()
+    return response.to_json()
+
+
+@main.route('/data/bulk', methods=['POST'])
+def save_values():
+    from .. import app_manager
+    data: dict = request.get_json()
+    response = app_manager.save_values(data)
+    return response.to_json()
+
+
+@main.route('/data/wait', methods=['GET'])
+def wait_for_data():
+    from .. import app_manager
+    args = dict(request.args)
+    response = app_manager.wait_for_data(args)
+    return response.to_json()
+
+
+@main.route('/data/stream', methods=['GET'])
+def stream_data():
+    from .. import app_manager
+    args = dict(request.args)
+    response = app_manager.stream_data(args)
+    return response.to_event_stream()
+
+
+@main.route('/data/aggregate', methods=['GET'])
+def get_aggregated_data():
+    from .. import app_manager
+    args = dict(request.args)
+    response = app_manager.get_aggregated_data(args)
+    return response.to_json()
+
+
+@main.route('/data/export', methods=['GET'])
+def export_data():
+    from .. import app_manager
+    args = dict(request.args)
+    response = app_manager.export_data(args)
+    name = args.get('experiment_id') or args.get('device_id')
+    return response.to_file('{}.npz'.format(name))
+
+
+@main.route('/data/events', methods=['GET'])
+def get_events():
+    from .. import app_manager
+    args = dict(request.args)
+    response = app_manager.get_events(args)
     return response.to_json()
 
 
@@ -3,6 +3,8 @@ import enum
 from sqlalchemy.dialects.mysql import DATETIME
 
 from .src.utils.AbstractClass import AbstractModel
+from .src.utils.errors import IdError
+from .src.utils.keys import SurrogateKeys
 
 
 class VariableType(enum.Enum):
@@ -17,28 +19,115 @@ class LogType(enum.Enum):
     TASK = 'task'
 
 
+def next_number(context):
+    """
+    Default of the number column: the next unused number of the table. Concurrent inserts may get the same number,
+    the unique constraint rejects all but one of them (see DataManager._insert_if_missing).
+    """
+    column = context.current_column
+    return context.connection.execute(db.select([db.func.coalesce(db.func.max(column), 0) + 1])).scalar()
+
+
+def load_numbers(cls):
+    # a separate connection, the mapping may be needed while a query is running
+    with db.engine.connect() as connection:
+        return connection.execute(db.select([cls.id, cls.number])).fetchall()
+
+
+class NumberType(db.TypeDecorator):
+    """
+    Stores the ID of a device or variable as its number. Unknown IDs are refused by IdError, both in stored rows
+    and in filters.
+    """
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def __init__(self, keys: SurrogateKeys):
+        super().__init__()
+        self.keys = keys
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        number = self.keys.number(value)
+        if number is None:
+            raise IdError("{} with given ID: {} was not found".format(self.keys.kind, value))
+        return number
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.keys.name(value)
+
+
+DEVICE_NUMBERS = SurrogateKeys('Device', lambda: load_numbers(Device))
+VARIABLE_NUMBERS = SurrogateKeys('Variable', lambda: load_numbers(Variable))
+
+
 class Device(db.Model, AbstractModel):
     __tablename__ = 'devices'
     id = db.Column(db.String(100), primary_key=True)
+    # identifies the device in the values table
+    number = db.Column(db.SmallInteger, nullable=False, unique=True, default=next_number)
     device_class = db.Column(db.String(100), nullable=False)
     device_type = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(100), nullable=True, default=None)
 
 
+# values and events are partitioned by months of their time (see DataManager.maintain_partitions),
+# so their primary keys include the time and they cannot have foreign keys
+PARTITION_BY = 'RANGE COLUMNS(time) (PARTITION pmax VALUES LESS THAN (MAXVALUE))'
+
+
 class Value(db.Model, AbstractModel):
     __tablename__ = 'values'
-    id = db.Column(db.Integer, primary_key=True)
-    time = db.Column(DATETIME(fsp=6), nullable=False)
+    __table_args__ = (
+        db.Index('ix_values_dev_id_id', 'dev_id', 'id'),
+        db.Index('ix_values_dev_id_time', 'dev_id', 'time'),
+        db.Index('ix_values_dev_id_var_id_time', 'dev_id', 'var_id', 'time'),
+        {'mysql_partition_by': PARTITION_BY},
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    time = db.Column(DATETIME(fsp=6), primary_key=True)
     value = db.Column(db.Float, nullable=False)
-    dev_id = db.Column(db.String(100), db.ForeignKey('devices.id'), nullable=False)
-    var_id = db.Column(db.String(100), db.ForeignKey('variables.id'), nullable=False)
+    # the numbers of the device and variable are stored, but their IDs are read and written
+    dev_id = db.Column(NumberType(DEVICE_NUMBERS), nullable=False)
+    var_id = db.Column(NumberType(VARIABLE_NUMBERS), nullable=False)
     attribute = db.Column(db.Integer, nullable=True, default=None)
     note = db.Column(db.String(100), nullable=True, default=None)
 
 
+class Rollup(AbstractModel):
+    """
+    Aggregates of values of one variable and attribute (-1 for none) of a device in a time bucket.
+    """
+    width = None  # width of the time bucket in seconds
+
+    dev_id = db.Column(db.String(100), primary_key=True)
+    var_id = db.Column(db.String(100), primary_key=True)
+    attribute = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    time = db.Column(DATETIME(fsp=6), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float(precision=53), nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    last = db.Column(db.Float, nullable=False)
+    last_time = db.Column(DATETIME(fsp=6), nullable=False)
+
+
+class MinuteRollup(db.Model, Rollup):
+    __tablename__ = 'values_minute'
+    width = 60
+
+
+class HourRollup(db.Model, Rollup):
+    __tablename__ = 'values_hour'
+    width = 3600
+
+
 class Variable(db.Model, AbstractModel):
     __tablename__ = 'variables'
     id = db.Column(db.String(30), primary_key=True)
+    # identifies the variable in the values table
+    number = db.Column(db.SmallInteger, nullable=False, unique=True, default=next_number)
     name = db.Column(db.String(100), nullable=True)
     type = db.Column(db.Enum(VariableType), nullable=False, default=None)
     unit = db.Column(db.String(30), nullable=True, default=None)
@@ -46,13 +135,19 @@ class Variable(db.Model, AbstractModel):
 
 class Event(db.Model, AbstractModel):
     __tablename__ = 'events'
-    id = db.Column(db.Integer, primary_key=True)
-    dev_id = db.Column(db.String(100), db.ForeignKey('devices.id'), nullable=False)
-    event_type = db.Column(db.Integer, db.ForeignKey('event_types.id'), nullable=False)
-    time = db.Column(DATETIME(fsp=6), nullable=False)
-    args = db.Column(db.String(200), nullable=False)
+    __table_args__ = (
+        db.Index('ix_events_dev_id_time', 'dev_id', 'time'),
+        db.Index('ix_events_dev_id_event_type_time', 'dev_id', 'event_type', 'time'),
+        db.Index('ix_events_dev_id_command_time', 'dev_id', 'command', 'time'),
+        {'mysql_partition_by': PARTITION_BY},
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    dev_id = db.Column(db.String(100), nullable=False)
+    event_type = db.Column(db.Integer, nullable=False)
+    time = db.Column(DATETIME(fsp=6), primary_key=True)
+    args = db.Column(db.JSON(), nullable=False)
     command = db.Column(db.String(100), nullable=False)
-    response = db.Column(db.String(1023), nullable=False)
+    response = db.Column(db.JSON(), nullable=False)
 
 
 class EventType(db.Model, AbstractModel):
@@ -68,6 +163,15 @@ class Log(db.Model, AbstractModel):
     config = db.Column(db.JSON(), nullable=False)
 
 
+class SpoolReplay(db.Model, AbstractModel):
+    """
+    Key of a locally spooled row which was replayed into the database.
+    """
+    __tablename__ = 'spool_replays'
+    key = db.Column(db.String(32), primary_key=True)
+    time = db.Column(DATETIME(fsp=6), nullable=False, index=True)
+
+
 # TEMPORAL HACK !!!
 class Experiment(db.Model, AbstractModel):
     __tablename__ = 'experiments'
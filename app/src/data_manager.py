@@ -1,19 +1,118 @@
+import heapq
+import json
+from array import array
+from datetime import timedelta
+from math import isclose, isfinite
+from operator import attrgetter, itemgetter
+from threading import Lock, Semaphore, Thread
+from time import sleep
+
+from flask import current_app
+from sqlalchemy import or_, and_, func, literal, literal_column, text, select, union_all
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from . import utils
 from .utils import time
+from .utils.archive import Archive
+from .utils.broadcaster import Broadcaster, Stream
+from .utils.buffer import WriteBuffer
+from .utils.cache import LatestCache
+from .utils.cursor import encode_cursor, decode_cursor
+from .utils.errors import IdError, BusyError
+from .utils.notifier import Notifier
+from .utils.partitions import PARTITIONED_TABLES, MAX_PARTITION, month_start, partition_name, partition_start, \
+    partition_definitions
 from .utils.permanent_data import EVENT_TYPES, VARIABLES
-from .utils.time import time_to_string
+from .utils.query_cache import QueryCache
+from .utils.rollup import NO_ATTRIBUTE, aggregate, bucket_start, merge
+from .utils.session import session_scope, is_unavailable
+from .utils.spool import Spool
+from .utils.time import time_to_string, time_from_string, time_to_microseconds, EPOCH
 from .. import db
-from ..models import Variable, Device, Experiment, Value, Event, EventType, Log
+from ..models import Variable, Device, Experiment, Value, Event, EventType, Log, MinuteRollup, HourRollup, \
+    SpoolReplay, DEVICE_NUMBERS, VARIABLE_NUMBERS
+
+# tables whose primary key is assigned by the application, not by the database
+NATURAL_KEY_MODELS = (Variable, EventType, Device, Log)
+# attempts to insert an item with a natural key whose number was taken concurrently
+INSERT_ATTEMPTS = 3
+# mappings of IDs to the numbers stored in values, see SurrogateKeys
+SURROGATE_KEYS = {Device: DEVICE_NUMBERS, Variable: VARIABLE_NUMBERS}
+
+# tables with aggregates of values maintained on every write, from the widest bucket
+ROLLUP_MODELS = (HourRollup, MinuteRollup)
+ROLLUP_KEY = ('dev_id', 'var_id', 'attribute', 'time')
+ROLLUP_AGGREGATES = ('count', 'sum', 'min', 'max', 'last', 'last_time')
+
+
+def to_json(obj):
+    """
+    Converts an object into a structure which can be stored as JSON. Exceptions are converted into dictionaries
+    with the 'error' (class name) and 'message', other unsupported objects into their string representation.
+
+    :param obj: the object
+    :return: the converted object
+    """
+    if isinstance(obj, dict):
+        return {str(key): to_json(item) for key, item in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [to_json(item) for item in obj]
+    if isinstance(obj, float) and not isfinite(obj):
+        return str(obj)
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    if isinstance(obj, Exception):
+        return {'error': obj.__class__.__name__, 'message': str(obj)}
+    return str(obj)
 
 
 class DataManager:
     """
     Defines access points to the persistent data layer of the application.
     """
+    # serialises inserts of items with a natural key, see _insert_if_missing
+    _insert_lock = Lock()
+
     def __init__(self):
         self.last_seen_id = {'values': {}, 'events': {}}
+        # the newest values per variable and attribute and the newest event of every device
+        self.latest = {'values': LatestCache(), 'events': LatestCache()}
+        self.notifier = Notifier()
+        # every waiting request occupies a thread of the server, their number is limited to keep threads for others
+        self.waiting_requests = Semaphore(current_app.config.get('DATA_WAIT_MAX_REQUESTS', 32))
+        self.broadcaster = Broadcaster()
+        # every stream occupies a thread of the server as well
+        self.open_streams = Semaphore(current_app.config.get('DATA_STREAM_MAX_SUBSCRIBERS', 16))
+        # results of get_data, invalidated when new data of their device are stored
+        self.query_cache = QueryCache(current_app.config.get('DATA_CACHE_SIZE', 256),
+                                      current_app.config.get('DATA_CACHE_TTL', 2.0))
 
         self.variables = self.load_variables()
+        # values store the numbers of their devices and variables, the mappings are loaded again on a miss
+        self.device_numbers = DEVICE_NUMBERS
+        self.variable_numbers = VARIABLE_NUMBERS
+        self.device_numbers.load()
+        self.variable_numbers.load()
         self.experiments = dict()
+        # values moved out of the database by archive_values
+        self.archive = Archive(current_app.config.get('ARCHIVE_PATH', 'archive'))
+
+        self.values_buffer = WriteBuffer(self._write_values,
+                                         current_app.config.get('VALUES_BUFFER_SIZE', 500),
+                                         current_app.config.get('VALUES_BUFFER_INTERVAL', 1.0))
+
+        # rows are spooled locally while the database is unavailable and replayed by the forwarder thread
+        self.spool = Spool(current_app.config.get('SPOOL_PATH', ':memory:'))
+        self.spool_retry_interval = current_app.config.get('SPOOL_RETRY_INTERVAL', 5.0)
+        self.spool_batch_size = current_app.config.get('SPOOL_BATCH_SIZE', 1000)
+        self.database_available = True
+        self._spool_lock = Lock()
+        self._forwarder = None
+        if len(self.spool):
+            # rows spooled before a restart
+            self._database_unavailable()
 
     def _store_permanent(self):
         for item in EVENT_TYPES:
@@ -26,16 +125,245 @@ class DataManager:
         """
         Executes an INSERT query and commits the change.
 
+        Items with a natural key (see NATURAL_KEY_MODELS) are inserted only if an item with the same ID does not
+        exist yet. Other items get their ID from the database and are always inserted.
+
         :param item: Item to insert
         :param item_class: Class reference of the Item type
         """
-        from main import app
-        with app.app_context():
-            exists = item_class.query.filter_by(id=item.id).first()
-            if not exists:
+        with session_scope():
+            if item_class in NATURAL_KEY_MODELS:
+                DataManager._insert_if_missing(item, item_class)
+                if item_class in SURROGATE_KEYS:
+                    # the number of the item is known at once, without waiting for the next reload
+                    SURROGATE_KEYS[item_class].load()
+            else:
                 db.session.add(item)
                 db.session.commit()
 
+    @staticmethod
+    def _insert_if_missing(item, item_class):
+        """
+        Inserts an item unless an item with the same ID exists and commits the change. Inserts are serialised
+        within the process, so the number of a new device or variable (see next_number) is unique. If the number
+        was taken by another process meanwhile, the insert fails and is retried with the next number.
+        """
+        with DataManager._insert_lock:
+            for attempt in range(1, INSERT_ATTEMPTS + 1):
+                if item_class.query.filter_by(id=item.id).first() is not None:
+                    return
+                db.session.add(item)
+                try:
+                    db.session.commit()
+                    return
+                except IntegrityError:
+                    # the rollback expunges the item and resets its number
+                    db.session.rollback()
+                    if attempt == INSERT_ATTEMPTS:
+                        raise
+
+    @staticmethod
+    def _insert_rows(table, rows):
+        """
+        Executes multi-row INSERT queries for the given rows. Does not commit the change.
+
+        :param table: the table
+        :param rows: list of dictionaries {column: value}
+        """
+        batches = {}
+        for row in rows:
+            batches.setdefault(tuple(sorted(row)), []).append(row)
+        for batch in batches.values():
+            db.session.execute(table.insert(), batch)
+
+    @staticmethod
+    def _insert_values(rows):
+        """
+        Inserts the given Value rows and updates the rollups of the values, all in one transaction.
+
+        :param rows: list of dictionaries {column: value}
+        """
+        with session_scope():
+            DataManager._insert_rows(Value.__table__, rows)
+            DataManager._update_rollups(rows)
+            db.session.commit()
+
+    def _write_values(self, rows):
+        """
+        Writes the given Value rows, or spools them if the database is unavailable. Threads waiting for new values
+        of the devices are notified and the rows are published afterwards.
+
+        :param rows: list of dictionaries {column: value}
+        """
+        if self._store('values', rows, self._insert_values):
+            self._notify_stored('values', {row['dev_id'] for row in rows})
+        for row in rows:
+            self._publish('values', row['dev_id'], (row['var_id'], row['attribute']), row)
+
+    def _store(self, kind, rows, write) -> bool:
+        """
+        Writes rows into the database by the given function. If the database is unavailable, the rows are spooled
+        instead, without waiting for the database until the forwarder has replayed all spooled rows.
+
+        :param kind: kind of the rows, 'variables', 'values' or 'events'
+        :param rows: list of dictionaries {column: value}
+        :param write: function writing the rows
+        :return: True if the rows were written, False if they were spooled
+        """
+        with self._spool_lock:
+            if not self.database_available:
+                self.spool.append(kind, rows)
+                return False
+        try:
+            write(rows)
+            return True
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            utils.Log.error(e)
+            self._database_unavailable(kind, rows)
+            return False
+
+    def _database_unavailable(self, kind=None, rows=()):
+        """
+        Spools the rows, stops writing into the database and starts the forwarder.
+        """
+        with self._spool_lock:
+            self.database_available = False
+            if rows:
+                self.spool.append(kind, rows)
+            if self._forwarder is None:
+                self._forwarder = Thread(target=self._forward, name="spool forwarder thread", daemon=True)
+                self._forwarder.start()
+
+    def _forward(self):
+        """
+        Replays the spool in batches every SPOOL_RETRY_INTERVAL seconds until it is empty.
+        """
+        while True:
+            sleep(self.spool_retry_interval)
+            try:
+                while True:
+                    with self._spool_lock:
+                        items = self.spool.peek(self.spool_batch_size)
+                        if not items:
+                            self.database_available = True
+                            self._forwarder = None
+                            break
+                    self._replay_batch(items)
+                    self.spool.remove([item[0] for item in items])
+            except Exception as e:
+                utils.Log.error(e)
+                continue
+            self._prune_replays()
+            return
+
+    def _replay_batch(self, items):
+        """
+        Replays spooled items. If the batch fails for other reason than an unavailable database, the items are
+        replayed one by one and those which cannot be written are dropped.
+        """
+        try:
+            self._replay(items)
+        except Exception as e:
+            if is_unavailable(e):
+                raise
+            for item in items:
+                try:
+                    self._replay([item])
+                except Exception as e:
+                    if is_unavailable(e):
+                        raise
+                    utils.Log.error(Exception('Spooled {} row {} has been dropped: {}'.format(item[1], item[3], e)))
+
+    def _replay(self, items):
+        """
+        Writes spooled items into the database in one transaction together with their keys. Items whose keys are
+        already stored were replayed before and are skipped.
+
+        :param items: tuples (sequence number, kind, key, row) as returned by Spool.peek
+        """
+        for _, kind, _, row in items:
+            if kind == 'variables':
+                self.save_variable(row['id'])
+
+        rows = {'values': [], 'events': []}
+        with session_scope():
+            replayed = {key for key, in db.session.query(SpoolReplay.key)
+                        .filter(SpoolReplay.key.in_([item[2] for item in items]))}
+            keys = []
+            for _, kind, key, row in items:
+                if kind in rows and key not in replayed:
+                    rows[kind].append(row)
+                    keys.append({'key': key, 'time': time.now()})
+            if not keys:
+                return
+            self._insert_rows(Value.__table__, rows['values'])
+            self._update_rollups(rows['values'])
+            self._insert_rows(Event.__table__, rows['events'])
+            self._insert_rows(SpoolReplay.__table__, keys)
+            db.session.commit()
+
+        for data_type, data_rows in rows.items():
+            if data_rows:
+                self._notify_stored(data_type, {row['dev_id'] for row in data_rows})
+
+    def _prune_replays(self):
+        """
+        Removes keys of replayed rows older than SPOOL_REPLAY_RETENTION seconds. A row is replayed again only if
+        the application stopped between the replay and the removal of the row from the spool.
+        """
+        try:
+            with session_scope():
+                retention = timedelta(seconds=current_app.config.get('SPOOL_REPLAY_RETENTION', 86400))
+                SpoolReplay.query.filter(SpoolReplay.time < time.now() - retention).delete(synchronize_session=False)
+                db.session.commit()
+        except Exception as e:
+            utils.Log.error(e)
+
+    def _notify_stored(self, data_type, device_ids):
+        """
+        Notifies threads waiting for new data of the given devices about the newest stored IDs
+        and invalidates cached data of the devices. The newest IDs are looked up only for devices
+        somebody waits for.
+        """
+        self.query_cache.invalidate(device_ids)
+        device_ids = self.notifier.watched(data_type, device_ids)
+        if not device_ids:
+            return
+        cls = Value if data_type == 'values' else Event
+        with session_scope():
+            newest = db.session.query(cls.dev_id, func.max(cls.id)) \
+                .filter(cls.dev_id.in_(device_ids)) \
+                .group_by(cls.dev_id) \
+                .all()
+        self.notifier.notify(data_type, dict(newest))
+
+    @staticmethod
+    def _update_rollups(rows):
+        """
+        Merges aggregates of the given Value rows into all rollup tables. Does not commit the change.
+
+        :param rows: list of dictionaries {column: value}
+        """
+        for cls in ROLLUP_MODELS:
+            items = [dict(zip(ROLLUP_KEY, key), **aggregates) for key, aggregates in aggregate(rows, cls.width).items()]
+            if not items:
+                continue
+            table = cls.__table__
+            statement = mysql_insert(table)
+            new = statement.inserted
+            # the order matters, 'last' must be compared to the 'last_time' before its update
+            statement = statement.on_duplicate_key_update([
+                ('count', table.c.count + new.count),
+                ('sum', table.c.sum + new.sum),
+                ('min', func.least(table.c.min, new.min)),
+                ('max', func.greatest(table.c.max, new.max)),
+                ('last', func.if_(new.last_time >= table.c.last_time, new.last, table.c.last)),
+                ('last_time', func.greatest(table.c.last_time, new.last_time)),
+            ])
+            db.session.execute(statement, items)
+
     @staticmethod
     def update(item):
         """
@@ -43,8 +371,7 @@ class DataManager:
 
         :param item: Item to update
         """
-        from main import app
-        with app.app_context():
+        with session_scope():
             db.session.add(item)
             db.session.commit()
 
@@ -55,14 +382,32 @@ class DataManager:
 
         :param log_id: ID of the log item
         """
-        from main import app
-        with app.app_context():
+        with session_scope():
             if log_id:
                 Log.query.filter_by(id=log_id).delete()
             else:
                 db.session.query(Log).delete()
             db.session.commit()
 
+    def flush(self):
+        """
+        Writes all buffered values into persistent storage.
+        """
+        self.values_buffer.flush()
+
+    def end(self):
+        """
+        Stops buffering of values and writes the remaining ones into persistent storage.
+        """
+        self.values_buffer.stop()
+
+    @property
+    def buffered_values(self) -> int:
+        """
+        Number of values which were saved but not yet written into persistent storage.
+        """
+        return self.values_buffer.pending
+
     def load_variables(self):
         """
         Loads all variables from persistent storage.
@@ -73,12 +418,59 @@ class DataManager:
         """
         Saves a Value object into persistent storage.
 
+        Values are buffered and written in batches, see VALUES_BUFFER_SIZE and VALUES_BUFFER_INTERVAL in config.
+        The newest data and live streams get a value once it is written.
+
         :param value: value to save
         """
         if value.var_id not in self.variables:
-            self.save_variable(value.var_id)
+            self._store('variables', [{'id': value.var_id}], lambda rows: self.save_variable(value.var_id))
             self.variables.append(value.var_id)
-        self.insert(value, Value)
+        row = {column.key: getattr(value, column.key) for column in Value.__table__.columns}
+        if row['id'] is None:
+            del row['id']
+        self.values_buffer.put(row)
+
+    def save_values(self, rows: list) -> int:
+        """
+        Saves many values at once, bypassing the buffer. Unknown variables are registered once per call and
+        the values are written in one transaction by multi-row INSERT queries of up to BULK_BATCH_SIZE values,
+        so either all of them are saved or none.
+
+        :param rows: list of dictionaries with the dev_id, var_id, time, value, attribute and note of values
+        :return: number of saved values
+        """
+        unknown_devices = sorted(device_id for device_id in {row['dev_id'] for row in rows}
+                                 if self.device_numbers.number(device_id) is None)
+        if unknown_devices:
+            raise IdError("Devices with given IDs were not found: {}".format(', '.join(unknown_devices)))
+
+        for var_id in sorted({row['var_id'] for row in rows} - set(self.variables)):
+            self._store('variables', [{'id': var_id}], lambda variables: self.save_variable(variables[0]['id']))
+            self.variables.append(var_id)
+
+        batch_size = current_app.config.get('BULK_BATCH_SIZE', 5000)
+
+        def write(values):
+            with session_scope():
+                for i in range(0, len(values), batch_size):
+                    self._insert_rows(Value.__table__, values[i:i + batch_size])
+                    self._update_rollups(values[i:i + batch_size])
+                db.session.commit()
+
+        if self._store('values', rows, write):
+            self._notify_stored('values', {row['dev_id'] for row in rows})
+        for row in rows:
+            self._publish('values', row['dev_id'], (row['var_id'], row['attribute']), row)
+        return len(rows)
+
+    def _publish(self, data_type, device_id, key, row):
+        """
+        Passes a saved row to the in-memory consumers: the cache of the newest data and the live streams.
+        """
+        self.latest[data_type].update(device_id, key, row)
+        if self.broadcaster.has_subscribers(device_id, data_type):
+            self.broadcaster.publish(device_id, data_type, json.dumps(dict(row, time=time_to_string(row['time']))))
 
     def save_variable(self, variable: Variable):
         """
@@ -93,9 +485,18 @@ class DataManager:
         """
         Saves an Event object into persistent storage.
 
+        The arguments and response of the event are stored as JSON, see to_json.
+
         :param event: event to save
         """
-        self.insert(event, Event)
+        for column in ('args', 'response'):
+            if getattr(event, column) is not None:
+                setattr(event, column, to_json(getattr(event, column)))
+        row = {column.key: getattr(event, column.key) for column in Event.__table__.columns
+               if getattr(event, column.key) is not None}
+        if self._store('events', [row], lambda rows: self.insert(event, Event)):
+            self._notify_stored('events', {event.dev_id})
+        self._publish('events', event.dev_id, None, row)
 
     def save_device(self, connector: Device):
         """
@@ -133,21 +534,30 @@ class DataManager:
         experiment.end = time.now()
         self.update(experiment)
 
-    def _post_process(self, query_results, data_type, device_id):
-        result = {}
+    @staticmethod
+    def _serialise(obj) -> (int, dict):
+        row = dict(obj.__dict__)
+        row.pop('_sa_instance_state', None)
+        log_id = row.pop('id')
+        row['time'] = time_to_string(row['time'])
+        return log_id, row
 
-        for obj in query_results:
-            row = obj.__dict__
-            log_id = row.pop('id')
-            row['time'] = time_to_string(row['time'])
-            if "_sa_instance_state" in row:
-                del row['_sa_instance_state']
-            result[log_id] = row
+    def _post_process(self, query_results, data_type, device_id):
+        result = dict(map(self._serialise, query_results))
+        self._remember_last_seen(result, data_type, device_id)
+        return result
 
+    def _remember_last_seen(self, result, data_type, device_id):
         if device_id is not None and len(result) != 0:
             self.last_seen_id[data_type][device_id] = max(list(map(int, result.keys())))
 
-        return result
+    def _data_query(self, cls, log_id, last_time, device_id, data_type):
+        query = cls.query.filter_by(dev_id=device_id)
+        if last_time is not None:
+            return query.filter(cls.time > last_time)
+        if log_id is None:
+            log_id = self.last_seen_id[data_type].get(device_id, 0)
+        return query.filter(cls.id > log_id)
 
     def get_data(self, log_id: int, last_time: str, device_id: str, data_type: str = 'values') -> dict:
         """
@@ -159,36 +569,804 @@ class DataManager:
                           from the response. If it's not None, the log_id parameter is ignored.
         :param device_id: device ID of the device
         :param data_type: defines the type of data to retrieve, defaults to 'values'
-        :return: a dictionary with the data from persistent storage
+        :return: a dictionary with the data from persistent storage, including archived values. Concurrent
+                 identical calls share one query and the result is cached for up to DATA_CACHE_TTL seconds
+                 (see QueryCache), so it must not be modified.
         """
         cls = Value if data_type == 'values' else Event
+        if last_time is None and log_id is None:
+            log_id = self.last_seen_id[data_type].get(device_id, 0)
 
+        def load():
+            with session_scope():
+                items = self._data_query(cls, log_id, last_time, device_id, data_type).all()
+                if cls is Value:
+                    items = self._archived_values(device_id, log_id, last_time) + items
+                return dict(map(self._serialise, items))
+
+        key = (data_type, device_id) + (('time', last_time) if last_time is not None else ('id', log_id))
+        result = self.query_cache.get(key, device_id, load)
+        self._remember_last_seen(result, data_type, device_id)
+        return result
+
+    def _archived_values(self, device_id, log_id, last_time, until=None, variables=None) -> list:
+        """
+        Reads archived values selected the same way as by _data_query, optionally limited by the time until
+        (included) and variables.
+        """
         if last_time is not None:
-            from main import app
-            with app.app_context():
-                return self._post_process(cls.query.filter_by(dev_id=device_id).filter(cls.time > last_time).all(),
-                                          data_type, device_id)
+            rows = [row for row in self.archive.read(device_id, variables, last_time, until)
+                    if row['time'] > last_time]
+        else:
+            rows = [row for row in self.archive.read(device_id, variables, None, until, log_id)
+                    if row['id'] > log_id]
+        return [Value(**row) for row in rows if until is None or row['time'] <= until]
+
+    def get_data_of_devices(self, device_ids: list, data_type: str = 'values', log_id: int = None,
+                            last_time=None, until=None, variables: list = None, limit: int = None,
+                            cursor: str = None) -> (dict, str):
+        """
+        Retrieves a limited amount of data of several devices from persistent storage by a single query, ordered
+        by ID or by time if the last_time parameter is not None. The following data are retrieved by passing
+        the returned cursor.
+
+        :param device_ids: device IDs of the devices
+        :param data_type: defines the type of data to retrieve, defaults to 'values'
+        :param log_id: data with this or lower ID will be excluded, is ignored if the last_time or cursor parameter
+                       is not None. Defaults to no limit.
+        :param last_time: data from before and at this time will be excluded, is ignored if the cursor parameter
+                          is not None
+        :param until: data from after this time will be excluded, defaults to no limit
+        :param variables: IDs of variables of the values to retrieve, defaults to all variables. Does not apply
+                          to events.
+        :param limit: maximal number of items to retrieve per device, defaults to (and is capped by)
+                      DATA_PAGE_SIZE_MAX
+        :param cursor: the cursor returned with the previous data of the same devices
+        :return: a dictionary {device_id: {log_id: data}} with all the devices, including archived values,
+                 and the cursor to the following data, None if there are no more data of any device
+        """
+        cls = Value if data_type == 'values' else Event
+
+        max_limit = current_app.config.get('DATA_PAGE_SIZE_MAX', 10000)
+        limit = max_limit if limit is None else min(limit, max_limit)
+        if limit < 1:
+            raise SyntaxError("Invalid limit has been provided: {}".format(limit))
+
+        if cursor is not None:
+            positions = decode_cursor(cursor).get('devices')
+            if not isinstance(positions, dict) or not all(isinstance(positions.get(device_id), dict)
+                                                          and 'id' in positions[device_id]
+                                                          for device_id in device_ids):
+                raise SyntaxError("Invalid cursor has been provided: {}".format(cursor))
+            positions = {device_id: positions[device_id] for device_id in device_ids}
+            if len({'time' in position for position in positions.values()}) > 1:
+                raise SyntaxError("Invalid cursor has been provided: {}".format(cursor))
+        elif last_time is not None:
+            positions = {device_id: {'time': time_to_string(last_time), 'id': None} for device_id in device_ids}
         else:
+            positions = {device_id: {'id': log_id or 0} for device_id in device_ids}
+        by_time = 'time' in positions[device_ids[0]]
+        order = (cls.time, cls.id) if by_time else (cls.id,)
+
+        # every device is read by its own index range scan, all of them within one statement
+        pages = []
+        for device_id, position in positions.items():
+            query = select(cls).filter(cls.dev_id == device_id)
+            if by_time:
+                position_time = time_from_string(position['time'])
+                if position['id'] is None:
+                    query = query.filter(cls.time > position_time)
+                else:
+                    query = query.filter(cls.time >= position_time,
+                                         or_(cls.time > position_time, cls.id > position['id']))
+            else:
+                query = query.filter(cls.id > position['id'])
+            if until is not None:
+                query = query.filter(cls.time <= until)
+            if cls is Value and variables:
+                query = query.filter(Value.var_id.in_(variables))
+            pages.append(select(query.order_by(*order).limit(limit + 1).subquery()))
+        page = aliased(cls, union_all(*pages).subquery())
+
+        with session_scope():
+            items = db.session.query(page).all()
+
+        by_device = {device_id: [] for device_id in device_ids}
+        for item in items:
+            by_device[item.dev_id].append(item)
+
+        result, next_positions, has_more = {}, {}, False
+        for device_id, position in positions.items():
+            device_items = sorted(by_device[device_id], key=attrgetter(*('time', 'id') if by_time else ('id',)))
+            if cls is Value:
+                device_items = self._merge_archived_page(device_items, device_id, position, limit + 1, until,
+                                                         variables)
+            if len(device_items) > limit:
+                device_items = device_items[:limit]
+                has_more = True
+            if device_items:
+                last = device_items[-1]
+                position = {'time': time_to_string(last.time), 'id': last.id} if by_time else {'id': last.id}
+            next_positions[device_id] = position
+            result[device_id] = dict(map(self._serialise, device_items))
+
+        return result, encode_cursor({'devices': next_positions}) if has_more else None
+
+    def iter_data(self, log_id: int, last_time: str, device_id: str, data_type: str = 'values'):
+        """
+        Retrieves data from persistent storage for a specified device item by item, ordered by ID. The data are
+        read from the database in chunks of DATA_STREAM_CHUNK_SIZE items, so the whole result is never held in memory.
+
+        The parameters have the same meaning as in get_data.
+
+        :return: a generator of dictionaries with the data from persistent storage, including their 'id'
+                 and archived values
+        """
+        cls = Value if data_type == 'values' else Event
+        if last_time is None and log_id is None:
+            log_id = self.last_seen_id[data_type].get(device_id, 0)
+        archived = self._archived_values(device_id, log_id, last_time) if cls is Value else []
+        archived.sort(key=attrgetter('id'))
+
+        with session_scope():
+            chunk_size = current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)
+            query = self._data_query(cls, log_id, last_time, device_id, data_type).order_by(cls.id)
+            last_id = None
+            # a value both archived and stored (if its archiving was interrupted) is retrieved once
+            for obj in heapq.merge(query.yield_per(chunk_size), archived, key=attrgetter('id')):
+                if obj.id == last_id:
+                    continue
+                last_id, row = self._serialise(obj)
+                row['id'] = last_id
+                yield row
+
+    def get_data_page(self, log_id: int, last_time: str, device_id: str, data_type: str = 'values',
+                      limit: int = None, cursor: str = None) -> (dict, str):
+        """
+        Retrieves a limited amount of data from persistent storage for a specified device, ordered by ID or by time
+        if the last_time parameter is not None. The following data are retrieved by passing the returned cursor.
+
+        :param log_id: ID of the log item to retrieve. Is ignored if the last_time or cursor parameter is not None.
+        :param last_time: The timestamp in format <YYYYmmddHHMMSSfff>. Data from before this time will be excluded
+                          from the response. Is ignored if the cursor parameter is not None.
+        :param device_id: device ID of the device
+        :param data_type: defines the type of data to retrieve, defaults to 'values'
+        :param limit: maximal number of items to retrieve, defaults to (and is capped by) DATA_PAGE_SIZE_MAX
+        :param cursor: the cursor returned with the previous data
+        :return: a dictionary with the data from persistent storage, including archived values, and the cursor
+                 to the following data, None if there are no more data
+        """
+        cls = Value if data_type == 'values' else Event
+
+        max_limit = current_app.config.get('DATA_PAGE_SIZE_MAX', 10000)
+        limit = max_limit if limit is None else min(limit, max_limit)
+        if limit < 1:
+            raise SyntaxError("Invalid limit has been provided: {}".format(limit))
+
+        if cursor is not None:
+            position = decode_cursor(cursor)
+        elif last_time is not None:
+            position = {'time': time_to_string(last_time), 'id': None}
+        else:
+            position = {'id': self.last_seen_id[data_type].get(device_id, 0) if log_id is None else log_id}
+
+        with session_scope():
+            query = cls.query.filter_by(dev_id=device_id)
+            if 'time' in position:
+                position_time = time_from_string(position['time'])
+                if position['id'] is None:
+                    query = query.filter(cls.time > position_time)
+                else:
+                    query = query.filter(cls.time >= position_time,
+                                         or_(cls.time > position_time, cls.id > position['id']))
+                query = query.order_by(cls.time, cls.id)
+            else:
+                query = query.filter(cls.id > position['id']).order_by(cls.id)
+
+            items = query.limit(limit + 1).all()
+
+        if cls is Value:
+            items = self._merge_archived_page(items, device_id, position, limit + 1)
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            if 'time' in position:
+                next_cursor = encode_cursor({'time': time_to_string(last.time), 'id': last.id})
+            else:
+                next_cursor = encode_cursor({'id': last.id})
+
+        return self._post_process(items, data_type, device_id), next_cursor
+
+    def _merge_archived_page(self, items, device_id, position, count, until=None, variables=None) -> list:
+        """
+        Merges archived values following the position of a page into the stored values of the page,
+        keeping the order of the page and at most the given number of values, optionally limited by the time
+        until (included) and variables.
+        """
+        if 'time' in position:
+            position_time = time_from_string(position['time'])
+            rows = self.archive.read(device_id, variables, position_time, until)
+            if position['id'] is None:
+                rows = [row for row in rows if row['time'] > position_time]
+            else:
+                rows = [row for row in rows if (row['time'], row['id']) > (position_time, position['id'])]
+            key = attrgetter('time', 'id')
+        else:
+            rows = [row for row in self.archive.read(device_id, variables, None, until, position['id'])
+                    if row['id'] > position['id']]
+            key = attrgetter('id')
+        rows = [row for row in rows if (until is None or row['time'] <= until)
+                and (not variables or row['var_id'] in variables)]
+
+        # a value both archived and stored (if its archiving was interrupted) is retrieved once
+        stored_ids = {item.id for item in items}
+        archived = [Value(**row) for row in rows if row['id'] not in stored_ids]
+        if not archived:
+            return items
+        return sorted(items + archived, key=key)[:count]
+
+    def wait_for_data(self, device_id: str, data_type: str = 'values', log_id: int = None, cursor: str = None,
+                      timeout: float = None, limit: int = None) -> (dict, str):
+        """
+        Retrieves data of a specified device newer than the given position, waiting until such data are stored
+        if there are none yet. Waiting does not query persistent storage. At most DATA_WAIT_MAX_REQUESTS requests
+        wait at once, the others are refused by BusyError.
+
+        :param device_id: device ID of the device
+        :param data_type: defines the type of data to retrieve, defaults to 'values'
+        :param log_id: ID of the last known log item, is ignored if the cursor parameter is not None.
+                       Defaults to the newest stored item, i.e. only data stored from now on are retrieved.
+        :param cursor: the cursor returned with the previous data, ordered by ID
+        :param timeout: maximal waiting time in seconds, defaults to (and is capped by) DATA_WAIT_TIMEOUT_MAX
+        :param limit: maximal number of items to retrieve, see get_data_page
+        :return: a dictionary with the data, empty if the timeout expired, and the cursor to the following data
+        """
+        cls = Value if data_type == 'values' else Event
+        data_type = 'values' if data_type == 'values' else 'events'
+
+        max_timeout = current_app.config.get('DATA_WAIT_TIMEOUT_MAX', 30)
+        timeout = max_timeout if timeout is None else min(max(timeout, 0), max_timeout)
+
+        def load_newest_id():
+            with session_scope():
+                newest_id = db.session.query(func.max(cls.id)).filter(cls.dev_id == device_id).scalar()
+            if cls is Value:
+                return max(newest_id or 0, self.archive.newest_id(device_id) or 0)
+            return newest_id
+
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            if 'id' not in position or 'time' in position:
+                raise SyntaxError("Only cursors ordered by ID can be waited for: {}".format(cursor))
+            log_id = position['id']
+
+        if not self.waiting_requests.acquire(blocking=False):
+            raise BusyError("Too many requests are waiting for data, try again later")
+        try:
+            newest_id = self.notifier.watermark(data_type, device_id, load_newest_id)
             if log_id is None:
-                log_id = self.last_seen_id[data_type].get(device_id, 0)
-            from main import app
-            with app.app_context():
-                return self._post_process(cls.query.filter_by(dev_id=device_id).filter(cls.id > log_id).all(),
-                                          data_type, device_id)
+                log_id = newest_id
+            if not self.notifier.wait(data_type, device_id, log_id, timeout):
+                return {}, encode_cursor({'id': log_id})
+        finally:
+            self.waiting_requests.release()
+        data, next_cursor = self.get_data_page(log_id, None, device_id, data_type, limit)
+        return data, next_cursor or encode_cursor({'id': max(map(int, data), default=log_id)})
+
+    def stream_data(self, device_id: str, data_types=('values', 'events')):
+        """
+        Subscribes to data of a specified device saved from now on. Up to DATA_STREAM_BUFFER_SIZE messages are
+        buffered for a slow consumer, then they are replaced by a 'resync' message. At most
+        DATA_STREAM_MAX_SUBSCRIBERS streams are open at once, the others are refused by BusyError, and every
+        stream ends after DATA_STREAM_LIFETIME seconds, the client has to subscribe again.
+
+        :param device_id: device ID of the device
+        :param data_types: types of data to receive
+        :return: an iterator of lists of messages (data type, JSON encoded data), None every DATA_STREAM_HEARTBEAT
+                 seconds without data. It has to be closed if it is not iterated to the end.
+        """
+        if not self.open_streams.acquire(blocking=False):
+            raise BusyError("Too many streams of data are open, try again later")
+        subscription = self.broadcaster.subscribe(device_id, data_types,
+                                                  current_app.config.get('DATA_STREAM_BUFFER_SIZE', 1000))
+
+        def close():
+            self.broadcaster.unsubscribe(subscription)
+            self.open_streams.release()
+
+        return Stream(subscription, current_app.config.get('DATA_STREAM_HEARTBEAT', 15),
+                      current_app.config.get('DATA_STREAM_LIFETIME', 3600), close)
+
+    def export_values(self, device_id: str, start=None, until=None, variables: list = None) -> dict:
+        """
+        Retrieves values of a specified device as typed arrays, one set of arrays per variable:
+
+        - '<variable>/time': int64 - time in microseconds since the Unix epoch (UTC),
+        - '<variable>/value': float64 - the value,
+        - '<variable>/attribute': int64 - the attribute, -1 if the value has none
+
+        :param device_id: device ID of the device
+        :param start: values from before this time will be excluded, defaults to no limit
+        :param until: values from this time on will be excluded, defaults to no limit
+        :param variables: IDs of variables to export, defaults to all variables
+        :return: a dictionary {name: array} ordered by variable and time, including archived values
+        """
+        archived = [row for row in self.archive.read(device_id, variables, start, until)
+                    if (start is None or row['time'] >= start) and (until is None or row['time'] < until)]
+        if archived:
+            return self._export_merged(device_id, start, until, variables, archived)
+
+        columns = {}
+
+        with session_scope():
+            query = db.session.query(Value.var_id, Value.time, Value.value, Value.attribute) \
+                .filter(Value.dev_id == device_id)
+            if start is not None:
+                query = query.filter(Value.time >= start)
+            if until is not None:
+                query = query.filter(Value.time < until)
+            if variables:
+                query = query.filter(Value.var_id.in_(variables))
+            query = query.order_by(Value.var_id, Value.time)
+
+            chunk_size = current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)
+            current_var_id = None
+            for var_id, value_time, value, attribute in query.yield_per(chunk_size):
+                if var_id != current_var_id:
+                    current_var_id = var_id
+                    times, values, attributes = array('q'), array('d'), array('q')
+                    columns[var_id + '/time'] = times
+                    columns[var_id + '/value'] = values
+                    columns[var_id + '/attribute'] = attributes
+                times.append(time_to_microseconds(value_time))
+                values.append(value)
+                attributes.append(-1 if attribute is None else attribute)
+
+        return columns
+
+    def _export_merged(self, device_id, start, until, variables, archived) -> dict:
+        """
+        Exports stored and archived values together. A value both archived and stored (if its archiving was
+        interrupted) is exported once.
+        """
+        rows = {row['id']: row for row in archived}
+        with session_scope():
+            query = db.session.query(Value.id, Value.var_id, Value.time, Value.value, Value.attribute) \
+                .filter(Value.dev_id == device_id)
+            if start is not None:
+                query = query.filter(Value.time >= start)
+            if until is not None:
+                query = query.filter(Value.time < until)
+            if variables:
+                query = query.filter(Value.var_id.in_(variables))
+            for row in query.yield_per(current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)):
+                rows[row.id] = row._asdict()
+
+        columns = {}
+        for row in sorted(rows.values(), key=lambda row: (row['var_id'], row['time'], row['id'])):
+            if row['var_id'] + '/time' not in columns:
+                for name, typecode in [('/time', 'q'), ('/value', 'd'), ('/attribute', 'q')]:
+                    columns[row['var_id'] + name] = array(typecode)
+            columns[row['var_id'] + '/time'].append(time_to_microseconds(row['time']))
+            columns[row['var_id'] + '/value'].append(row['value'])
+            columns[row['var_id'] + '/attribute'].append(-1 if row['attribute'] is None else row['attribute'])
+        return columns
+
+    def get_aggregated_data(self, device_id: str, bucket: int, start=None, until=None,
+                            variables: list = None) -> dict:
+        """
+        Aggregates values of a specified device into time buckets of given width. Buckets are aligned to the Unix
+        epoch and computed separately for each variable and attribute.
+
+        Each bucket contains 'time' (start of the bucket), 'attribute', 'count', 'min', 'max', 'mean' and 'last'
+        (the newest value in the bucket).
+
+        If the width of the bucket and the bounds of the range are whole minutes or hours, the buckets are merged
+        from the rollup tables instead of the raw values.
+
+        :param device_id: device ID of the device
+        :param bucket: width of a bucket in seconds
+        :param start: values from before this time will be excluded, defaults to no limit
+        :param until: values from this time on will be excluded, defaults to no limit
+        :param variables: IDs of variables to aggregate, defaults to all variables
+        :return: a dictionary {variable: list of buckets ordered by attribute and time}, including archived values
+        """
+        if bucket < 1:
+            raise SyntaxError("Invalid bucket width has been provided: {}".format(bucket))
+
+        for cls in ROLLUP_MODELS:
+            if bucket % cls.width == 0 and all(bound is None or bucket_start(bound, cls.width) == bound
+                                               for bound in (start, until)):
+                return self._aggregate_rollups(cls, device_id, bucket, start, until, variables)
+
+        with session_scope():
+            bucket_id = func.timestampdiff(literal_column('SECOND'), literal(EPOCH), Value.time).op('DIV')(bucket)
+            query = db.session.query(Value.var_id, Value.attribute, bucket_id.label('bucket'),
+                                     func.count(Value.id).label('count'), func.min(Value.value).label('min'),
+                                     func.max(Value.value).label('max'), func.sum(Value.value).label('sum'),
+                                     func.max(Value.time).label('last_time')) \
+                .filter(Value.dev_id == device_id)
+            if start is not None:
+                query = query.filter(Value.time >= start)
+            if until is not None:
+                query = query.filter(Value.time < until)
+            if variables:
+                query = query.filter(Value.var_id.in_(variables))
+            buckets = query.group_by(Value.var_id, Value.attribute, literal_column('bucket')).subquery()
+
+            # the last value of a bucket is the one at its latest time
+            rows = db.session.query(buckets, Value.value) \
+                .join(Value, and_(Value.dev_id == device_id, Value.var_id == buckets.c.var_id,
+                                  Value.time == buckets.c.last_time,
+                                  Value.attribute.isnot_distinct_from(buckets.c.attribute))) \
+                .all()
+
+        aggregated = {}
+        for row in rows:
+            attribute = NO_ATTRIBUTE if row.attribute is None else row.attribute
+            key = (row.var_id, attribute, EPOCH + timedelta(seconds=row.bucket * bucket))
+            # if more values share the latest time of the bucket, the first one is the last value
+            aggregated.setdefault(key, {'count': row.count, 'sum': float(row.sum), 'min': row.min, 'max': row.max,
+                                        'last': row.value, 'last_time': row.last_time})
+
+        archived = [row for row in self.archive.read(device_id, variables, start, until)
+                    if (start is None or row['time'] >= start) and (until is None or row['time'] < until)]
+        for (_, var_id, attribute, bucket_time), aggregates in aggregate(archived, bucket).items():
+            key = (var_id, attribute, bucket_time)
+            if key in aggregated:
+                merge(aggregated[key], aggregates)
+            else:
+                aggregated[key] = aggregates
 
-    def get_latest_data(self, device_id, data_type: str = 'values') -> dict:
+        return self._bucket_result(sorted(aggregated.items(), key=itemgetter(0)))
+
+    def _aggregate_rollups(self, cls, device_id, bucket, start, until, variables):
+        with session_scope():
+            query = cls.query.filter(cls.dev_id == device_id)
+            if start is not None:
+                query = query.filter(cls.time >= start)
+            if until is not None:
+                query = query.filter(cls.time < until)
+            if variables:
+                query = query.filter(cls.var_id.in_(variables))
+            query = query.order_by(cls.var_id, cls.attribute, cls.time)
+
+            merged = []
+            for rollup in query.yield_per(current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)):
+                key = (rollup.var_id, rollup.attribute, bucket_start(rollup.time, bucket))
+                aggregates = {column: getattr(rollup, column) for column in ROLLUP_AGGREGATES}
+                if merged and merged[-1][0] == key:
+                    merge(merged[-1][1], aggregates)
+                else:
+                    merged.append((key, aggregates))
+
+        return self._bucket_result(merged)
+
+    @staticmethod
+    def _bucket_result(buckets) -> dict:
+        """
+        :param buckets: list of pairs ((variable, attribute, start of the bucket), aggregates), ordered by the key
+        :return: a dictionary {variable: list of buckets}, see get_aggregated_data
+        """
+        result = {}
+        for (var_id, attribute, bucket_time), aggregates in buckets:
+            result.setdefault(var_id, []).append({
+                'time': time_to_string(bucket_time), 'attribute': None if attribute == NO_ATTRIBUTE else attribute,
+                'count': aggregates['count'], 'min': aggregates['min'], 'max': aggregates['max'],
+                'mean': aggregates['sum'] / aggregates['count'], 'last': aggregates['last']})
+        return result
+
+    def _rollup_windows(self, start, until):
+        """
+        Splits the range of values into windows of ROLLUP_WINDOW seconds aligned to the widest rollup bucket.
+        """
+        width = ROLLUP_MODELS[0].width
+        if start is None:
+            start = db.session.query(func.min(Value.time)).scalar()
+            if start is None:
+                return
+        if until is None:
+            until = time.now()
+        start = bucket_start(start, width)
+        until = bucket_start(until, width)
+        window = timedelta(seconds=current_app.config.get('ROLLUP_WINDOW', 86400))
+        while start < until:
+            yield start, min(start + window, until)
+            start += window
+
+    def _iter_value_rows(self, window_start, window_end, chunk_size):
+        """
+        Reads raw values in the range [window_start, window_end) in chunks of rows for the rollups,
+        the archived values first.
+        """
+        for device_id in self.archive.devices():
+            rows = [{column: row[column] for column in ('dev_id', 'var_id', 'attribute', 'time', 'value')}
+                    for row in self.archive.read(device_id, start=window_start, until=window_end)
+                    if window_start <= row['time'] < window_end]
+            for i in range(0, len(rows), chunk_size):
+                yield rows[i:i + chunk_size]
+
+        query = db.session.query(Value.dev_id, Value.var_id, Value.attribute, Value.time, Value.value) \
+            .filter(Value.time >= window_start, Value.time < window_end)
+        chunk = []
+        for row in query.yield_per(chunk_size):
+            chunk.append(row._asdict())
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def rebuild_rollups(self, start=None, until=None) -> int:
+        """
+        Recomputes the rollup tables from the raw values. The range is processed in windows of ROLLUP_WINDOW
+        seconds, each in its own transaction, and its bounds are rounded down to whole hours.
+
+        :param start: start of the range, defaults to the time of the oldest value
+        :param until: end of the range (excluded), defaults to the current time
+        :return: number of processed values
+        """
+        count = 0
+        with session_scope():
+            chunk_size = current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)
+            for window_start, window_end in self._rollup_windows(start, until):
+                for cls in ROLLUP_MODELS:
+                    cls.query.filter(cls.time >= window_start, cls.time < window_end) \
+                        .delete(synchronize_session=False)
+                for rows in self._iter_value_rows(window_start, window_end, chunk_size):
+                    self._update_rollups(rows)
+                    count += len(rows)
+                db.session.commit()
+        return count
+
+    def check_rollups(self, start=None, until=None) -> list:
+        """
+        Compares the rollup tables with aggregates of the raw values. The range is processed the same way as
+        in rebuild_rollups.
+
+        :param start: start of the range, defaults to the time of the oldest value
+        :param until: end of the range (excluded), defaults to the current time
+        :return: list of inconsistent buckets, each a dictionary with the table, key of the bucket and both counts
+        """
+        mismatches = []
+        with session_scope():
+            chunk_size = current_app.config.get('DATA_STREAM_CHUNK_SIZE', 1000)
+            for window_start, window_end in self._rollup_windows(start, until):
+                expected = {cls: {} for cls in ROLLUP_MODELS}
+                for rows in self._iter_value_rows(window_start, window_end, chunk_size):
+                    for cls in ROLLUP_MODELS:
+                        for key, aggregates in aggregate(rows, cls.width).items():
+                            if key in expected[cls]:
+                                merge(expected[cls][key], aggregates)
+                            else:
+                                expected[cls][key] = aggregates
+
+                for cls in ROLLUP_MODELS:
+                    actual = {tuple(getattr(rollup, column) for column in ROLLUP_KEY): rollup for rollup in
+                              cls.query.filter(cls.time >= window_start, cls.time < window_end)}
+                    for key in sorted(set(expected[cls]) | set(actual)):
+                        aggregates, rollup = expected[cls].get(key), actual.get(key)
+                        if aggregates is not None and rollup is not None and rollup.count == aggregates['count'] \
+                                and isclose(rollup.sum, aggregates['sum'], rel_tol=1e-9, abs_tol=1e-6) \
+                                and rollup.min == aggregates['min'] and rollup.max == aggregates['max']:
+                            continue
+                        mismatches.append({'table': cls.__tablename__, 'dev_id': key[0], 'var_id': key[1],
+                                           'attribute': None if key[2] == NO_ATTRIBUTE else key[2],
+                                           'time': time_to_string(key[3]),
+                                           'expected': 0 if aggregates is None else aggregates['count'],
+                                           'actual': 0 if rollup is None else rollup.count})
+        return mismatches
+
+    def archive_values(self, until=None, experiment_id: int = None) -> int:
+        """
+        Moves values from the database into the compressed archive, in chunks of up to ARCHIVE_CHUNK_SIZE values
+        of a variable, each in its own transaction. The archived values remain available from get_data,
+        get_data_page, iter_data, export_values, get_aggregated_data and the rollups.
+
+        :param until: values before this time are archived
+        :param experiment_id: values of this finished experiment are archived (if until is not given)
+        :return: number of archived values
+        """
+        count = 0
+        with session_scope():
+            if until is not None:
+                filters = [Value.time < until]
+            elif experiment_id is not None:
+                experiment = Experiment.query.filter_by(id=experiment_id).first()
+                if experiment is None:
+                    raise IdError("Experiment with given ID: {} was not found".format(experiment_id))
+                if experiment.end is None:
+                    raise SyntaxError("Experiment {} has not finished yet".format(experiment_id))
+                filters = [Value.dev_id == experiment.dev_id, Value.time >= experiment.start,
+                           Value.time <= experiment.end]
+            else:
+                raise SyntaxError("Either the time or the experiment of values to archive must be given")
+
+            chunk_size = current_app.config.get('ARCHIVE_CHUNK_SIZE', 10000)
+            for device_id, var_id in db.session.query(Value.dev_id, Value.var_id).filter(*filters).distinct().all():
+                while True:
+                    rows = [row._asdict() for row in
+                            db.session.query(Value.id, Value.time, Value.value, Value.attribute, Value.note)
+                                .filter(*filters, Value.dev_id == device_id, Value.var_id == var_id)
+                                .order_by(Value.time, Value.id).limit(chunk_size)]
+                    if not rows:
+                        break
+                    chunk = self.archive.write(device_id, var_id, rows)
+                    try:
+                        Value.query.filter(Value.id.in_([row['id'] for row in rows]),
+                                           Value.time.between(rows[0]['time'], rows[-1]['time'])) \
+                            .delete(synchronize_session=False)
+                        db.session.commit()
+                    except Exception:
+                        self.archive.remove(chunk)
+                        raise
+                    self.query_cache.invalidate([device_id])
+                    self.latest['values'].invalidate(device_id)
+                    count += len(rows)
+        return count
+
+    def maintain_partitions(self, now=None) -> dict:
+        """
+        Creates monthly partitions of the values and events tables for PARTITION_PREMAKE_MONTHS months ahead and
+        removes the partitions of months before the last PARTITION_RETENTION_MONTHS months, if it is set. Removed
+        partitions are dropped, or detached into tables '<table>_<partition>' if PARTITION_RETENTION_ACTION is
+        'detach'. Tables which are not partitioned are skipped. Cached data of the devices with removed data
+        are invalidated.
+
+        :param now: current time, defaults to now
+        :return: a dictionary {table: {'created': names of partitions, 'removed': names of partitions}}
+        """
+        result = {}
+        affected = {}  # {data type: IDs of devices with removed data}
+        with session_scope():
+            current_month = month_start(now or time.now())
+            premake = current_app.config.get('PARTITION_PREMAKE_MONTHS', 3)
+            retention = current_app.config.get('PARTITION_RETENTION_MONTHS', None)
+            action = current_app.config.get('PARTITION_RETENTION_ACTION', 'drop')
+
+            for table in PARTITIONED_TABLES:
+                names = [name for name, in db.session.execute(
+                    text("SELECT partition_name FROM information_schema.partitions WHERE table_schema = DATABASE() "
+                         "AND table_name = :table AND partition_name IS NOT NULL "
+                         "ORDER BY partition_ordinal_position"), {'table': table})]
+                if MAX_PARTITION not in names:
+                    continue
+                months = [partition_start(name) for name in names if name != MAX_PARTITION]
+
+                # splitting the last partition copies only its rows, i.e. values dated beyond the premade months,
+                # of which there are normally none
+                starts = []
+                start = month_start(months[-1], 1) if months else current_month
+                while start <= month_start(current_month, premake):
+                    starts.append(start)
+                    start = month_start(start, 1)
+                if starts:
+                    db.session.execute(text('ALTER TABLE `{}` REORGANIZE PARTITION {} INTO ({})'.format(
+                        table, MAX_PARTITION, partition_definitions(starts))))
+
+                removed = []
+                if retention is not None:
+                    cls = Value if table == Value.__tablename__ else Event
+                    for start in months:
+                        if start >= month_start(current_month, -retention):
+                            break
+                        name = partition_name(start)
+                        affected.setdefault(table, set()).update(
+                            device_id for device_id, in db.session.query(cls.dev_id).filter(
+                                cls.time >= start, cls.time < month_start(start, 1)).distinct())
+                        if action == 'detach':
+                            detached = '{}_{}'.format(table, name)
+                            db.session.execute(text('CREATE TABLE `{}` LIKE `{}`'.format(detached, table)))
+                            db.session.execute(text('ALTER TABLE `{}` REMOVE PARTITIONING'.format(detached)))
+                            db.session.execute(text('ALTER TABLE `{}` EXCHANGE PARTITION {} WITH TABLE `{}`'.format(
+                                table, name, detached)))
+                        db.session.execute(text('ALTER TABLE `{}` DROP PARTITION {}'.format(table, name)))
+                        removed.append(name)
+
+                result[table] = {'created': [partition_name(start) for start in starts], 'removed': removed}
+
+        self.query_cache.invalidate(set().union(*affected.values()))
+        for data_type, device_ids in affected.items():
+            for device_id in device_ids:
+                self.latest[data_type].invalidate(device_id)
+        return result
+
+    def get_experiment(self, experiment_id: int) -> Experiment:
+        """
+        Retrieves an Experiment object from persistent storage.
+
+        :param experiment_id: ID of the experiment
+        :return: the experiment, None if it does not exist
+        """
+        with session_scope():
+            return Experiment.query.filter_by(id=experiment_id).first()
+
+    @staticmethod
+    def _load_latest_rows(device_id, data_type):
+        if data_type == 'values':
+            newest = db.session.query(func.max(Value.id).label('id')) \
+                .filter(Value.dev_id == device_id) \
+                .group_by(Value.var_id, Value.attribute) \
+                .subquery()
+            items = Value.query.join(newest, Value.id == newest.c.id).order_by(Value.id).all()
+        else:
+            items = Event.query.filter_by(dev_id=device_id).order_by(Event.id.desc()).limit(1).all()
+        for item in items:
+            row = {column.key: getattr(item, column.key) for column in item.__table__.columns}
+            yield ((item.var_id, item.attribute) if data_type == 'values' else None), row
+
+    def load_latest_data(self, device_id=None):
+        """
+        Loads the newest data from persistent storage into memory, so get_latest_data does not have to query it.
+
+        :param device_id: device ID of the device, defaults to all devices with an unfinished experiment
+        """
+        with session_scope():
+            if device_id is None:
+                device_ids = [row.dev_id for row in
+                              db.session.query(Experiment.dev_id).filter(Experiment.end.is_(None)).distinct()]
+            else:
+                device_ids = [device_id]
+            for device_id in device_ids:
+                for data_type, cache in self.latest.items():
+                    cache.load(device_id, list(self._load_latest_rows(device_id, data_type)))
+
+    def get_events(self, device_id: str, event_types: list = None, commands: list = None, start=None,
+                   until=None) -> dict:
         """
-        Retrieves the data with the newest time for a specified device.
+        Retrieves events of a specified device filtered by their types, commands and time.
+
+        :param device_id: device ID of the device
+        :param event_types: types of the events (see EVENT_TYPES), defaults to all types
+        :param commands: IDs of the commands of the events, defaults to all commands
+        :param start: events from before this time will be excluded, defaults to no limit
+        :param until: events from this time on will be excluded, defaults to no limit
+        :return: a dictionary {log_id: event} ordered by time
+        """
+        with session_scope():
+            query = Event.query.filter(Event.dev_id == device_id)
+            if event_types:
+                query = query.filter(Event.event_type.in_(event_types))
+            if commands:
+                query = query.filter(Event.command.in_(commands))
+            if start is not None:
+                query = query.filter(Event.time >= start)
+            if until is not None:
+                query = query.filter(Event.time < until)
+            return dict(map(self._serialise, query.order_by(Event.time, Event.id)))
+
+    def get_latest_data(self, device_id, data_type: str = 'values', per_variable: bool = False,
+                        variables: list = None):
+        """
+        Retrieves the most recently stored data of a specified device. The data are kept in memory and updated
+        whenever data are stored, persistent storage is queried only for the first request of a device which was
+        not loaded by load_latest_data. The ID is known only for data loaded from persistent storage.
 
         :param device_id: device ID of the device
         :param data_type: defines the type of data to retrieve, defaults to 'values'
-        :return: a dictionary with the data from persistent storage
+        :param per_variable: if True, the newest value of every variable and attribute is retrieved (values only)
+        :param variables: IDs of variables to retrieve if per_variable is True, defaults to all variables
+        :return: the Value or Event, None if there are none. If per_variable is True,
+                 a dictionary {variable: list of dictionaries with the values ordered by attribute}
         """
         cls = Value if data_type == 'values' else Event
+        cache = self.latest['values' if data_type == 'values' else 'events']
+        if not cache.is_loaded(device_id):
+            self.load_latest_data(device_id)
+
+        if not per_variable or data_type != 'values':
+            row = cache.latest(device_id)
+            return None if row is None else cls(**row)
 
-        from main import app
-        with app.app_context():
-            return cls.query.filter_by(dev_id=device_id).order_by(cls.id.desc()).first()
+        result = {}
+        for (var_id, attribute), row in sorted(cache.rows(device_id),
+                                               key=lambda item: (item[0][0], NO_ATTRIBUTE if item[0][1] is None
+                                                                 else item[0][1])):
+            if not variables or var_id in variables:
+                result.setdefault(var_id, []).append(dict(row, time=time_to_string(row['time'])))
+        return result
 
     def event_task_start(self, config: dict):
         """
@@ -205,8 +1383,8 @@ class DataManager:
         args = {'task_class': config['task_class'],
                 'task_id': config['task_id'],
                 'task_type': config['task_type']}
-        event = Event(dev_id=config['device_id'], event_type=3, time=time.now(), args=str(args),
-                      command='start task', response=str(True))
+        event = Event(dev_id=config['device_id'], event_type=3, time=time.now(), args=args,
+                      command='start task', response=True)
         self.save_event(event)
 
     def event_task_end(self, device_id, task_id):
@@ -216,8 +1394,8 @@ class DataManager:
         :param device_id: ID of the device to which the task corresponds
         :param task_id: ID of the task to end
         """
-        event = Event(dev_id=device_id, event_type=4, time=time.now(), args=str(task_id),
-                      command='end task', response=str(True))
+        event = Event(dev_id=device_id, event_type=4, time=time.now(), args=task_id,
+                      command='end task', response=True)
         self.save_event(event)
 
     def event_device_start(self, config):
@@ -233,8 +1411,8 @@ class DataManager:
 
         :param config: A dictionary with the specified extra parameters
         """
-        event = Event(dev_id=config['device_id'], event_type=3, time=time.now(), args=str(config),
-                      command='start device', response=str(True))
+        event = Event(dev_id=config['device_id'], event_type=3, time=time.now(), args=config,
+                      command='start device', response=True)
         self.save_event(event)
 
     def event_device_end(self, device_id):
@@ -243,8 +1421,8 @@ class DataManager:
 
         :param device_id: ID of the device to end
         """
-        event = Event(dev_id=device_id, event_type=4, time=time.now(), args=str(device_id),
-                      command='end device', response=str(True))
+        event = Event(dev_id=device_id, event_type=4, time=time.now(), args=device_id,
+                      command='end device', response=True)
         self.save_event(event)
 
     def store_log(self, init_type, config):
@@ -275,5 +1453,5 @@ class DataManager:
         """
         Retrieves all log entries.
         """
-        with db.app.app_context():
+        with session_scope():
             return Log.query.all()
@@ -78,6 +78,18 @@ class DeviceManager:
 
         return result
 
+    def command_stats(self) -> Dict[str, dict]:
+        """
+        Statistics of the command queue of each existing device.
+
+        :return: A dictionary {"device_id": {"queued": number of queued commands,
+                 "saved_calls": number of reads answered by an identical queued read,
+                 "fused_commands": number of reads answered by composite commands}}
+        """
+        return {key: {'queued': len(device._queue), 'saved_calls': device.saved_calls,
+                      'fused_commands': device.fused_commands}
+                for key, device in self._devices.items()}
+
     @staticmethod
     def _load_class(device_class: str, device_type: str) -> Connector.__class__:
         return classes[device_class][device_type]
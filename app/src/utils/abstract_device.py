@@ -1,8 +1,12 @@
+import heapq
 import sys
 from abc import abstractmethod
-from threading import Thread
+from copy import copy
+from itertools import count
+from threading import Condition, Lock, Thread, current_thread
+from typing import Callable, Dict, Optional, Tuple
 
-from .workflow import Job, WorkflowProvider
+from .workflow import Job, Scheduler, WorkflowProvider
 from . import Log
 from .AbstractClass import abstractattribute, Interface
 
@@ -16,18 +20,34 @@ class Connector(metaclass=Interface):
     """
     def __init__(self, config: dict):
         self.setup = {}
-        self.scheduler = WorkflowProvider().scheduler
 
         self.config = config
         self.__dict__.update(config)
 
         self.is_alive = True
-        self._is_queue_check_running = False
         self._queue = PriorityQueue()
+        # IDs of commands which only read from the device, identical queued reads are executed only once
+        self.idempotent_commands = set()
+        self._pending_reads = {}  # {(command ID, arguments): {priority: queued command}}
+        self._coalesced = {}  # {queued command: [identical commands waiting for its response]}
+        self.saved_calls = 0
+        # commands answering several reads at once (see CompositeCommand), queued reads are fused into them
+        self.composite_commands = []
+        self.fused_commands = 0
+        # a single worker thread executes the queued commands, it is started by the first posted command
+        self._queue_condition = Condition()
+        self._worker = None
 
     def __eq__(self, other):
         return self.config == other.config
 
+    @property
+    def scheduler(self) -> Scheduler:
+        """
+        The scheduler shared by all devices.
+        """
+        return WorkflowProvider().scheduler
+
     def validate_attributes(self, required, class_name):
         for att in required:
             if att not in self.__dict__.keys():
@@ -98,11 +118,7 @@ class Connector(metaclass=Interface):
         :param priority: Priority in which the orders will execute.
                          Commands with same priority will exeute in the order they were queued for execution.
         """
-        cmd.device_id = self.device_id
-        self._queue.put(cmd, priority)
-        if not self._is_queue_check_running:
-            t = Thread(target=self._queue_new_item)
-            t.start()
+        self._enqueue(cmd, priority)
 
     def post_manual_command(self, cmd, priority=0):
         """
@@ -111,21 +127,122 @@ class Connector(metaclass=Interface):
         :param cmd: command object
         :param priority: priority the command should take over other commands
         """
-        cmd.device_id = self.device_id
-        self._queue.put(cmd, priority)
-        if not self._is_queue_check_running:
-            t = Thread(target=self._queue_new_item)
-            t.start()
+        self._enqueue(cmd, priority)
         cmd.await_cmd()
         cmd.save_command_to_db()
 
-    def _queue_new_item(self):
-        self._is_queue_check_running = True
-        while self._queue.has_items():
-            self._execute_command(self._queue.get())
-        self._is_queue_check_running = False
+    def post_commands(self, cmds, priority=2):
+        """
+        Queues several commands for execution at once, so that they can be fused into a composite command.
+
+        :param cmds: list of command objects
+        :param priority: Priority in which the orders will execute.
+        """
+        with self._queue_condition:
+            for cmd in cmds:
+                self._enqueue(cmd, priority)
+
+    def _enqueue(self, cmd, priority):
+        cmd.device_id = self.device_id
+        with self._queue_condition:
+            if not self.is_alive:
+                self._reject_command(cmd)
+                return
+            if self._coalesce(cmd, priority):
+                return
+            if self._read_key(cmd) is None:
+                # reads queued before a command which may change the device must not answer later reads
+                self._pending_reads.clear()
+            self._queue.put(cmd, priority)
+            if self._worker is None:
+                self._worker = Thread(target=self._process_queue, name="{} command worker".format(self.device_id),
+                                      daemon=True)
+                self._worker.start()
+            self._queue_condition.notify()
+
+    def _process_queue(self):
+        """
+        Executes the queued commands one by one until the device is terminated.
+        """
+        while True:
+            with self._queue_condition:
+                while self.is_alive and not self._queue.has_items():
+                    self._queue_condition.wait()
+                if not self.is_alive:
+                    return
+                cmd = self._queue.get()
+                coalesced = self._take_coalesced(cmd)
+                composite, fused = self._fuse(cmd)
+            if composite is None:
+                self._execute_command(cmd, coalesced)
+            else:
+                self._execute_composite(composite, [(cmd, coalesced)] + fused)
+
+    def _read_key(self, cmd):
+        if cmd.command_id not in self.idempotent_commands:
+            return None
+        return cmd.command_id, repr(cmd.args)
+
+    def _coalesce(self, cmd, priority) -> bool:
+        """
+        Attaches a read to an identical queued read with the same or a higher priority. Identical reads queued
+        with different priorities are kept apart, so a read with a higher priority does not stop the queued ones
+        with a lower priority from accepting further reads. Reads queued before a command which is not idempotent
+        accept no further reads, see _enqueue.
+
+        :return: True if the command will get the response of the queued one
+        """
+        key = self._read_key(cmd)
+        if key is None:
+            return False
+        pending = self._pending_reads.setdefault(key, {})
+        earlier = [queued_priority for queued_priority in pending if queued_priority <= priority]
+        if earlier:
+            self._coalesced.setdefault(pending[min(earlier)], []).append(cmd)
+            self.saved_calls += 1
+            return True
+        pending[priority] = cmd
+        return False
+
+    def _take_coalesced(self, cmd) -> list:
+        """
+        Stops attaching reads to a command taken from the queue, reads posted later are executed again.
+
+        :return: commands waiting for the response of the command
+        """
+        key = self._read_key(cmd)
+        pending = self._pending_reads.get(key, {})
+        for priority in [priority for priority, queued in pending.items() if queued is cmd]:
+            del pending[priority]
+        if not pending:
+            self._pending_reads.pop(key, None)
+        return self._coalesced.pop(cmd, [])
+
+    def _fuse(self, cmd):
+        """
+        Takes the queued reads which can be answered together with the command by a composite command.
+        Only the reads queued before the next command which is not a read are taken.
+
+        :return: the composite command, or None if there are too few reads to fuse,
+                 and a list of (fused command, commands waiting for its response)
+        """
+        for composite in self.composite_commands:
+            if composite.field(cmd) is None:
+                continue
+            # reads queued behind a write could observe its effect, they are not answered before it
+            fused = self._queue.take(lambda queued: composite.field(queued) is not None, composite.min_commands - 1,
+                                     barrier=lambda queued: self._read_key(queued) is None)
+            if fused:
+                self.fused_commands += len(fused) + 1
+                return composite, [(command, self._take_coalesced(command)) for command in fused]
+        return None, []
+
+    def _reject_command(self, command):
+        command.response = Exception("Device {} has been terminated".format(self.device_id))
+        command.is_valid = False
+        command.resolve()
 
-    def _execute_command(self, command):
+    def _execute_command(self, command, coalesced=()):
         try:
             validity = True
             response = self.get_command_reference(command.command_id)(*command.args)
@@ -133,19 +250,59 @@ class Connector(metaclass=Interface):
             validity = False
             response = e
 
+        self._resolve_command(command, coalesced, validity, response)
+        return command
+
+    def _execute_composite(self, composite, fused):
+        """
+        Executes a composite command and splits its response into the responses of the fused commands.
+
+        :param composite: the composite command
+        :param fused: list of (fused command, commands waiting for its response)
+        """
+        try:
+            response = self.get_command_reference(composite.command_id)(*composite.args)
+            error = None
+        except Exception as e:
+            response = {}
+            error = e
+
+        for command, coalesced in fused:
+            field = composite.field(command)
+            validity, result = response.get(field, (False, error or "Command {} did not return {}".format(
+                composite.command_id, field)))
+            if not validity and not isinstance(result, Exception):
+                result = Exception(result)
+            self._resolve_command(command, coalesced, validity, copy(result) if isinstance(result, dict) else result)
+
+    def _resolve_command(self, command, coalesced, validity, response):
         command.response = response
         command.is_valid = validity
         command.executed_on = (self.device_class, self.device_id)
+        # every command gets its own copy of the response, since saving its data modifies it
+        for other in coalesced:
+            other.response = copy(response) if isinstance(response, dict) else response
+            other.is_valid = validity
+            other.executed_on = command.executed_on
 
         command.resolve()
-        return command
+        for other in coalesced:
+            other.resolve()
 
     def end(self):
         """
         Terminates the device.
         """
-        self.scheduler.is_active = False
-        self.is_alive = False
+        with self._queue_condition:
+            self.is_alive = False
+            self._queue_condition.notify_all()
+            # commands which were not executed are resolved, so that nobody waits for them
+            while self._queue.has_items():
+                cmd = self._queue.get()
+                for command in [cmd] + self._take_coalesced(cmd):
+                    self._reject_command(command)
+        if self._worker is not None and self._worker is not current_thread():
+            self._worker.join()
         self.disconnect()
 
     def whoami(self):
@@ -162,10 +319,14 @@ class Connector(metaclass=Interface):
 
 class PriorityQueue:
     """
-    A queue in which items are processed on an order based on their priority.
+    A thread-safe queue in which items are processed on an order based on their priority, the lowest first.
+    Items with the same priority are processed in the order they were put, which is kept by their sequence numbers.
+    Both put and get take O(log n) time.
     """
     def __init__(self):
-        self._items = []
+        self._items = []  # heap of (priority, sequence number, command)
+        self._sequence = count()
+        self._lock = Lock()
 
     def put(self, command, priority: int):
         """
@@ -174,18 +335,39 @@ class PriorityQueue:
         :param command: command object
         :param priority: priority the command should take over other commands
         """
-        self._items.append((priority, command))
-        self._items.sort(key=self._sort_by_priority)
+        with self._lock:
+            heapq.heappush(self._items, (priority, next(self._sequence), command))
 
     def get(self):
         """
         Gets an element from the front of the queue.
         """
-        return self._items.pop(0)[1]
+        with self._lock:
+            return heapq.heappop(self._items)[2]
+
+    def take(self, predicate: Callable, minimum: int = 1, barrier: Callable = None) -> list:
+        """
+        Removes the commands matching a predicate from the queue, if there are at least the given number of them.
 
-    @staticmethod
-    def _sort_by_priority(elem):
-        return elem[0]
+        :param predicate: called with each queued command
+        :param minimum: the least number of matching commands
+        :param barrier: called with each queued command, only the commands queued before the first one
+                        it accepts are taken
+        :return: the removed commands in the order they would be taken, or an empty list
+        """
+        with self._lock:
+            taken = []
+            for item in sorted(self._items):
+                if barrier is not None and barrier(item[2]):
+                    break
+                if predicate(item[2]):
+                    taken.append(item)
+            if len(taken) < max(minimum, 1):
+                return []
+            sequences = {sequence for _, sequence, _ in taken}
+            self._items = [item for item in self._items if item[1] not in sequences]
+            heapq.heapify(self._items)
+        return [command for _, _, command in taken]
 
     def has_items(self):
         """
@@ -193,7 +375,53 @@ class PriorityQueue:
 
         :return: False if empty, true if not.
         """
-        return len(self._items) != 0
+        return len(self) != 0
+
+    def __len__(self):
+        """
+        :return: number of queued items
+        """
+        with self._lock:
+            return len(self._items)
 
     def __eq__(self, other):
-        return self._items == other._items
+        return [(priority, command) for priority, _, command in sorted(self._items)] == \
+            [(priority, command) for priority, _, command in sorted(other._items)]
+
+
+class CompositeCommand:
+    """
+    A command of a device which answers several reads at once, e.g. measure_all. Its response is a dictionary
+    {field: (success, response of the read or an error message)}.
+
+    Drivers declare composite commands in Connector.composite_commands. When a read answered by a composite command
+    is taken from the queue together with enough other queued reads answered by it, they are all replaced
+    by a single call of the composite command. Only a command which reads all its fields by a single transfer
+    from the device should be declared, otherwise the fused reads are merely executed in a different order.
+    E.g. measure_all of the PSI java and Phenometrics drivers issues a separate request for each field,
+    so these drivers declare no composite commands.
+    """
+    def __init__(self, command_id: str, fields: Dict[Tuple[str, tuple], str], args: list = None,
+                 min_commands: int = None):
+        """
+        :param command_id: ID of the composite command
+        :param fields: the fields of the response answering the reads {(command ID, arguments): field}
+        :param args: arguments of the composite command
+        :param min_commands: the least number of reads replaced by the composite command, defaults to the number
+                             of distinct fields (reads answered by the same field count once)
+        """
+        self.command_id = command_id
+        self.fields = fields
+        self.args = args or []
+        self.min_commands = min_commands or len(set(fields.values()))
+
+    def field(self, command) -> Optional[str]:
+        """
+        :param command: command object
+        :return: the field of the response answering the command, None if it does not answer it
+        """
+        try:
+            return self.fields.get((command.command_id, tuple(command.args)))
+        except TypeError:
+            # unhashable arguments
+            return None
@@ -0,0 +1,330 @@
+import json
+import os
+import re
+import struct
+import zlib
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import List, Optional
+
+from .time import EPOCH, time_to_microseconds, time_to_string, time_from_string
+
+# the first bytes of every chunk file, followed by the zlib compressed columns
+MAGIC = b'DCA1'
+INDEX_FILE = 'index.json'
+
+
+def _zigzag(number: int) -> int:
+    return number * 2 if number >= 0 else -number * 2 - 1
+
+
+def _unzigzag(number: int) -> int:
+    return number // 2 if number % 2 == 0 else -(number + 1) // 2
+
+
+def _write_varint(output: bytearray, number: int):
+    while number >= 0x80:
+        output.append(number & 0x7F | 0x80)
+        number >>= 7
+    output.append(number)
+
+
+def _read_varint(data: bytes, position: int) -> (int, int):
+    number, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+class BitWriter:
+    def __init__(self):
+        self.output = bytearray()
+        self._bits = 0
+        self._length = 0
+
+    def write(self, bits: int, length: int):
+        self._bits = (self._bits << length) | bits
+        self._length += length
+        while self._length >= 8:
+            self._length -= 8
+            self.output.append((self._bits >> self._length) & 0xFF)
+        self._bits &= (1 << self._length) - 1
+
+    def flush(self) -> bytes:
+        if self._length:
+            self.write(0, 8 - self._length)
+        return bytes(self.output)
+
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._position = 0
+        self._bits = 0
+        self._length = 0
+
+    def read(self, length: int) -> int:
+        while self._length < length:
+            self._bits = (self._bits << 8) | self._data[self._position]
+            self._position += 1
+            self._length += 8
+        self._length -= length
+        bits = self._bits >> self._length
+        self._bits &= (1 << self._length) - 1
+        return bits
+
+
+def encode_times(times: List[datetime]) -> bytes:
+    """
+    Encodes times as zigzag varints of the differences between consecutive deltas in microseconds,
+    which are mostly zero for regularly measured values.
+    """
+    output = bytearray()
+    previous, previous_delta = 0, 0
+    for time in times:
+        microseconds = time_to_microseconds(time)
+        delta = microseconds - previous
+        _write_varint(output, _zigzag(delta - previous_delta))
+        previous, previous_delta = microseconds, delta
+    return bytes(output)
+
+
+def decode_times(data: bytes, count: int) -> List[datetime]:
+    times, position = [], 0
+    microseconds, delta = 0, 0
+    for _ in range(count):
+        delta_of_delta, position = _read_varint(data, position)
+        delta += _unzigzag(delta_of_delta)
+        microseconds += delta
+        times.append(EPOCH + timedelta(microseconds=microseconds))
+    return times
+
+
+def encode_floats(values: List[float]) -> bytes:
+    """
+    Encodes floats by XOR with the previous value (the Gorilla encoding): an unchanged value takes one bit,
+    otherwise only the meaningful bits of the XOR are stored, reusing the previous leading and trailing zeros
+    if they fit.
+    """
+    writer = BitWriter()
+    previous, leading, trailing = 0, 65, 0
+    for value in values:
+        bits = struct.unpack('>Q', struct.pack('>d', value))[0]
+        xor = bits ^ previous
+        previous = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if new_leading >= leading and new_trailing >= trailing:
+            writer.write(0b10, 2)
+        else:
+            leading, trailing = new_leading, new_trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(64 - leading - trailing - 1, 6)
+        writer.write(xor >> trailing, 64 - leading - trailing)
+    return writer.flush()
+
+
+def decode_floats(data: bytes, count: int) -> List[float]:
+    reader = BitReader(data)
+    values = []
+    previous, leading, trailing = 0, 0, 0
+    for _ in range(count):
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                trailing = 64 - leading - reader.read(6) - 1
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append(struct.unpack('>d', struct.pack('>Q', previous))[0])
+    return values
+
+
+def encode_chunk(rows: List[dict]) -> bytes:
+    """
+    Encodes values of one variable column by column.
+
+    :param rows: list of dictionaries with the id, time, value, attribute and note, ordered by time
+    :return: content of a chunk file
+    """
+    ids, attributes = bytearray(), bytearray()
+    previous_id = 0
+    for row in rows:
+        _write_varint(ids, _zigzag(row['id'] - previous_id))
+        previous_id = row['id']
+        _write_varint(attributes, 0 if row['attribute'] is None else _zigzag(row['attribute']) + 1)
+    notes = {index: row['note'] for index, row in enumerate(rows) if row['note'] is not None}
+
+    payload = bytearray()
+    _write_varint(payload, len(rows))
+    for column in [ids, encode_times([row['time'] for row in rows]), encode_floats([row['value'] for row in rows]),
+                   attributes, json.dumps(notes).encode()]:
+        _write_varint(payload, len(column))
+        payload.extend(column)
+    return MAGIC + zlib.compress(bytes(payload))
+
+
+def decode_chunk(data: bytes) -> List[dict]:
+    """
+    :param data: content of a chunk file
+    :return: list of dictionaries with the id, time, value, attribute and note, ordered by time
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Invalid archive chunk')
+    payload = zlib.decompress(data[len(MAGIC):])
+    count, position = _read_varint(payload, 0)
+    columns = []
+    for _ in range(5):
+        length, position = _read_varint(payload, position)
+        columns.append(payload[position:position + length])
+        position += length
+    id_column, time_column, value_column, attribute_column, note_column = columns
+
+    ids, attributes = [], []
+    log_id, id_position, attribute_position = 0, 0, 0
+    for _ in range(count):
+        delta, id_position = _read_varint(id_column, id_position)
+        log_id += _unzigzag(delta)
+        ids.append(log_id)
+        attribute, attribute_position = _read_varint(attribute_column, attribute_position)
+        attributes.append(None if attribute == 0 else _unzigzag(attribute - 1))
+    notes = json.loads(note_column.decode())
+
+    return [{'id': log_id, 'time': time, 'value': value, 'attribute': attribute, 'note': notes.get(str(index))}
+            for index, (log_id, time, value, attribute) in
+            enumerate(zip(ids, decode_times(time_column, count), decode_floats(value_column, count), attributes))]
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_-]', lambda match: '%{:02X}'.format(ord(match.group())), name)
+
+
+class Archive:
+    """
+    Compressed files with values moved out of the database.
+
+    Values of every device and variable are stored in chunk files of consecutive values (see encode_chunk)
+    in the directory of the device. The index file of the directory lists its chunks with their variable,
+    range of times and IDs, so only the chunks overlapping a query are read.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._indexes = {}  # {device_id: (modification time of the index file, list of chunks)}
+        self._lock = Lock()
+
+    def _directory(self, device_id: str) -> str:
+        return os.path.join(self.path, _file_name(device_id))
+
+    def _index(self, device_id: str) -> List[dict]:
+        """
+        Loads the index of a device, again only if it was changed (e.g. by another process).
+        """
+        path = os.path.join(self._directory(device_id), INDEX_FILE)
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if device_id not in self._indexes or self._indexes[device_id][0] != modified:
+            with open(path) as file:
+                self._indexes[device_id] = (modified, json.load(file))
+        return self._indexes[device_id][1]
+
+    def _save_index(self, device_id: str, chunks: List[dict]):
+        path = os.path.join(self._directory(device_id), INDEX_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(chunks, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        self._indexes.pop(device_id, None)
+
+    def devices(self) -> List[str]:
+        """
+        :return: IDs of devices with archived values
+        """
+        with self._lock:
+            if not os.path.isdir(self.path):
+                return []
+            return sorted({chunk['dev_id'] for name in os.listdir(self.path)
+                           for chunk in self._index_of_directory(name)})
+
+    def _index_of_directory(self, name: str) -> List[dict]:
+        path = os.path.join(self.path, name, INDEX_FILE)
+        if not os.path.isfile(path):
+            return []
+        with open(path) as file:
+            return json.load(file)
+
+    def newest_id(self, device_id: str) -> Optional[int]:
+        """
+        :param device_id: ID of the device
+        :return: the greatest ID of archived values of the device, None if there are none
+        """
+        with self._lock:
+            return max((chunk['max_id'] for chunk in self._index(device_id)), default=None)
+
+    def write(self, device_id: str, var_id: str, rows: List[dict]) -> dict:
+        """
+        Stores values of a variable as a new chunk.
+
+        :param device_id: ID of the device
+        :param var_id: ID of the variable
+        :param rows: list of dictionaries with the id, time, value, attribute and note, ordered by time
+        :return: entry of the chunk in the index
+        """
+        chunk = {'dev_id': device_id, 'var_id': var_id, 'count': len(rows),
+                 'file': '{}-{}.chunk'.format(_file_name(var_id), rows[0]['id']),
+                 'start': time_to_string(rows[0]['time']), 'end': time_to_string(rows[-1]['time']),
+                 'min_id': min(row['id'] for row in rows), 'max_id': max(row['id'] for row in rows)}
+        with self._lock:
+            os.makedirs(self._directory(device_id), exist_ok=True)
+            with open(os.path.join(self._directory(device_id), chunk['file']), 'wb') as file:
+                file.write(encode_chunk(rows))
+                file.flush()
+                os.fsync(file.fileno())
+            self._save_index(device_id, self._index(device_id) + [chunk])
+        return chunk
+
+    def remove(self, chunk: dict):
+        """
+        Removes a chunk and its entry in the index.
+
+        :param chunk: the entry returned by write
+        """
+        device_id = chunk['dev_id']
+        with self._lock:
+            self._save_index(device_id, [entry for entry in self._index(device_id) if entry != chunk])
+            os.remove(os.path.join(self._directory(device_id), chunk['file']))
+
+    def read(self, device_id: str, var_ids: list = None, start: datetime = None, until: datetime = None,
+             after_id: Optional[int] = None) -> List[dict]:
+        """
+        Reads the chunks of a device which may contain the requested values. The values are not filtered,
+        the chunks only overlap the requested range.
+
+        :param device_id: ID of the device
+        :param var_ids: IDs of variables, defaults to all variables
+        :param start: the earliest time, defaults to no limit
+        :param until: the latest time, defaults to no limit
+        :param after_id: the values must have a greater ID, defaults to no limit
+        :return: list of dictionaries with the id, time, value, attribute, note, dev_id and var_id
+        """
+        with self._lock:
+            chunks = [chunk for chunk in self._index(device_id)
+                      if (not var_ids or chunk['var_id'] in var_ids)
+                      and (start is None or time_from_string(chunk['end']) >= start)
+                      and (until is None or time_from_string(chunk['start']) <= until)
+                      and (after_id is None or chunk['max_id'] > after_id)]
+        rows = []
+        for chunk in chunks:
+            with open(os.path.join(self._directory(device_id), chunk['file']), 'rb') as file:
+                for row in decode_chunk(file.read()):
+                    row['dev_id'], row['var_id'] = device_id, chunk['var_id']
+                    rows.append(row)
+        return rows
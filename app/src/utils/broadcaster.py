@@ -0,0 +1,127 @@
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Iterable, List, Optional
+
+# the message which replaces messages dropped because of a full buffer
+RESYNC = ('resync', '{}')
+
+
+class Subscription:
+    """
+    Bounded buffer of messages for one consumer.
+
+    If the consumer is too slow and the buffer is full, all buffered messages are dropped and the consumer
+    receives RESYNC instead, followed by the new messages. It should then re-read the data it missed.
+    """
+    def __init__(self, keys: list, size: int):
+        self.keys = keys
+        self.size = size
+
+        self._messages = deque()
+        self._overflowed = False
+        self._condition = Condition()
+
+    def put(self, message: tuple):
+        with self._condition:
+            if len(self._messages) >= self.size:
+                self._messages.clear()
+                self._overflowed = True
+            self._messages.append(message)
+            self._condition.notify()
+
+    def get(self, timeout: float) -> Optional[List[tuple]]:
+        """
+        Takes all buffered messages, waiting for at least one.
+
+        :param timeout: maximal waiting time in seconds
+        :return: list of messages (event, data), None if the timeout expired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._messages, timeout):
+                return None
+            messages = [RESYNC] if self._overflowed else []
+            messages.extend(self._messages)
+            self._messages.clear()
+            self._overflowed = False
+            return messages
+
+
+class Stream:
+    """
+    Iterator over the messages of a subscription which ends after a given lifetime. The subscription is
+    cancelled when the stream ends or is closed, also if it was never iterated.
+    """
+    def __init__(self, subscription: Subscription, heartbeat: float, lifetime: float, on_close: Callable[[], None]):
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+        self.deadline = monotonic() + lifetime
+
+        self._on_close = on_close
+        self._closed = False
+        self._lock = Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Optional[List[tuple]]:
+        """
+        :return: list of messages (event, data), None if there were none for the heartbeat interval
+        """
+        remaining = self.deadline - monotonic()
+        if self._closed or remaining <= 0:
+            self.close()
+            raise StopIteration
+        return self.subscription.get(min(self.heartbeat, remaining))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._on_close()
+
+
+class Broadcaster:
+    """
+    Delivers messages published for a device and data type to all its subscribers.
+    """
+    def __init__(self):
+        self._subscriptions = {}  # {(device_id, data_type): set of Subscription}
+        self._lock = Lock()
+
+    def subscribe(self, device_id: str, data_types: Iterable[str], size: int) -> Subscription:
+        """
+        :param device_id: ID of the device
+        :param data_types: types of data to receive, 'values' and/or 'events'
+        :param size: maximal number of buffered messages
+        :return: a new subscription
+        """
+        subscription = Subscription([(device_id, data_type) for data_type in data_types], size)
+        with self._lock:
+            for key in subscription.keys:
+                self._subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for key in subscription.keys:
+                subscriptions = self._subscriptions.get(key, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(key, None)
+
+    def has_subscribers(self, device_id: str, data_type: str) -> bool:
+        with self._lock:
+            return (device_id, data_type) in self._subscriptions
+
+    def publish(self, device_id: str, data_type: str, data: str):
+        """
+        :param device_id: ID of the device
+        :param data_type: type of the data, 'values' or 'events'
+        :param data: the message data
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get((device_id, data_type), ()))
+        for subscription in subscriptions:
+            subscription.put((data_type, data))
@@ -0,0 +1,90 @@
+from threading import Thread, Lock, Event
+from typing import Callable, List
+
+from . import Log
+
+
+class WriteBuffer:
+    """
+    Collects rows from all threads and hands them over to a writer in batches.
+
+    A batch is written either when the buffer holds `size` rows (by the thread which filled it)
+    or `interval` seconds after the previous write (by a background thread), whichever comes first.
+    """
+    def __init__(self, writer: Callable[[List[dict]], None], size=500, interval=1.0):
+        self.size = size
+        self.interval = interval
+
+        self._writer = writer
+        self._rows: List[dict] = []
+        self._in_flight = 0
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of rows which were buffered but not yet written.
+        """
+        with self._lock:
+            return len(self._rows) + self._in_flight
+
+    def put(self, row: dict):
+        """
+        Adds a row to the buffer. Once the buffer is stopped, the row is written immediately.
+
+        :param row: a dictionary {column: value}
+        """
+        with self._lock:
+            self._rows.append(row)
+            is_full = len(self._rows) >= self.size or self._stopped.is_set()
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = Thread(target=self._run, name="write buffer thread", daemon=True)
+                self._thread.start()
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered rows in a single batch.
+
+        If the batch fails, its rows are written one by one, so a single faulty row
+        is logged and dropped without losing the rest of the batch.
+        """
+        with self._write_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._in_flight = len(rows)
+            if not rows:
+                return
+            try:
+                self._writer(rows)
+            except Exception as e:
+                Log.error(e)
+                if len(rows) > 1:
+                    self._write_each(rows)
+            finally:
+                with self._lock:
+                    self._in_flight = 0
+
+    def _write_each(self, rows: List[dict]):
+        for row in rows:
+            try:
+                self._writer([row])
+            except Exception as e:
+                Log.error(e)
+
+    def stop(self):
+        """
+        Stops the background thread and writes the remaining rows. Rows put afterwards are written one by one.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
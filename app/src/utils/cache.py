@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, List, Optional
+
+
+class LatestCache:
+    """
+    Thread-safe store of the newest row of every device and key (e.g. a variable).
+
+    Rows are dictionaries with a 'time' key. A row replaces the stored one only if it is not older,
+    so rows loaded from the database never override newer rows saved in the meantime.
+
+    Rows are expected to be updated in the order they were stored, so the most recently stored row
+    of a device is the one with the highest ID.
+    """
+    def __init__(self):
+        self._rows = {}  # {device_id: OrderedDict {key: row}}, the most recently updated key last
+        self._newest = {}  # {device_id: row}, the most recently stored row
+        self._loaded = set()
+        self._lock = Lock()
+
+    def _update(self, device_id, key, row: dict):
+        rows = self._rows.setdefault(device_id, OrderedDict())
+        current = rows.get(key)
+        if current is None or row['time'] >= current['time']:
+            rows[key] = row
+            rows.move_to_end(key)
+
+    def update(self, device_id, key, row: dict):
+        """
+        Stores a row if it is not older than the stored one.
+
+        :param device_id: ID of the device
+        :param key: key of the row within the device
+        :param row: a dictionary {column: value}
+        """
+        with self._lock:
+            self._update(device_id, key, row)
+            self._newest[device_id] = row
+
+    def load(self, device_id, rows: Iterable[tuple]):
+        """
+        Stores rows loaded from persistent storage and marks the device as loaded.
+
+        :param device_id: ID of the device
+        :param rows: pairs (key, row) ordered by ID
+        """
+        rows = list(rows)
+        with self._lock:
+            for key, row in rows:
+                self._update(device_id, key, row)
+            if rows:
+                # a row stored in the meantime is newer than the loaded ones
+                self._newest.setdefault(device_id, rows[-1][1])
+            self._loaded.add(device_id)
+
+    def invalidate(self, device_id):
+        """
+        Forgets the rows of a device, so they are loaded from persistent storage again.
+
+        :param device_id: ID of the device
+        """
+        with self._lock:
+            self._rows.pop(device_id, None)
+            self._newest.pop(device_id, None)
+            self._loaded.discard(device_id)
+
+    def is_loaded(self, device_id) -> bool:
+        with self._lock:
+            return device_id in self._loaded
+
+    def latest(self, device_id) -> Optional[dict]:
+        """
+        :param device_id: ID of the device
+        :return: the most recently stored row of all keys, None if there is none
+        """
+        with self._lock:
+            return self._newest.get(device_id)
+
+    def rows(self, device_id) -> List[tuple]:
+        """
+        :param device_id: ID of the device
+        :return: pairs (key, row) of all keys of the device
+        """
+        with self._lock:
+            return list(self._rows.get(device_id, {}).items())
@@ -0,0 +1,37 @@
+import io
+import sys
+import zipfile
+from array import array
+from typing import Dict
+
+# array typecodes and the corresponding NumPy type descriptors
+DESCRIPTORS = {'q': '<i8', 'd': '<f8'}
+
+
+def to_npy(data: array) -> bytes:
+    """
+    Encodes a one-dimensional array in the NumPy .npy format (version 1.0).
+    :param data: array of typecode 'q' (int64) or 'd' (float64)
+    :return: encoded array
+    """
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(DESCRIPTORS[data.typecode],
+                                                                                   len(data))
+    # magic string, version and header length take 10 bytes, the data must start aligned to 64 bytes
+    header += ' ' * (-(10 + len(header) + 1) % 64) + '\n'
+    if sys.byteorder == 'big':
+        data = array(data.typecode, data)
+        data.byteswap()
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1') + data.tobytes()
+
+
+def to_npz(columns: Dict[str, array]) -> bytes:
+    """
+    Encodes named arrays into a compressed NumPy .npz archive, which can be read by numpy.load.
+    :param columns: a dictionary {name: array}
+    :return: encoded archive
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in columns.items():
+            archive.writestr(name + '.npy', to_npy(data))
+    return buffer.getvalue()
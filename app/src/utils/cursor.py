@@ -0,0 +1,26 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+
+def encode_cursor(position: dict) -> str:
+    """
+    Encodes a position in a result set to an opaque string.
+    :param position: a dictionary with the position
+    :return: encoded cursor
+    """
+    return urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decodes a cursor created by encode_cursor.
+    :param cursor: encoded cursor
+    :return: a dictionary with the position
+    """
+    try:
+        position = json.loads(urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise SyntaxError("Invalid cursor has been provided: {}".format(cursor))
+    if not isinstance(position, dict):
+        raise SyntaxError("Invalid cursor has been provided: {}".format(cursor))
+    return position
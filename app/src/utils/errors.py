@@ -8,3 +8,14 @@ class IdError(Exception):
 
 class ClassError(IdError):
     pass
+
+
+class BusyError(Exception):
+    """
+    The request cannot be served now because too many requests are being served, it may be repeated later.
+    """
+    def __init__(self, message):
+        self.message = message
+
+    def __eq__(self, other):
+        return self.message == other.message
@@ -0,0 +1,54 @@
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterable, Optional, Tuple
+
+
+class SurrogateKeys:
+    """
+    Cached mapping between names (string IDs of devices or variables) and their small integer numbers.
+
+    The mapping is loaded again when an unknown name or number is looked up, so items added after the last load
+    are found as well, but at most once per reload_interval seconds, so repeated lookups of unknown items do not
+    load it every time. Items added by this process should be followed by load(). Names and numbers are never
+    changed or reused.
+    """
+    def __init__(self, kind: str, load: Callable[[], Iterable[Tuple[str, int]]], reload_interval: float = 1.0):
+        self.kind = kind
+        self.reload_interval = reload_interval
+        self._load = load
+        self._numbers = {}  # {name: number}
+        self._names = {}  # {number: name}
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def _load_locked(self):
+        self._numbers = {name: number for name, number in self._load()}
+        self._names = {number: name for name, number in self._numbers.items()}
+        self._loaded_at = monotonic()
+
+    def load(self):
+        with self._lock:
+            self._load_locked()
+
+    def _reload(self):
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at >= self.reload_interval:
+                self._load_locked()
+
+    def number(self, name: str) -> Optional[int]:
+        """
+        :param name: the name
+        :return: number of the name, None if it does not exist
+        """
+        if name not in self._numbers:
+            self._reload()
+        return self._numbers.get(name)
+
+    def name(self, number: int) -> Optional[str]:
+        """
+        :param number: the number
+        :return: name with the number, None if it does not exist
+        """
+        if number not in self._names:
+            self._reload()
+        return self._names.get(number)
@@ -0,0 +1,105 @@
+from threading import Condition, Lock
+from typing import Callable, Dict, Iterable, Optional, Set
+
+
+class Notifier:
+    """
+    Lets threads wait until new data of a device are stored.
+
+    The notifier keeps the newest stored ID (the watermark) of every watched device and data type and wakes up
+    only the threads waiting for the device whose watermark has grown. The watermark of a device nobody waits for
+    is forgotten once its data are stored, so the storing thread does not have to look up its newest ID.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._watermarks = {}  # {(data_type, device_id): newest ID}
+        self._conditions = {}  # {(data_type, device_id): Condition}
+        self._waiters = {}  # {(data_type, device_id): number of waiting threads}
+
+    def _condition(self, key) -> Condition:
+        if key not in self._conditions:
+            self._conditions[key] = Condition(self._lock)
+        return self._conditions[key]
+
+    def _add_waiter(self, key, count: int):
+        self._waiters[key] = self._waiters.get(key, 0) + count
+        if not self._waiters[key]:
+            del self._waiters[key]
+
+    def watched(self, data_type: str, device_ids: Iterable[str]) -> Set[str]:
+        """
+        Selects the devices with waiting threads among devices whose data were just stored.
+        Watermarks of the other devices are forgotten.
+
+        :param data_type: type of the data, 'values' or 'events'
+        :param device_ids: IDs of the devices
+        :return: IDs of the devices which need to be notified
+        """
+        with self._lock:
+            watched = set()
+            for device_id in device_ids:
+                key = (data_type, device_id)
+                if self._waiters.get(key):
+                    watched.add(device_id)
+                else:
+                    self._watermarks.pop(key, None)
+            return watched
+
+    def notify(self, data_type: str, watermarks: Dict[str, int]):
+        """
+        Raises the watermarks of devices and wakes up the threads waiting for them.
+
+        :param data_type: type of the data, 'values' or 'events'
+        :param watermarks: a dictionary {device_id: newest stored ID}
+        """
+        with self._lock:
+            for device_id, newest_id in watermarks.items():
+                key = (data_type, device_id)
+                if newest_id > self._watermarks.get(key, 0):
+                    self._watermarks[key] = newest_id
+                    self._condition(key).notify_all()
+
+    def watermark(self, data_type: str, device_id: str, load: Callable[[], Optional[int]]) -> int:
+        """
+        :param data_type: type of the data, 'values' or 'events'
+        :param device_id: ID of the device
+        :param load: loads the newest stored ID if the watermark of the device is not known yet
+        :return: the newest stored ID of the device
+        """
+        key = (data_type, device_id)
+        with self._lock:
+            if key in self._watermarks:
+                return self._watermarks[key]
+            # data stored while the watermark is loaded are notified as if the thread was already waiting
+            self._add_waiter(key, 1)
+        try:
+            newest_id = load() or 0
+        except Exception:
+            with self._lock:
+                self._add_waiter(key, -1)
+            raise
+        with self._lock:
+            self._add_waiter(key, -1)
+            # the watermark may have grown while it was loaded
+            return self._watermarks.setdefault(key, newest_id)
+
+    def wait(self, data_type: str, device_id: str, last_id: int, timeout: float) -> bool:
+        """
+        Blocks until the watermark of the device exceeds the given ID or the timeout expires.
+        The watermark must have been obtained by watermark() before. If it was forgotten meanwhile,
+        data of the device have been stored since and the call returns immediately.
+
+        :param data_type: type of the data, 'values' or 'events'
+        :param device_id: ID of the device
+        :param last_id: the newest ID known to the caller
+        :param timeout: maximal waiting time in seconds
+        :return: True if there may be data newer than last_id
+        """
+        key = (data_type, device_id)
+        with self._lock:
+            self._add_waiter(key, 1)
+            try:
+                return self._condition(key).wait_for(
+                    lambda: key not in self._watermarks or self._watermarks[key] > last_id, timeout)
+            finally:
+                self._add_waiter(key, -1)
@@ -0,0 +1,45 @@
+from datetime import datetime
+from typing import List
+
+# tables partitioned by months of their time
+PARTITIONED_TABLES = ('values', 'events')
+# the partition for rows beyond the last month, it is kept empty so that it can be split without copying
+MAX_PARTITION = 'pmax'
+
+
+def month_start(time: datetime, months: int = 0) -> datetime:
+    """
+    :param time: requested time
+    :param months: number of months to add
+    :return: start of the month of the time, shifted by the given number of months
+    """
+    month = time.year * 12 + time.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    """
+    :param start: start of the month
+    :return: name of the partition of the month
+    """
+    return start.strftime('p%Y%m')
+
+
+def partition_start(name: str) -> datetime:
+    """
+    :param name: name of the partition of a month
+    :return: start of the month
+    """
+    return datetime.strptime(name, 'p%Y%m')
+
+
+def partition_definitions(starts: List[datetime]) -> str:
+    """
+    :param starts: starts of the months
+    :return: definitions of monthly partitions followed by the MAX_PARTITION
+    """
+    definitions = ["PARTITION {} VALUES LESS THAN ('{}')".format(partition_name(start),
+                                                                month_start(start, 1).strftime('%Y-%m-%d'))
+                   for start in starts]
+    definitions.append('PARTITION {} VALUES LESS THAN (MAXVALUE)'.format(MAX_PARTITION))
+    return ', '.join(definitions)
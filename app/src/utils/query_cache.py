@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+from typing import Callable, Hashable, Iterable
+
+
+class _Flight:
+    """
+    A running load of a query, shared by all its callers.
+    """
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class QueryCache:
+    """
+    Short-lived LRU cache of query results, which also coalesces concurrent identical queries: while a query runs,
+    callers of the same query wait for its result instead of running it again.
+
+    Results of a device are invalidated when new data of the device are stored. A result whose load overlapped
+    with storing new data is not cached and later callers do not join such a load.
+    """
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()  # {key: (device_id, generation, expiration time, result)}
+        self._flights = {}  # {key: _Flight}
+        self._generations = {}  # {device_id: number of invalidations}
+        self._lock = Lock()
+
+    def get(self, key: Hashable, device_id: str, load: Callable):
+        """
+        :param key: identification of the query
+        :param device_id: ID of the device whose data are queried
+        :param load: runs the query
+        :return: the result of the query, shared by all callers, so it must not be modified
+        """
+        with self._lock:
+            generation = self._generations.get(device_id, 0)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == generation and entry[2] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+
+            flight = self._flights.get(key)
+            leader = flight is None or flight.generation != generation
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight(generation)
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = load()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.error is None and self.size > 0 and self.ttl > 0 \
+                        and flight.generation == self._generations.get(device_id, 0):
+                    self._entries[key] = (device_id, flight.generation, monotonic() + self.ttl, flight.result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+
+    def invalidate(self, device_ids: Iterable[str]):
+        """
+        :param device_ids: IDs of devices whose data have changed
+        """
+        device_ids = set(device_ids)
+        with self._lock:
+            for device_id in device_ids:
+                self._generations[device_id] = self._generations.get(device_id, 0) + 1
+            for key in [key for key, entry in self._entries.items() if entry[0] in device_ids]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'size': len(self._entries)}
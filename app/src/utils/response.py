@@ -1,4 +1,9 @@
-from flask import jsonify
+import json
+
+from flask import jsonify, stream_with_context
+from flask import Response as HTTPResponse
+
+from .errors import BusyError
 
 
 class Response:
@@ -6,10 +11,11 @@ class Response:
     Represents a response class containing information about the success/failure and returned data of the conducted
     action.
     """
-    def __init__(self, success, data, cause):
+    def __init__(self, success, data, cause, extra=None):
         self.cause = cause
         self.data = data
         self.success = success
+        self.extra = extra
 
     def __eq__(self, other):
         return self.__dict__ == other.__dict__
@@ -18,10 +24,56 @@ class Response:
         return str(self.__dict__)
 
     def to_json(self):
-        return jsonify(
-            {
-                "success": self.success,
-                "cause": str(self.cause),
-                "data": self.data,
-            }
-        )
+        content = {
+            "success": self.success,
+            "cause": str(self.cause),
+            "data": self.data,
+        }
+        if self.extra:
+            content.update(self.extra)
+        response = jsonify(content)
+        if isinstance(self.cause, BusyError):
+            response.status_code = 503
+        return response
+
+    def to_ndjson(self):
+        """
+        Streams the data as newline delimited JSON, one item per line. Failures are returned as JSON.
+        """
+        if not self.success:
+            return self.to_json()
+        lines = (json.dumps(item) + '\n' for item in self.data)
+        return HTTPResponse(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    def to_event_stream(self):
+        """
+        Streams the data, lists of (event, data) messages, as Server-Sent Events. None is sent as a keep-alive
+        comment. Failures are returned as JSON.
+        """
+        if not self.success:
+            return self.to_json()
+
+        def events():
+            # the headers are sent with the first chunk, the client must not wait for data to connect
+            yield ':\n\n'
+            for messages in self.data:
+                if messages is None:
+                    yield ':\n\n'
+                    continue
+                yield ''.join('event: {}\ndata: {}\n\n'.format(event, data) for event, data in messages)
+
+        response = HTTPResponse(events(), mimetype='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # the stream is released even if the client disconnects before it is iterated
+        if hasattr(self.data, 'close'):
+            response.call_on_close(self.data.close)
+        return response
+
+    def to_file(self, filename, mimetype='application/octet-stream'):
+        """
+        Returns the data as a file attachment. Failures are returned as JSON.
+        """
+        if not self.success:
+            return self.to_json()
+        return HTTPResponse(self.data, mimetype=mimetype,
+                            headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
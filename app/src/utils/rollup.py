@@ -0,0 +1,53 @@
+from datetime import timedelta
+from typing import Dict, Iterable, Tuple
+
+from .time import EPOCH
+
+NO_ATTRIBUTE = -1
+
+
+def bucket_start(time, width: int):
+    """
+    Computes the start of the time bucket the time falls into. Buckets are aligned to the Unix epoch.
+    :param time: requested time
+    :param width: width of the bucket in seconds
+    :return: start of the bucket
+    """
+    return EPOCH + timedelta(seconds=(time - EPOCH) // timedelta(seconds=width) * width)
+
+
+def aggregate(rows: Iterable[dict], width: int) -> Dict[Tuple, dict]:
+    """
+    Aggregates values into time buckets of given width.
+    :param rows: dictionaries with keys 'dev_id', 'var_id', 'attribute', 'time' and 'value'
+    :param width: width of a bucket in seconds
+    :return: a dictionary {(dev_id, var_id, attribute, bucket start): aggregates}
+    """
+    result = {}
+    for row in rows:
+        attribute = NO_ATTRIBUTE if row.get('attribute') is None else row['attribute']
+        key = (row['dev_id'], row['var_id'], attribute, bucket_start(row['time'], width))
+        aggregates = {'count': 1, 'sum': row['value'], 'min': row['value'], 'max': row['value'],
+                      'last': row['value'], 'last_time': row['time']}
+        if key in result:
+            merge(result[key], aggregates)
+        else:
+            result[key] = aggregates
+    return result
+
+
+def merge(aggregates: dict, other: dict) -> dict:
+    """
+    Merges aggregates of other values into the given aggregates.
+    :param aggregates: a dictionary with keys 'count', 'sum', 'min', 'max', 'last' and 'last_time', updated in place
+    :param other: a dictionary with the same keys
+    :return: the updated aggregates
+    """
+    aggregates['count'] += other['count']
+    aggregates['sum'] += other['sum']
+    aggregates['min'] = min(aggregates['min'], other['min'])
+    aggregates['max'] = max(aggregates['max'], other['max'])
+    if other['last_time'] >= aggregates['last_time']:
+        aggregates['last'] = other['last']
+        aggregates['last_time'] = other['last_time']
+    return aggregates
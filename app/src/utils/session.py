@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from threading import local
+
+from flask import has_app_context
+from sqlalchemy.exc import DBAPIError, StatementError, TimeoutError
+
+from .errors import IdError
+from ... import db
+
+_scope = local()
+
+# MySQL errors meaning that the server cannot be reached or does not accept connections
+UNAVAILABLE_ERRORS = {1040, 1053, 2002, 2003, 2005, 2006, 2013, 2055}
+
+
+@contextmanager
+def session_scope():
+    """
+    Provides the database session of the current thread for a unit of work.
+
+    A thread without an application context (e.g. a task or device thread) gets one on the first use and keeps it
+    for its whole lifetime, so neither the context nor the session is set up again for every saved sample.
+    If the unit of work fails, the session is rolled back. When the outermost scope ends, the session is closed,
+    which returns its connection to the pool. An IdError raised while binding parameters of a query (e.g. by an
+    unknown device ID) is raised unwrapped.
+    """
+    if not has_app_context():
+        from main import app
+        app.app_context().push()  # never popped, it lives as long as the thread
+
+    _scope.depth = getattr(_scope, 'depth', 0) + 1
+    try:
+        yield db.session
+    except StatementError as e:
+        db.session.rollback()
+        if isinstance(e.orig, IdError):
+            raise e.orig from e
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        _scope.depth -= 1
+        if _scope.depth == 0:
+            db.session.close()
+
+
+def is_unavailable(error: Exception) -> bool:
+    """
+    Decides whether a database error was caused by an unavailable server (or an exhausted connection pool),
+    not by the query itself.
+
+    :param error: the raised exception
+    :return: True if the same query may succeed later
+    """
+    if isinstance(error, TimeoutError):
+        return True
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        args = getattr(error.orig, 'args', ())
+        return len(args) > 0 and args[0] in UNAVAILABLE_ERRORS
+    return False
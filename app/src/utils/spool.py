@@ -0,0 +1,67 @@
+import json
+import sqlite3
+from datetime import datetime
+from threading import Lock
+from typing import List, Tuple
+from uuid import uuid4
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    raise TypeError('Object of type {} cannot be spooled'.format(type(obj).__name__))
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.strptime(obj['__datetime__'], '%Y-%m-%dT%H:%M:%S.%f' if '.' in obj['__datetime__']
+                                 else '%Y-%m-%dT%H:%M:%S')
+    return obj
+
+
+class Spool:
+    """
+    Local append-only store of rows which could not be written into the database.
+
+    The rows are kept in a SQLite database in WAL mode, so they survive a restart of the application. Every row gets
+    a unique key, which makes its replay into the database idempotent.
+    """
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS spool (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                 'kind TEXT NOT NULL, key TEXT NOT NULL UNIQUE, row TEXT NOT NULL)')
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def append(self, kind: str, rows: List[dict]):
+        """
+        Appends rows in a single transaction.
+
+        :param kind: kind of the rows, e.g. the name of their table
+        :param rows: list of dictionaries {column: value}
+        """
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT INTO spool (kind, key, row) VALUES (?, ?, ?)',
+                                         [(kind, uuid4().hex, json.dumps(row, default=_encode)) for row in rows])
+
+    def peek(self, limit: int) -> List[Tuple[int, str, str, dict]]:
+        """
+        :param limit: maximal number of rows
+        :return: the oldest rows as tuples (sequence number, kind, key, row)
+        """
+        with self._lock:
+            items = self._connection.execute('SELECT seq, kind, key, row FROM spool ORDER BY seq LIMIT ?',
+                                             (limit, )).fetchall()
+        return [(seq, kind, key, json.loads(row, object_hook=_decode)) for seq, kind, key, row in items]
+
+    def remove(self, seqs: List[int]):
+        """
+        :param seqs: sequence numbers of the rows to remove
+        """
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM spool WHERE seq = ?', [(seq, ) for seq in seqs])
@@ -1,4 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
 
 
 def now():
@@ -25,3 +27,12 @@ def time_to_string(time):
     :return: processed time
     """
     return datetime.strftime(time, "%Y%m%d%H%M%S%f")
+
+
+def time_to_microseconds(time):
+    """
+    Processes the input datetime to the number of microseconds since the Unix epoch.
+    :param time: requested time
+    :return: processed time
+    """
+    return (time - EPOCH) // timedelta(microseconds=1)
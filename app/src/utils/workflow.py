@@ -1,4 +1,4 @@
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 from typing import List, Callable
 import jpype
 
@@ -40,16 +40,43 @@ class Scheduler(Thread):
             job.success = False
         job.is_done.set()
 
+    def stop(self):
+        self.is_active = False
+        self.has_jobs.set()
+
     def run(self):
         while self.is_active:
-            self.has_jobs.wait(timeout=5)
-            while self.jobs:
-                self.execute(self.jobs.pop(0))
+            self.has_jobs.wait()
+            # cleared before the jobs are taken, so that a job scheduled meanwhile sets it again
             self.has_jobs.clear()
+            while self.jobs and self.is_active:
+                self.execute(self.jobs.pop(0))
 
 
 class WorkflowProvider:
-    def __init__(self):
-        self.scheduler = Scheduler()
-        self.scheduler.start()
+    """
+    Provides the Scheduler shared by all devices. Its thread is started when the scheduler is first requested,
+    so no thread runs until a job is scheduled.
+    """
+    _scheduler = None
+    _lock = Lock()
+
+    @property
+    def scheduler(self) -> Scheduler:
+        with WorkflowProvider._lock:
+            if WorkflowProvider._scheduler is None:
+                WorkflowProvider._scheduler = Scheduler()
+                WorkflowProvider._scheduler.daemon = True
+                WorkflowProvider._scheduler.start()
+            return WorkflowProvider._scheduler
+
+    @staticmethod
+    def stop():
+        """
+        Stops the shared Scheduler, if it was started. A scheduler requested afterwards is started anew.
+        """
+        with WorkflowProvider._lock:
+            if WorkflowProvider._scheduler is not None:
+                WorkflowProvider._scheduler.stop()
+                WorkflowProvider._scheduler = None
 
@@ -1,5 +1,5 @@
 from ..command import Command
-from ..src.utils.abstract_device import Connector
+from ..src.utils.abstract_device import Connector, CompositeCommand
 from ..src.utils.observable import Observable, Observer
 from ..src.utils.abstract_task import BaseTask
 from ..src.utils import Log
@@ -18,6 +18,7 @@ class SICS(Connector):
             '1': self.get_weight,
             '2': self.get_info
         }
+        self.idempotent_commands = {'1', '2'}
 
     def get_weight(self):
         """
@@ -1 +1 @@
-from .. import Connector, Command, Log, Scheduler, Job
+from .. import Connector, CompositeCommand, Command, Log, Scheduler, Job
@@ -31,6 +31,7 @@ class GMS(JavaDevice):
             "15": self.get_serial_nr,
             "16": self.get_fw_ver
         }
+        self.idempotent_commands = {"1", "9", "10", "11", "13", "14", "15", "16"}
 
     def get_info(self):
         """
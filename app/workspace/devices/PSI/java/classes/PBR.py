@@ -60,6 +60,8 @@ class PBR(JavaDevice):
             "21": self.get_hardware_address,
             "22": self.get_cluster_name
         }
+        self.idempotent_commands = {"1", "2", "4", "5", "6", "9", "12", "14", "16", "17", "18", "19", "21", "22"}
+        # no composite commands, measure_all sends a separate request for each of its fields
 
     def get_temp_settings(self):
         """
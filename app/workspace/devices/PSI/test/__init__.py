@@ -1,4 +1,4 @@
-from .. import Connector
+from .. import Connector, CompositeCommand
 from .classes.GAS import GAS
 from .classes.GMS import GMS
 from .classes.PBR import PBR
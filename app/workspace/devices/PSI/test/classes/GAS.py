@@ -29,6 +29,7 @@ class GAS(Connector):
             "8": self.get_small_valves,
             "9": self.set_small_valves,
         }
+        self.idempotent_commands = {"1", "2", "4", "5", "6", "7", "8"}
 
     def get_co2_air(self):
         """
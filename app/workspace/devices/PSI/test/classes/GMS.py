@@ -18,6 +18,7 @@ class GMS(Connector):
             "2": self.get_valve_flow,
             "3": self.set_valve_flow,
         }
+        self.idempotent_commands = {"1", "2"}
 
     def get_valve_flow(self, valve):
         """
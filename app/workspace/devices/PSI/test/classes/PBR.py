@@ -1,5 +1,5 @@
 from random import random
-from .. import Connector
+from .. import Connector, CompositeCommand
 
 
 class PBR(Connector):
@@ -59,6 +59,20 @@ class PBR(Connector):
             "22": self.get_hardware_address,
             "23": self.get_cluster_name
         }
+        self.idempotent_commands = {"1", "2", "4", "5", "6", "9", "12", "14", "15", "17", "18", "19", "20", "22", "23"}
+        # reads answered by measure_all, including their default arguments
+        self.composite_commands = [CompositeCommand("19", {
+            ("12", ()): "pwm_settings",
+            ("9", (0,)): "light_0",
+            ("9", (1,)): "light_1",
+            ("5", (0,)): "od_0",
+            ("5", (1,)): "od_1",
+            ("4", ()): "ph",
+            ("4", (5, 0)): "ph",
+            ("2", ()): "temp",
+            ("6", (5,)): "pump",
+            ("14", ()): "o2"
+        })]
 
     def get_temp_settings(self):
         """
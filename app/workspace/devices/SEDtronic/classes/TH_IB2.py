@@ -20,6 +20,7 @@ class TH_IB2(Connector):
             "2": self.get_humidity,
             "3": self.measure_all
         }
+        self.idempotent_commands = {"1", "2", "3"}
 
     def get_temperature(self, temp_unit="C"):
         """
@@ -24,6 +24,7 @@ class U1W_TVSL(Connector):
             "3": self.get_illuminance,
             "4": self.measure_all
         }
+        self.idempotent_commands = {"1", "2", "3", "4"}
 
     def get_temperature(self, temp_unit="C"):
         """
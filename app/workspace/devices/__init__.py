@@ -1,4 +1,4 @@
-from .. import Connector, Log, Command, Scheduler, Job
+from .. import Connector, CompositeCommand, Log, Command, Scheduler, Job
 from . import MettlerToledo, Phenometrics, SEDtronic
 from .PSI import java, test
 
@@ -196,7 +196,8 @@ class PBRMeasureAll(BaseTask):
                                   self.task_id,
                                   is_awaited=True)
                 commands.append((_name, command))
-                self.device.post_command(command, 1)
+            # posted at once, so that the device can answer them by a composite command
+            self.device.post_commands([command for _, command in commands], 1)
 
             for name, command in commands:
                 command.await_cmd()
@@ -76,7 +76,8 @@ class MeasureAllDesync(BaseTask):
                               self.task_id,
                               is_awaited=True)
             executed_commands.append((_name, command))
-            self.device.post_command(command, 1)
+        # posted at once, so that the device can answer them by a composite command
+        self.device.post_commands([command for _, command in executed_commands], 1)
 
         for name, command in executed_commands:
             command.await_cmd()
@@ -1,4 +1,7 @@
 #!/bin/sh
 export FLASK_APP=main.py
 flask db upgrade
-exec gunicorn -b 0.0.0.0:5000 --access-logfile - --error-logfile - main:app
+# a single worker owns the devices, requests waiting for data (/data/wait) and streams (/data/stream) occupy
+# one thread each, at most DATA_WAIT_MAX_REQUESTS and DATA_STREAM_MAX_SUBSCRIBERS of them (see config.py)
+# so that threads are left for other requests
+exec gunicorn -b 0.0.0.0:5000 --workers 1 --threads ${GUNICORN_THREADS:-64} --access-logfile - --error-logfile - main:app
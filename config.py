@@ -3,6 +3,22 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def engine_options(pool_size, max_overflow):
+    """
+    Options of the database connection pool. Every device and task thread holds a connection only while it stores
+    or reads data, the pool is sized for the expected number of concurrent threads. Connections are checked before
+    use and replaced before MySQL closes them (wait_timeout), so a restarted server does not cause errors.
+    """
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', pool_size)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', max_overflow)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '3600')),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['true', 'on', '1'],
+        'connect_args': {'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))},
+    }
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'hard to guess string')
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
@@ -19,6 +35,54 @@ class Config:
     DB_PASSWORD = os.environ.get('PASSWORD').strip('"')
 
     DB_HOST = os.environ.get('database', 'database')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(10, 20)
+
+    # measured values are written in batches of this size or after this many seconds
+    VALUES_BUFFER_SIZE = int(os.environ.get('VALUES_BUFFER_SIZE', '500'))
+    VALUES_BUFFER_INTERVAL = float(os.environ.get('VALUES_BUFFER_INTERVAL', '1.0'))
+
+    # maximal number of items returned in one page of /data
+    DATA_PAGE_SIZE_MAX = int(os.environ.get('DATA_PAGE_SIZE_MAX', '10000'))
+    # number of items read from the database at once when /data is streamed
+    DATA_STREAM_CHUNK_SIZE = int(os.environ.get('DATA_STREAM_CHUNK_SIZE', '1000'))
+    # number of messages buffered for a slow client of /data/stream and seconds between keep-alive comments
+    DATA_STREAM_BUFFER_SIZE = int(os.environ.get('DATA_STREAM_BUFFER_SIZE', '1000'))
+    DATA_STREAM_HEARTBEAT = int(os.environ.get('DATA_STREAM_HEARTBEAT', '15'))
+    # maximal number of streams open at once, the others are refused with 503, and seconds after which a stream
+    # is closed - together with DATA_WAIT_MAX_REQUESTS it must be lower than GUNICORN_THREADS in boot.sh
+    DATA_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('DATA_STREAM_MAX_SUBSCRIBERS', '16'))
+    DATA_STREAM_LIFETIME = int(os.environ.get('DATA_STREAM_LIFETIME', '3600'))
+    # maximal number of seconds a request to /data/wait is kept open and of such requests open at once, the others
+    # are refused with 503 - it must be lower than the number of threads of the server (GUNICORN_THREADS in boot.sh)
+    DATA_WAIT_TIMEOUT_MAX = int(os.environ.get('DATA_WAIT_TIMEOUT_MAX', '30'))
+    DATA_WAIT_MAX_REQUESTS = int(os.environ.get('DATA_WAIT_MAX_REQUESTS', '32'))
+    # local file where values and events are spooled while the database is unavailable, the spooled rows are
+    # replayed in batches of SPOOL_BATCH_SIZE every SPOOL_RETRY_INTERVAL seconds until the database recovers
+    SPOOL_PATH = os.environ.get('SPOOL_PATH', os.path.join(basedir, 'spool.db'))
+    SPOOL_RETRY_INTERVAL = float(os.environ.get('SPOOL_RETRY_INTERVAL', '5.0'))
+    SPOOL_BATCH_SIZE = int(os.environ.get('SPOOL_BATCH_SIZE', '1000'))
+    # seconds for which the keys of replayed rows are kept to detect repeated replays
+    SPOOL_REPLAY_RETENTION = int(os.environ.get('SPOOL_REPLAY_RETENTION', '86400'))
+    # number of /data results cached for at most DATA_CACHE_TTL seconds, the cache is disabled by 0
+    DATA_CACHE_SIZE = int(os.environ.get('DATA_CACHE_SIZE', '256'))
+    DATA_CACHE_TTL = float(os.environ.get('DATA_CACHE_TTL', '2.0'))
+    # maximal number of values accepted by /data/bulk at once and number of values written by one INSERT query
+    BULK_SIZE_MAX = int(os.environ.get('BULK_SIZE_MAX', '100000'))
+    BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '5000'))
+    # values moved out of the database (see DataManager.archive_values) are stored in compressed files
+    # of up to ARCHIVE_CHUNK_SIZE values in this directory
+    ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH', os.path.join(basedir, 'archive'))
+    ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', '10000'))
+    # values and events are partitioned by months: partitions are created this many months ahead and removed
+    # (dropped, or detached into separate tables) after the retention period, which is unlimited by default;
+    # the maintenance runs every PARTITION_MAINTENANCE_INTERVAL hours
+    PARTITION_PREMAKE_MONTHS = int(os.environ.get('PARTITION_PREMAKE_MONTHS', '3'))
+    PARTITION_RETENTION_MONTHS = int(os.environ['PARTITION_RETENTION_MONTHS']) \
+        if os.environ.get('PARTITION_RETENTION_MONTHS') else None
+    PARTITION_RETENTION_ACTION = os.environ.get('PARTITION_RETENTION_ACTION', 'drop')  # drop/detach
+    PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', '24'))
+    # seconds of values processed in one transaction when the rollups are rebuilt or checked
+    ROLLUP_WINDOW = int(os.environ.get('ROLLUP_WINDOW', '86400'))
 
     @staticmethod
     def init_app(app):
@@ -29,6 +93,9 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'mysql://TestUser:pass@{}/device_control_test'.format(Config.DB_HOST)
+    VALUES_BUFFER_SIZE = 1
+    SPOOL_PATH = ':memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(5, 5)
 
 
 class DevelopmentConfig(Config):
@@ -39,6 +106,7 @@ class DevelopmentConfig(Config):
 
 
 class ProductionConfig(Config):
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(20, 40)
     SQLALCHEMY_DATABASE_URI = 'mysql://{}:{}@{}/device_control'.format(Config.DB_USERNAME,
                                                                        Config.DB_PASSWORD,
                                                                        Config.DB_HOST)
@@ -29,3 +29,89 @@ def profile():
     from werkzeug.contrib.profiler import ProfilerMiddleware
     app.wsgi_app = ProfilerMiddleware(app.wsgi_app)
     app.run()
+
+
+@app.cli.group()
+def rollups():
+    """Maintain the rollup tables of values."""
+
+
+@rollups.command()
+@click.option('--time', 'start', help='Start of the range <YYYYmmddHHMMSSfff>, defaults to the oldest value.')
+@click.option('--until', help='End of the range <YYYYmmddHHMMSSfff>, defaults to now.')
+def backfill(start, until):
+    """Rebuild the rollups from the stored values."""
+    from app import app_manager
+    from app.src.utils.time import time_from_string
+    count = app_manager.dataManager.rebuild_rollups(time_from_string(start), time_from_string(until))
+    click.echo('Aggregated {} values.'.format(count))
+
+
+@rollups.command()
+@click.option('--time', 'start', help='Start of the range <YYYYmmddHHMMSSfff>, defaults to the oldest value.')
+@click.option('--until', help='End of the range <YYYYmmddHHMMSSfff>, defaults to now.')
+def check(start, until):
+    """Compare the rollups with the stored values."""
+    from app import app_manager
+    from app.src.utils.time import time_from_string
+    mismatches = app_manager.dataManager.check_rollups(time_from_string(start), time_from_string(until))
+    for mismatch in mismatches:
+        click.echo('{table}: {dev_id} {var_id} {attribute} {time} - expected {expected} values, '
+                   'found {actual}'.format(**mismatch))
+    click.echo('{} inconsistent buckets.'.format(len(mismatches)))
+    sys.exit(1 if mismatches else 0)
+
+
+@app.cli.group()
+def archive():
+    """Maintain the archive of values."""
+
+
+@archive.command()
+@click.option('--until', help='Archive values before this time <YYYYmmddHHMMSSfff>.')
+@click.option('--experiment', type=int, help='Archive values of this finished experiment.')
+def values(until, experiment):
+    """Move values from the database into the compressed archive."""
+    from app import app_manager
+    from app.src.utils.time import time_from_string
+    count = app_manager.dataManager.archive_values(time_from_string(until), experiment)
+    click.echo('Archived {} values.'.format(count))
+
+
+@app.cli.command('import-values')
+@click.argument('file', type=click.File())
+@click.option('--header', is_flag=True, help='Skip the first line.')
+def import_values(file, header):
+    """Save values from a CSV file with lines device_id,variable_id,time,value[,attribute]."""
+    import csv
+    from itertools import islice
+    from app import app_manager
+    reader = csv.reader(file)
+    if header:
+        next(reader, None)
+    count = 0
+    while True:
+        rows = list(islice(reader, app.config['BULK_SIZE_MAX']))
+        if not rows:
+            break
+        response = app_manager.save_values({'values': rows})
+        if not response.success:
+            click.echo('Values from line {} on have not been saved (rows are counted from it): {}'.format(
+                count + header + 1, response.cause))
+            sys.exit(1)
+        count += response.data['saved']
+    click.echo('Saved {} values.'.format(count))
+
+
+@app.cli.group()
+def partitions():
+    """Maintain the partitions of values and events."""
+
+
+@partitions.command()
+def maintain():
+    """Create future partitions and remove expired ones."""
+    from app import app_manager
+    for table, changes in app_manager.dataManager.maintain_partitions().items():
+        click.echo('{}: created {}, removed {}'.format(table, ', '.join(changes['created']) or 'none',
+                                                        ', '.join(changes['removed']) or 'none'))
@@ -0,0 +1,40 @@
+"""rollup tables of values
+
+Revision ID: 3c9e1f7a2b64
+Revises: f5751393095d
+Create Date: 2026-10-18 17:31:02.514870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a2b64'
+down_revision = 'f5751393095d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('values_minute', 'values_hour'):
+        op.create_table(table,
+                        sa.Column('dev_id', sa.String(length=100), nullable=False),
+                        sa.Column('var_id', sa.String(length=100), nullable=False),
+                        sa.Column('attribute', sa.Integer(), autoincrement=False, nullable=False),
+                        sa.Column('time', mysql.DATETIME(fsp=6), nullable=False),
+                        sa.Column('count', sa.Integer(), nullable=False),
+                        sa.Column('sum', sa.Float(precision=53), nullable=False),
+                        sa.Column('min', sa.Float(), nullable=False),
+                        sa.Column('max', sa.Float(), nullable=False),
+                        sa.Column('last', sa.Float(), nullable=False),
+                        sa.Column('last_time', mysql.DATETIME(fsp=6), nullable=False),
+                        sa.PrimaryKeyConstraint('dev_id', 'var_id', 'attribute', 'time')
+                        )
+    # values stored before the upgrade are aggregated by `flask rollups backfill`
+
+
+def downgrade():
+    op.drop_table('values_hour')
+    op.drop_table('values_minute')
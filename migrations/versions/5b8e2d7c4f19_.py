@@ -0,0 +1,67 @@
+"""partition values and events by months
+
+Revision ID: 5b8e2d7c4f19
+Revises: 8d2f4b6a1c37
+Create Date: 2026-10-18 18:52:03.418266
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2d7c4f19'
+down_revision = '8d2f4b6a1c37'
+branch_labels = None
+depends_on = None
+
+# MySQL requires the partitioning column in every unique key and does not support foreign keys
+# of partitioned tables
+FOREIGN_KEYS = {
+    'values': [('devices', 'dev_id'), ('variables', 'var_id')],
+    'events': [('devices', 'dev_id'), ('event_types', 'event_type')],
+}
+PREMAKE_MONTHS = 3
+
+
+def _month_start(time, months=0):
+    month = time.year * 12 + time.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Partitioning of values and events is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    for table in FOREIGN_KEYS:
+        for foreign_key in sa.inspect(bind).get_foreign_keys(table):
+            op.drop_constraint(foreign_key['name'], table, type_='foreignkey')
+        op.execute('ALTER TABLE `{}` DROP PRIMARY KEY, ADD PRIMARY KEY (id, time)'.format(table))
+
+        # monthly partitions from the oldest row, the rest is created by DataManager.maintain_partitions
+        oldest = bind.execute(sa.text('SELECT MIN(time) FROM `{}`'.format(table))).scalar()
+        start, last = _month_start(oldest or datetime.now()), _month_start(datetime.now(), PREMAKE_MONTHS)
+        definitions = []
+        while start <= last:
+            definitions.append("PARTITION {} VALUES LESS THAN ('{}')".format(
+                start.strftime('p%Y%m'), _month_start(start, 1).strftime('%Y-%m-%d')))
+            start = _month_start(start, 1)
+        definitions.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+        op.execute('ALTER TABLE `{}` PARTITION BY RANGE COLUMNS(time) ({})'.format(table, ', '.join(definitions)))
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Partitioning of values and events is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    for table, foreign_keys in FOREIGN_KEYS.items():
+        op.execute('ALTER TABLE `{}` REMOVE PARTITIONING'.format(table))
+        op.execute('ALTER TABLE `{}` DROP PRIMARY KEY, ADD PRIMARY KEY (id)'.format(table))
+        for referred_table, column in foreign_keys:
+            op.create_foreign_key(None, table, referred_table, [column], ['id'])
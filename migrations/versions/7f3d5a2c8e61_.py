@@ -0,0 +1,83 @@
+"""arguments and responses of events as JSON
+
+Revision ID: 7f3d5a2c8e61
+Revises: e4a1c93b7d20
+Create Date: 2026-10-18 20:58:40.152377
+
+"""
+import ast
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3d5a2c8e61'
+down_revision = 'e4a1c93b7d20'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_events_dev_id_event_type_time': ['dev_id', 'event_type', 'time'],
+    'ix_events_dev_id_command_time': ['dev_id', 'command', 'time'],
+}
+# rows of events converted in one transaction
+BATCH_SIZE = 10000
+
+
+def _from_repr(text):
+    """
+    Parses the string representation of a Python object stored before, strings which are not
+    a representation (e.g. IDs) are kept.
+    """
+    try:
+        obj = ast.literal_eval(text)
+        return json.dumps(obj if not isinstance(obj, (tuple, set)) else list(obj))
+    except (ValueError, SyntaxError, TypeError):
+        return json.dumps(text)
+
+
+def _to_repr(text, length):
+    obj = json.loads(text) if text is not None else None
+    return str(obj)[:length]
+
+
+def _convert(bind, column_type, convert):
+    """
+    Adds new columns for the arguments and response, fills them in batches of IDs and replaces the old columns
+    by them in a single rebuild of the table.
+    """
+    op.execute('ALTER TABLE events ADD COLUMN args_new {}, ADD COLUMN response_new {}'.format(*column_type))
+    last_id = bind.execute(sa.text('SELECT COALESCE(MAX(id), 0) FROM events')).scalar()
+    for low in range(0, last_id, BATCH_SIZE):
+        rows = bind.execute(sa.text('SELECT id, args, response FROM events WHERE id > :low AND id <= :high'),
+                            {'low': low, 'high': low + BATCH_SIZE}).fetchall()
+        if rows:
+            bind.execute(sa.text('UPDATE events SET args_new = :args, response_new = :response WHERE id = :id'),
+                         [{'id': row.id, 'args': convert(row.args, 200), 'response': convert(row.response, 1023)}
+                          for row in rows])
+    op.execute('ALTER TABLE events DROP COLUMN args, DROP COLUMN response, '
+               'CHANGE args_new args {} NOT NULL, CHANGE response_new response {} NOT NULL'.format(*column_type))
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Conversion of events to JSON is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    _convert(bind, ('JSON', 'JSON'), lambda text, length: _from_repr(text))
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'events', columns, unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Conversion of events to JSON is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    for name in INDEXES:
+        op.drop_index(name, table_name='events')
+    _convert(bind, ('VARCHAR(200)', 'VARCHAR(1023)'), _to_repr)
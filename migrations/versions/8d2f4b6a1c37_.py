@@ -0,0 +1,31 @@
+"""keys of replayed spooled rows
+
+Revision ID: 8d2f4b6a1c37
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-18 17:41:26.204517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f4b6a1c37'
+down_revision = '3c9e1f7a2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('spool_replays',
+                    sa.Column('key', sa.String(length=32), nullable=False),
+                    sa.Column('time', mysql.DATETIME(fsp=6), nullable=False),
+                    sa.PrimaryKeyConstraint('key')
+                    )
+    op.create_index(op.f('ix_spool_replays_time'), 'spool_replays', ['time'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_spool_replays_time'), table_name='spool_replays')
+    op.drop_table('spool_replays')
@@ -0,0 +1,75 @@
+"""numbers of devices and variables in values
+
+Revision ID: e4a1c93b7d20
+Revises: 5b8e2d7c4f19
+Create Date: 2026-10-18 19:46:11.730912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c93b7d20'
+down_revision = '5b8e2d7c4f19'
+branch_labels = None
+depends_on = None
+
+NUMBERED_TABLES = ('devices', 'variables')
+INDEXES = {
+    'ix_values_dev_id_id': ['dev_id', 'id'],
+    'ix_values_dev_id_time': ['dev_id', 'time'],
+    'ix_values_dev_id_var_id_time': ['dev_id', 'var_id', 'time'],
+}
+# rows of values converted in one transaction
+BATCH_SIZE = 100000
+
+
+def _convert_values(bind, column_type, assignment):
+    """
+    Adds new device and variable columns to values, fills them in batches of IDs and replaces the old columns
+    by them in a single rebuild of the table.
+    """
+    op.execute('ALTER TABLE `values` ADD COLUMN dev_id_new {0}, ADD COLUMN var_id_new {0}'.format(column_type))
+    last_id = bind.execute(sa.text('SELECT COALESCE(MAX(id), 0) FROM `values`')).scalar()
+    for low in range(0, last_id, BATCH_SIZE):
+        bind.execute(sa.text('UPDATE `values` v JOIN devices d ON {} JOIN variables r ON {} '
+                             'SET v.dev_id_new = d.{}, v.var_id_new = r.{} WHERE v.id > :low AND v.id <= :high'
+                             .format(*assignment)), {'low': low, 'high': low + BATCH_SIZE})
+    changes = ['DROP INDEX {}'.format(name) for name in INDEXES]
+    changes += ['DROP COLUMN dev_id', 'DROP COLUMN var_id',
+                'CHANGE dev_id_new dev_id {} NOT NULL'.format(column_type),
+                'CHANGE var_id_new var_id {} NOT NULL'.format(column_type)]
+    changes += ['ADD INDEX {} ({})'.format(name, ', '.join(columns)) for name, columns in INDEXES.items()]
+    op.execute('ALTER TABLE `values` {}'.format(', '.join(changes)))
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Numbering of devices and variables is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    for table in NUMBERED_TABLES:
+        op.add_column(table, sa.Column('number', sa.SmallInteger(), nullable=True))
+        op.execute('SET @number = 0')
+        op.execute('UPDATE `{}` SET number = (@number := @number + 1) ORDER BY id'.format(table))
+        op.alter_column(table, 'number', existing_type=sa.SmallInteger(), nullable=False)
+        op.create_unique_constraint(None, table, ['number'])
+
+    _convert_values(bind, 'SMALLINT', ('d.id = v.dev_id', 'r.id = v.var_id', 'number', 'number'))
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        raise NotImplementedError('Numbering of devices and variables is supported only by MySQL, not by {}'.format(
+            bind.dialect.name))
+
+    _convert_values(bind, 'VARCHAR(100)', ('d.number = v.dev_id', 'r.number = v.var_id', 'id', 'id'))
+
+    for table in NUMBERED_TABLES:
+        for constraint in sa.inspect(bind).get_unique_constraints(table):
+            if constraint['column_names'] == ['number']:
+                op.drop_constraint(constraint['name'], table, type_='unique')
+        op.drop_column(table, 'number')
@@ -0,0 +1,39 @@
+"""composite indexes for values and events
+
+Revision ID: f5751393095d
+Revises: bc7a92ac0ebe
+Create Date: 2026-10-18 17:25:41.108254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5751393095d'
+down_revision = 'bc7a92ac0ebe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_values_dev_id_id', 'values', ['dev_id', 'id'], unique=False)
+    op.create_index('ix_values_dev_id_time', 'values', ['dev_id', 'time'], unique=False)
+    op.create_index('ix_values_dev_id_var_id_time', 'values', ['dev_id', 'var_id', 'time'], unique=False)
+    op.create_index('ix_events_dev_id_time', 'events', ['dev_id', 'time'], unique=False)
+
+
+def downgrade():
+    # the foreign key on dev_id requires an index - MySQL may have replaced the original one by the new indexes
+    _ensure_dev_id_index('events')
+    op.drop_index('ix_events_dev_id_time', table_name='events')
+    _ensure_dev_id_index('values')
+    op.drop_index('ix_values_dev_id_var_id_time', table_name='values')
+    op.drop_index('ix_values_dev_id_time', table_name='values')
+    op.drop_index('ix_values_dev_id_id', table_name='values')
+
+
+def _ensure_dev_id_index(table):
+    indexes = sa.inspect(op.get_bind()).get_indexes(table)
+    if not any(index['column_names'] == ['dev_id'] for index in indexes):
+        op.create_index('dev_id', table, ['dev_id'], unique=False)
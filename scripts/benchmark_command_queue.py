@@ -0,0 +1,57 @@
+"""
+Measures the cost of putting a command into and getting it from the command queue of a Connector
+while the given number of commands is already queued, for the heap-based PriorityQueue and for
+the previous implementation which sorted the whole list on every put and popped its first item.
+
+Run it from the repository root:
+
+    python3 scripts/benchmark_command_queue.py --queued 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.src.utils.abstract_device import PriorityQueue  # noqa: E402
+
+
+class SortedListQueue:
+    """
+    The previous implementation of the queue.
+    """
+    def __init__(self):
+        self._items = []
+
+    def put(self, command, priority):
+        self._items.append((priority, command))
+        self._items.sort(key=lambda item: item[0])
+
+    def get(self):
+        return self._items.pop(0)[1]
+
+
+def measure(queue_class, queued, repeats):
+    queue = queue_class()
+    for i in range(queued):
+        queue.put('read {}'.format(i), 2)
+    start = time.perf_counter()
+    for i in range(repeats):
+        queue.put('command {}'.format(i), i % 3)
+        queue.get()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queued', type=int, default=10000, help='number of commands already queued')
+    parser.add_argument('--repeats', type=int, default=1000, help='number of measured put/get pairs')
+    args = parser.parse_args()
+
+    print('{:<20} {:>16}'.format('queue', 'put + get [us]'))
+    for queue_class in [SortedListQueue, PriorityQueue]:
+        print('{:<20} {:>16.2f}'.format(queue_class.__name__, measure(queue_class, args.queued, args.repeats)))
+
+
+if __name__ == '__main__':
+    main()
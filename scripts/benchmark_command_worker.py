@@ -0,0 +1,128 @@
+"""
+Measures how many threads are started and how long commands wait for their execution when several
+threads post commands to a Connector in bursts, for the persistent command worker and for the previous
+implementation which started a new thread to drain the queue whenever no drain thread seemed to run.
+
+Run it from the repository root:
+
+    python3 scripts/benchmark_command_worker.py --posters 8 --commands 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.src.utils.abstract_device import Connector  # noqa: E402
+
+
+class BenchmarkCommand:
+    def __init__(self):
+        self.command_id = 'read'
+        self.args = []
+        self.posted = None
+        self.executed = None
+        self._resolved = threading.Event()
+
+    def resolve(self):
+        self.executed = time.perf_counter()
+        self._resolved.set()
+
+    def await_cmd(self, timeout=None):
+        return self._resolved.wait(timeout)
+
+
+class BenchmarkDevice(Connector):
+    def __init__(self, config):
+        super(BenchmarkDevice, self).__init__(config)
+        self.interpreter = {'read': self.read}
+
+    def read(self):
+        return {'value': 1}
+
+    def disconnect(self):
+        pass
+
+    def test_connection(self):
+        return True
+
+
+class SpawningDevice(BenchmarkDevice):
+    """
+    The previous implementation of posting commands.
+    """
+    def __init__(self, config):
+        super(SpawningDevice, self).__init__(config)
+        self._is_queue_check_running = False
+
+    def post_command(self, cmd, priority=2):
+        cmd.device_id = self.device_id
+        self._queue.put(cmd, priority)
+        if not self._is_queue_check_running:
+            t = threading.Thread(target=self._queue_new_item)
+            t.start()
+
+    def _queue_new_item(self):
+        self._is_queue_check_running = True
+        while self._queue.has_items():
+            self._execute_command(self._queue.get())
+        self._is_queue_check_running = False
+
+
+def measure(device_class, posters, commands, burst):
+    device = device_class({'device_id': 'benchmark', 'device_class': 'benchmark', 'device_type': 'benchmark'})
+    started = [0]
+    original_start = threading.Thread.start
+
+    def counting_start(thread):
+        started[0] += 1
+        original_start(thread)
+
+    def post():
+        for i in range(commands):
+            command = posted[threading.current_thread().name][i]
+            command.posted = time.perf_counter()
+            device.post_command(command)
+            if i % burst == burst - 1:
+                time.sleep(0.001)
+
+    posted = {'poster {}'.format(i): [BenchmarkCommand() for _ in range(commands)] for i in range(posters)}
+    all_commands = [command for queued in posted.values() for command in queued]
+    threads = [threading.Thread(target=post, name=name) for name in posted]
+    threading.Thread.start = counting_start
+    try:
+        for thread in threads:
+            original_start(thread)
+        for thread in threads:
+            thread.join()
+        deadline = time.perf_counter() + 5
+        stranded = len([command for command in all_commands
+                        if not command.await_cmd(max(0, deadline - time.perf_counter()))])
+    finally:
+        threading.Thread.start = original_start
+        device.end()
+
+    latencies = [(command.executed - command.posted) * 1000 for command in all_commands if command.executed]
+    latencies.sort()
+    return started[0], stranded, statistics.mean(latencies), statistics.pstdev(latencies), \
+        latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posters', type=int, default=8, help='number of threads posting commands')
+    parser.add_argument('--commands', type=int, default=500, help='number of commands posted by every thread')
+    parser.add_argument('--burst', type=int, default=1, help='number of commands posted without a pause')
+    args = parser.parse_args()
+
+    print('{:<18} {:>8} {:>9} {:>10} {:>10} {:>10}'.format('device', 'threads', 'stranded', 'mean [ms]',
+                                                            'stdev [ms]', 'p99 [ms]'))
+    for device_class in [SpawningDevice, BenchmarkDevice]:
+        print('{:<18} {:>8} {:>9} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            device_class.__name__, *measure(device_class, args.posters, args.commands, args.burst)))
+
+
+if __name__ == '__main__':
+    main()
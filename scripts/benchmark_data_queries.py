@@ -0,0 +1,129 @@
+"""
+Measures the read paths used by DataManager.get_data and DataManager.get_latest_data
+without (IGNORE INDEX) and with the composite indexes on the values and events tables.
+
+Run it from the repository root with the same environment as run.sh, e.g.:
+
+    . DB_CONFIG && USERNAME=$USERNAME PASSWORD=$PASSWORD database=localhost \
+        python3 scripts/benchmark_data_queries.py --seed 2000000
+
+The --seed option first inserts synthetic values for a dedicated benchmark device.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config  # noqa: E402
+
+VALUES_INDEXES = 'ix_values_dev_id_id, ix_values_dev_id_time, ix_values_dev_id_var_id_time'
+EVENTS_INDEXES = 'ix_events_dev_id_time'
+
+QUERIES = [
+    ('values by log id', VALUES_INDEXES,
+     'SELECT * FROM `values` {hint} WHERE dev_id = :dev_id AND id > :log_id'),
+    ('values by time', VALUES_INDEXES,
+     'SELECT * FROM `values` {hint} WHERE dev_id = :dev_id AND time > :time'),
+    ('values of variable by time', VALUES_INDEXES,
+     'SELECT * FROM `values` {hint} WHERE dev_id = :dev_id AND var_id = :var_id AND time > :time'),
+    ('latest value', VALUES_INDEXES,
+     'SELECT * FROM `values` {hint} WHERE dev_id = :dev_id ORDER BY id DESC LIMIT 1'),
+    ('events by time', EVENTS_INDEXES,
+     'SELECT * FROM events {hint} WHERE dev_id = :device_id AND time > :time'),
+]
+
+VARIABLES = ['od', 'temp', 'pH', 'o2', 'light_intensity', 'pwm_pulse']
+
+
+def numbers(connection, table):
+    """
+    Values refer to devices and variables by their numbers instead of their IDs.
+    """
+    return dict(connection.execute(text('SELECT id, number FROM {}'.format(table))).fetchall())
+
+
+def seed(connection, device_id, rows, other_devices=20):
+    device_numbers = numbers(connection, 'devices')
+    new_devices = [dev_id for dev_id in ['{}-{}'.format(device_id, i) for i in range(other_devices)] + [device_id]
+                   if dev_id not in device_numbers]
+    if new_devices:
+        first = max(device_numbers.values(), default=0) + 1
+        connection.execute(text("INSERT INTO devices (id, number, device_class, device_type) "
+                                "VALUES (:id, :number, 'test', 'PBR')"),
+                           [{'id': dev_id, 'number': first + i} for i, dev_id in enumerate(new_devices)])
+        device_numbers = numbers(connection, 'devices')
+    variable_numbers = numbers(connection, 'variables')
+
+    start = datetime.utcnow() - timedelta(seconds=rows)
+    batch = []
+    for i in range(rows):
+        # the benchmark device is interleaved with other devices, as on a real rack
+        dev_id = device_id if i % (other_devices + 1) == 0 else '{}-{}'.format(device_id, i % other_devices)
+        batch.append({'time': start + timedelta(seconds=i), 'value': random.random(),
+                      'dev_id': device_numbers[dev_id], 'var_id': variable_numbers[VARIABLES[i % len(VARIABLES)]]})
+        if len(batch) == 10000:
+            _insert_values(connection, batch)
+            batch = []
+    if batch:
+        _insert_values(connection, batch)
+
+
+def _insert_values(connection, batch):
+    connection.execute(text("INSERT INTO `values` (time, value, dev_id, var_id) "
+                            "VALUES (:time, :value, :dev_id, :var_id)"), batch)
+
+
+def measure(connection, query, params, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        connection.execute(text(query), params).fetchall()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def explain(connection, query, params):
+    row = connection.execute(text('EXPLAIN ' + query), params).mappings().first()
+    return '{} ({} rows)'.format(row['key'], row['rows'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=os.getenv('FLASK_CONFIG') or 'default')
+    parser.add_argument('--device-id', default='benchmark-device')
+    parser.add_argument('--seed', type=int, default=0, help='number of synthetic values to insert first')
+    parser.add_argument('--tail', type=int, default=1000, help='number of newest values of the device to read')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(config[args.config].SQLALCHEMY_DATABASE_URI)
+    if args.seed:
+        with engine.begin() as connection:
+            seed(connection, args.device_id, args.seed)
+
+    with engine.connect() as connection:
+        device_number = numbers(connection, 'devices').get(args.device_id)
+        bounds = connection.execute(text("SELECT id, time FROM `values` WHERE dev_id = :dev_id "
+                                         "ORDER BY id DESC LIMIT 1 OFFSET :tail"),
+                                    {'dev_id': device_number, 'tail': args.tail}).first()
+        if bounds is None:
+            sys.exit('Not enough values for device {}, use --seed.'.format(args.device_id))
+        params = {'dev_id': device_number, 'device_id': args.device_id, 'log_id': bounds[0], 'time': bounds[1],
+                  'var_id': numbers(connection, 'variables')[VARIABLES[0]]}
+
+        print('{:<28} {:>12} {:>12}   {}'.format('query', 'before [ms]', 'after [ms]', 'index used after'))
+        for name, indexes, query in QUERIES:
+            before = measure(connection, query.format(hint='IGNORE INDEX ({})'.format(indexes)), params, args.repeats)
+            after = measure(connection, query.format(hint=''), params, args.repeats)
+            print('{:<28} {:>12.2f} {:>12.2f}   {}'.format(name, before, after,
+                                                          explain(connection, query.format(hint=''), params)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 import unittest
+from datetime import datetime
 from unittest import mock
 
 from app.command import Command
-from app.src.utils.errors import IdError
+from app.models import Value
+from app.src.utils.errors import IdError, BusyError
 from app import create_app, db, AppManager
 from app.src.utils.response import Response
 
@@ -118,7 +120,9 @@ class AppManagerTestCases(unittest.TestCase):
         self.AM.taskManager.ping = mock.Mock(return_value=task_data)
 
         # correct behaviour
-        result = Response(True, {'devices': device_data, 'tasks': task_data}, None)
+        result = Response(True, {'devices': device_data, 'tasks': task_data, 'commands': {},
+                                 'data_cache': {'hits': 0, 'misses': 0, 'coalesced': 0, 'size': 0},
+                                 'buffered_values': 0}, None)
         self.assertEqual(self.AM.ping(), result)
 
     def get_data(self):
@@ -136,17 +140,100 @@ class AppManagerTestCases(unittest.TestCase):
         self.AM.dataManager.get_data = mock.Mock(side_effect=e)
         self.assertEqual(self.AM.get_data(config), result)
 
+    def test_get_data_of_devices(self):
+        config = {'device_ids': 'dev_id_23,dev_id_24', 'type': 'values'}
+        data = {'dev_id_23': {}, 'dev_id_24': {}}
+        self.AM.dataManager.get_data_of_devices = mock.Mock(return_value=(data, 'next'))
+
+        # correct behaviour
+        self.assertEqual(self.AM.get_data(config), Response(True, data, None, extra={'next_cursor': 'next'}))
+        self.AM.dataManager.get_data_of_devices.assert_called_with(['dev_id_23', 'dev_id_24'], 'values', None,
+                                                                   None, None, None, None, None)
+        self.AM.get_data(dict(config, time='20210101100000000000', until='20210101110000000000', variables='od'))
+        self.AM.dataManager.get_data_of_devices.assert_called_with(['dev_id_23', 'dev_id_24'], 'values', None,
+                                                                   datetime(2021, 1, 1, 10), datetime(2021, 1, 1, 11),
+                                                                   ['od'], None, None)
+
+        # paginated per device
+        self.AM.get_data(dict(config, limit='10', cursor='abc'))
+        self.AM.dataManager.get_data_of_devices.assert_called_with(['dev_id_23', 'dev_id_24'], 'values', None,
+                                                                   None, None, None, 10, 'abc')
+
+        # data of several devices are not streamed
+        self.assertIsInstance(self.AM.get_data(dict(config, format='ndjson')).cause, SyntaxError)
+
+        # a device is required
+        self.assertFalse(self.AM.get_data({'type': 'values'}).success)
+
+    def test_wait_for_data(self):
+        config = {'device_id': 'dev_id_23', 'type': 'values', 'cursor': 'abc', 'timeout': '10'}
+        self.AM.dataManager.wait_for_data = mock.Mock(return_value=({}, 'abc'))
+
+        # correct behaviour
+        self.assertEqual(self.AM.wait_for_data(config),
+                         Response(True, {}, None, extra={'next_cursor': 'abc'}))
+        self.AM.dataManager.wait_for_data.assert_called_with('dev_id_23', 'values', None, 'abc', 10, None)
+
+        # too many waiting requests
+        e = BusyError('Too many requests are waiting for data, try again later')
+        self.AM.dataManager.wait_for_data = mock.Mock(side_effect=e)
+        response = self.AM.wait_for_data(config)
+        self.assertEqual(Response(False, None, e), response)
+        self.assertEqual(503, response.to_json().status_code)
+
+    def test_get_events(self):
+        config = {'device_id': 'dev_id_23', 'event_types': '1,2', 'commands': 'set-pump', 'time': '20210101100000000'}
+        data = {'some random data': 123}
+        self.AM.dataManager.get_events = mock.Mock(return_value=data)
+
+        # correct behaviour
+        self.assertEqual(self.AM.get_events(config), Response(True, data, None))
+        self.AM.dataManager.get_events.assert_called_with('dev_id_23', [1, 2], ['set-pump'],
+                                                          datetime(2021, 1, 1, 10), None)
+
+        # invalid event type
+        self.assertFalse(self.AM.get_events(dict(config, event_types='pump')).success)
+
     def test_get_latest_data(self):
         config = {'device_id': 23, 'type': 'values'}
-        data = {'some random data': 123}
-        self.AM.dataManager.get_latest_data = mock.Mock(return_value=data)
+        value = Value(id=1, time=datetime(2021, 1, 1, 10), value=1.5, dev_id='dev_id_23', var_id='od', attribute=None,
+                      note=None)
+        self.AM.dataManager.get_latest_data = mock.Mock(return_value=value)
 
         # correct behaviour
+        self.assertEqual(self.AM.get_latest_data(config),
+                         Response(True, {'id': 1, 'time': '20210101100000000000', 'value': 1.5, 'dev_id': 'dev_id_23',
+                                         'var_id': 'od', 'attribute': None, 'note': None}, None))
+
+        # every variable
+        data = {'od': [{'some random data': 123}]}
         result = Response(True, data, None)
-        self.assertEqual(self.AM.get_latest_data(config), result)
+        self.AM.dataManager.get_latest_data = mock.Mock(return_value=data)
+        self.assertEqual(self.AM.get_latest_data(dict(config, variables='*')), result)
+        self.AM.dataManager.get_latest_data.assert_called_with(23, 'values', True, None)
+        self.AM.get_latest_data(dict(config, variables='od,temp'))
+        self.AM.dataManager.get_latest_data.assert_called_with(23, 'values', True, ['od', 'temp'])
 
         # exception in progress
         e = AttributeError("Missing a key attribute.")
         result = Response(False, None, e)
         self.AM.dataManager.get_latest_data = mock.Mock(side_effect=e)
         self.assertEqual(self.AM.get_latest_data(config), result)
+
+    def test_save_values(self):
+        self.AM.dataManager.save_values = mock.Mock(return_value=2)
+        values = [['dev_id_23', 'od', '20210101100000000000', 1.5],
+                  ['dev_id_23', 'temp', '20210101100001000000', '25', '2']]
+
+        # correct behaviour
+        self.assertEqual(self.AM.save_values({'values': values}), Response(True, {'saved': 2}, None))
+        rows = self.AM.dataManager.save_values.call_args[0][0]
+        self.assertEqual([(1.5, None), (25.0, 2)], [(row['value'], row['attribute']) for row in rows])
+
+        # all invalid values are reported
+        result = self.AM.save_values({'values': values + [['dev_id_23', 'od', 'yesterday', 'nan'], ['dev_id_23']]})
+        self.assertFalse(result.success)
+        self.assertEqual('Invalid values have been provided: row 2: invalid time: yesterday; '
+                         'row 3: expected [device_id, variable_id, time, value, attribute]', str(result.cause))
+        self.assertFalse(self.AM.save_values({'values': []}).success)
+        self.assertEqual(1, self.AM.dataManager.save_values.call_count)
@@ -1,13 +1,27 @@
+import json
+import tempfile
+import threading
 import unittest
+from datetime import datetime
+from threading import Thread, Timer
 from unittest import mock
 
-from sqlalchemy.exc import OperationalError
+from flask import has_app_context
+from sqlalchemy import cast
+from sqlalchemy.exc import OperationalError, IntegrityError
 
-from app.models import Device, Value, Variable, VariableType, Experiment
+from app.models import Device, Value, Variable, VariableType, Experiment, MinuteRollup, HourRollup, Event, \
+    SpoolReplay
 from app.src.data_manager import DataManager
+from app.src.utils.archive import Archive
+from app.src.utils.buffer import WriteBuffer
+from app.src.utils.errors import IdError, BusyError
+from app.src.utils.keys import SurrogateKeys
 from app import create_app, db
 from app.src.utils.permanent_data import VARIABLES
-from app.src.utils.time import now, time_to_string
+from app.src.utils.response import Response
+from app.src.utils.session import session_scope
+from app.src.utils.time import now, time_to_string, time_from_string, time_to_microseconds
 
 
 class DataManagerTestCases(unittest.TestCase):
@@ -35,10 +49,30 @@ class DataManagerTestCases(unittest.TestCase):
         exists = Device.query.filter_by(id='dev_id_23').first()
         self.assertIsNotNone(exists)
 
+        # existing device is not inserted again
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.assertEqual(Device.query.filter_by(id='dev_id_23').count(), 1)
+
+        # items with autoincrement ID are always inserted
+        for _ in range(2):
+            self.DM.insert(Experiment(dev_id='dev_id_23', start=now()), Experiment)
+        self.assertEqual(Experiment.query.filter_by(dev_id='dev_id_23').count(), 2)
+
         # not all required attributes
         device = Device(id='dev_id_wrong', device_class='PSI')
         self.assertRaises(OperationalError, self.DM.insert, device, Device)
 
+    def test_insert_taken_number(self):
+        self.DM.insert(Device(id='dev_id_1', device_class='PSI', device_type='PBR'), Device)
+
+        # the number of a new device is taken by another process meanwhile
+        with mock.patch.object(Device.__table__.c.number.default, 'arg', side_effect=[1, 2]):
+            device = Device(id='dev_id_2', device_class='PSI', device_type='PBR')
+            self.DM.insert(device, Device)
+        self.assertEqual(2, device.number)
+        self.assertEqual({'dev_id_1': 1, 'dev_id_2': 2}, dict(db.session.query(Device.id, Device.number)))
+
     def test_update(self):
         device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
         self.DM.insert(device, Device)
@@ -86,6 +120,51 @@ class DataManagerTestCases(unittest.TestCase):
         # check variables
         self.assertIn('new_var', set(self.DM.load_variables()))
 
+    def test_save_value_buffered(self):
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.DM.values_buffer.size = 3
+
+        # buffered, not yet written
+        for i in range(2):
+            self.DM.save_value(Value(time=now(), value=i, dev_id='dev_id_23', var_id='od', attribute=1, note=None))
+        self.assertEqual(self.DM.buffered_values, 2)
+        self.assertEqual(Value.query.filter_by(dev_id='dev_id_23').count(), 0)
+
+        # full buffer is written in one batch
+        self.DM.save_value(Value(time=now(), value=2, dev_id='dev_id_23', var_id='od', attribute=1, note=None))
+        self.assertEqual(self.DM.buffered_values, 0)
+        self.assertEqual(Value.query.filter_by(dev_id='dev_id_23').count(), 3)
+
+        # remaining values are written on flush
+        self.DM.save_value(Value(time=now(), value=3, dev_id='dev_id_23', var_id='od', attribute=1, note=None))
+        self.DM.end()
+        self.assertEqual(self.DM.buffered_values, 0)
+        self.assertEqual(Value.query.filter_by(dev_id='dev_id_23').count(), 4)
+
+    def test_write_buffer_faulty_row(self):
+        written = []
+
+        def writer(rows):
+            if any(row['value'] is None for row in rows):
+                raise IntegrityError('INSERT', rows, Exception('value cannot be null'))
+            written.extend(rows)
+
+        buffer = WriteBuffer(writer, size=10)
+        for value in [1, None, 3]:
+            buffer.put({'value': value})
+        buffer.stop()
+
+        # only the faulty row is dropped
+        self.assertEqual(written, [{'value': 1}, {'value': 3}])
+        self.assertEqual(buffer.pending, 0)
+
+        # rows put after the buffer was stopped are written immediately
+        buffer.put({'value': 4})
+        self.assertEqual(written[-1], {'value': 4})
+        self.assertEqual(buffer.pending, 0)
+
     def test_save_variable(self):
         variable = "new_var"
 
@@ -95,14 +174,14 @@ class DataManagerTestCases(unittest.TestCase):
 
         # new variable
         self.DM.save_variable(variable)
-        variable = Variable(id=variable, type=VariableType.MEASURED, unit=None, name=None)
+        variable = Variable(id=variable, number=1, type=VariableType.MEASURED, unit=None, name=None)
 
         result = Variable.query.filter_by(id="new_var").first()
         self.assertEqual(variable, result)
 
     def test_save_device(self):
         connector = mock.Mock(device_id='dev_id', device_class='PSI', device_type='PBR', address='home')
-        device = Device(id=connector.device_id, device_class=connector.device_class,
+        device = Device(id=connector.device_id, number=1, device_class=connector.device_class,
                         device_type=connector.device_type, address=connector.address)
         self.DM.save_experiment = mock.Mock()
 
@@ -194,6 +273,589 @@ class DataManagerTestCases(unittest.TestCase):
         result = self.DM.get_data(None, values[2].time, device.id, 'values')
         self.assertEqual(expected_results, result)
 
+    def test_iter_data(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        # store some values
+        values = [Value(id=i, time=now(), value=20.0 + i, dev_id='dev_id_23', var_id='od', attribute=1, note=None)
+                  for i in range(1, 6)]
+
+        for value in values:
+            self.DM.save_value(value)
+
+        expected_results = [{'id': obj.id, 'time': time_to_string(obj.time), 'value': obj.value, 'var_id': obj.var_id,
+                             'dev_id': obj.dev_id, 'attribute': obj.attribute, 'note': obj.note}
+                            for obj in values[3:]]
+
+        # values from id
+        self.assertEqual(expected_results, list(self.DM.iter_data(3, None, device.id, 'values')))
+
+        # values from time
+        self.assertEqual(expected_results, list(self.DM.iter_data(None, values[2].time, device.id, 'values')))
+
+    def test_get_data_page(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        # store some values
+        values = [Value(id=i, time=now(), value=20.0 + i, dev_id='dev_id_23', var_id='od', attribute=1, note=None)
+                  for i in range(1, 6)]
+
+        for value in values:
+            self.DM.save_value(value)
+
+        # walk all values from id
+        result, cursor = self.DM.get_data_page(1, None, device.id, 'values', 2)
+        self.assertEqual([2, 3], list(result))
+        result, cursor = self.DM.get_data_page(None, None, device.id, 'values', 2, cursor)
+        self.assertEqual([4, 5], list(result))
+        self.assertIsNone(cursor)
+
+        # walk all values from time
+        result, cursor = self.DM.get_data_page(None, values[0].time, device.id, 'values', 3)
+        self.assertEqual([2, 3, 4], list(result))
+        result, cursor = self.DM.get_data_page(None, None, device.id, 'values', 3, cursor)
+        self.assertEqual([5], list(result))
+        self.assertIsNone(cursor)
+
+        # invalid cursor
+        self.assertRaises(SyntaxError, self.DM.get_data_page, None, None, device.id, 'values', 3, 'invalid')
+
+    def test_session_scope(self):
+        results = []
+
+        def work():
+            with session_scope():
+                db.session.add(Device(id='dev_id_23', device_class='PSI', device_type='PBR'))
+                db.session.commit()
+            # the application context is kept for the lifetime of the thread
+            results.append(has_app_context())
+            # failed unit of work is rolled back
+            try:
+                with session_scope():
+                    db.session.add(Device(id='dev_id_24', device_class='PSI'))
+                    db.session.commit()
+            except Exception:
+                results.append('failed')
+            with session_scope():
+                results.append(Device.query.count())
+
+        thread = Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertEqual([True, 'failed', 1], results)
+
+    def test_spool(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.DM.spool_retry_interval = 0.05
+        unavailable = OperationalError('INSERT', {}, Exception(2006, 'MySQL server has gone away'))
+
+        # the database goes away, values and events are spooled
+        with mock.patch.object(DataManager, '_insert_values', side_effect=unavailable), \
+                mock.patch.object(DataManager, 'insert', side_effect=unavailable):
+            self.DM.save_value(Value(time=now(), value=1.0, dev_id='dev_id_23', var_id='new_variable'))
+            self.DM.event_device_end(device.id)
+            self.assertFalse(self.DM.database_available)
+            self.assertEqual(3, len(self.DM.spool))
+            self.assertEqual(1.0, self.DM.get_latest_data(device.id).value)
+            forwarder = self.DM._forwarder
+
+        # the database recovers and the spool is replayed, then the forwarder ends
+        forwarder.join(5)
+        self.assertFalse(forwarder.is_alive())
+        self.assertTrue(self.DM.database_available)
+        self.assertEqual(0, len(self.DM.spool))
+        self.assertEqual([1.0], [value.value for value in Value.query.filter_by(var_id='new_variable')])
+        self.assertEqual(1, Event.query.count())
+        self.assertEqual(2, SpoolReplay.query.count())
+
+        # replay is idempotent
+        self.DM.spool.append('values', [{'time': now(), 'value': 2.0, 'dev_id': 'dev_id_23', 'var_id': 'od'}])
+        items = self.DM.spool.peek(10)
+        self.DM._replay(items)
+        self.DM._replay(items)
+        self.assertEqual(1, Value.query.filter_by(var_id='od').count())
+
+        # errors of the data are not spooled
+        self.assertRaises((OperationalError, IntegrityError), self.DM.save_event, Event(dev_id='dev_id_23'))
+        self.assertTrue(self.DM.database_available)
+
+    def test_wait_for_data(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.DM.save_value(Value(time=now(), value=1.0, dev_id='dev_id_23', var_id='od'))
+
+        # no data newer than the newest stored ones
+        data, cursor = self.DM.wait_for_data(device.id, timeout=0)
+        self.assertEqual({}, data)
+
+        # data stored while waiting
+        timer = Timer(0.1, self.DM.save_value, [Value(time=now(), value=2.0, dev_id='dev_id_23', var_id='od')])
+        timer.start()
+        data, cursor = self.DM.wait_for_data(device.id, cursor=cursor, timeout=5)
+        timer.join()
+        self.assertEqual([2.0], [row['value'] for row in data.values()])
+        self.assertEqual(({}, cursor), self.DM.wait_for_data(device.id, cursor=cursor, timeout=0))
+
+        # older data are retrieved immediately
+        data, _ = self.DM.wait_for_data(device.id, log_id=0, timeout=0)
+        self.assertEqual([1.0, 2.0], [row['value'] for row in data.values()])
+
+        # the newest ID is not looked up for a device nobody waits for
+        self.assertEqual(set(), self.DM.notifier.watched('values', [device.id]))
+        self.DM.save_value(Value(time=now(), value=3.0, dev_id='dev_id_23', var_id='od'))
+        data, _ = self.DM.wait_for_data(device.id, cursor=cursor, timeout=0)
+        self.assertEqual([3.0], [row['value'] for row in data.values()])
+
+        # cursor ordered by time
+        _, cursor = self.DM.get_data_page(None, datetime(2021, 1, 1), device.id, 'values', 1)
+        self.assertRaises(SyntaxError, self.DM.wait_for_data, device.id, 'values', None, cursor, 0)
+
+        # the number of waiting requests is limited
+        self.app.config['DATA_WAIT_MAX_REQUESTS'] = 1
+        DM = DataManager()
+        _, cursor = DM.wait_for_data(device.id, timeout=0)
+        waiting = threading.Event()
+        wait = DM.notifier.wait
+
+        def notifier_wait(*args):
+            waiting.set()
+            return wait(*args)
+
+        def wait_for_data():
+            with self.app.app_context():
+                DM.wait_for_data(device.id, 'values', None, cursor, 5)
+
+        with mock.patch.object(DM.notifier, 'wait', side_effect=notifier_wait):
+            thread = Thread(target=wait_for_data)
+            thread.start()
+            self.assertTrue(waiting.wait(5))
+            self.assertRaises(BusyError, DM.wait_for_data, device.id, 'values', None, cursor, 0)
+            DM.save_value(Value(time=now(), value=4.0, dev_id='dev_id_23', var_id='od'))
+            thread.join()
+        data, _ = DM.wait_for_data(device.id, 'values', None, cursor)
+        self.assertEqual([4.0], [row['value'] for row in data.values()])
+
+    def test_stream_data(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.app.config['DATA_STREAM_BUFFER_SIZE'] = 2
+        self.app.config['DATA_STREAM_HEARTBEAT'] = 0
+        values = self.DM.stream_data(device.id, ['values'])
+        everything = self.DM.stream_data(device.id)
+
+        # saved data are received by the subscribers
+        self.DM.save_value(Value(time=datetime(2021, 1, 1), value=1.0, dev_id='dev_id_23', var_id='od'))
+        messages = next(values)
+        self.assertEqual(['values'], [event for event, data in messages])
+        self.assertEqual({'time': '20210101000000000000', 'value': 1.0, 'dev_id': 'dev_id_23', 'var_id': 'od',
+                          'attribute': None, 'note': None}, json.loads(messages[0][1]))
+        self.DM.event_device_end(device.id)
+        self.assertIsNone(next(values))
+        self.assertEqual(['values', 'events'], [event for event, data in next(everything)])
+
+        # a slow subscriber has to resync
+        for i in range(3):
+            self.DM.save_value(Value(time=now(), value=i, dev_id='dev_id_23', var_id='od'))
+        messages = next(values)
+        self.assertEqual(['resync', 'values'], [event for event, data in messages])
+        self.assertEqual(2, json.loads(messages[1][1])['value'])
+
+        # closed streams are unsubscribed
+        values.close()
+        everything.close()
+        self.assertFalse(self.DM.broadcaster.has_subscribers(device.id, 'values'))
+
+        # the number of streams is limited
+        self.app.config['DATA_STREAM_MAX_SUBSCRIBERS'] = 1
+        self.app.config['DATA_STREAM_LIFETIME'] = 0
+        DM = DataManager()
+        stream = DM.stream_data(device.id)
+        self.assertRaises(BusyError, DM.stream_data, device.id)
+
+        # streams end after their lifetime
+        self.assertEqual([], list(stream))
+        self.assertFalse(DM.broadcaster.has_subscribers(device.id, 'values'))
+
+        # a response which was never sent releases its stream
+        Response(True, DM.stream_data(device.id), None).to_event_stream().close()
+        DM.stream_data(device.id).close()
+
+    def test_get_aggregated_data(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        # store values in two minutes, the first of them on two attributes
+        values = [Value(time=datetime(2021, 1, 1, 10, 0, 10), value=1.0, dev_id='dev_id_23', var_id='od', attribute=0),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 20), value=3.0, dev_id='dev_id_23', var_id='od', attribute=0),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 30), value=2.0, dev_id='dev_id_23', var_id='od', attribute=0),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 30), value=9.0, dev_id='dev_id_23', var_id='od', attribute=1),
+                  Value(time=datetime(2021, 1, 1, 10, 1, 10), value=5.0, dev_id='dev_id_23', var_id='od', attribute=0),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 10), value=25.0, dev_id='dev_id_23', var_id='temp')]
+
+        for value in values:
+            self.DM.save_value(value)
+
+        result = self.DM.get_aggregated_data(device.id, 60, variables=['od'])
+        expected_results = {'od': [
+            {'time': '20210101100000000000', 'attribute': 0, 'count': 3, 'min': 1.0, 'max': 3.0, 'mean': 2.0,
+             'last': 2.0},
+            {'time': '20210101100100000000', 'attribute': 0, 'count': 1, 'min': 5.0, 'max': 5.0, 'mean': 5.0,
+             'last': 5.0},
+            {'time': '20210101100000000000', 'attribute': 1, 'count': 1, 'min': 9.0, 'max': 9.0, 'mean': 9.0,
+             'last': 9.0}
+        ]}
+        self.assertEqual(expected_results, result)
+
+        # time range
+        result = self.DM.get_aggregated_data(device.id, 3600, values[0].time, values[4].time)
+        self.assertEqual([3, 1], [bucket['count'] for bucket in result['od']])
+        self.assertNotIn('temp', result)
+
+        # whole hours are read from the rollups
+        result = self.DM.get_aggregated_data(device.id, 3600, datetime(2021, 1, 1, 10), datetime(2021, 1, 1, 11))
+        self.assertEqual({'time': '20210101100000000000', 'attribute': 0, 'count': 4, 'min': 1.0, 'max': 5.0,
+                          'mean': 2.75, 'last': 5.0}, result['od'][0])
+        self.assertEqual(25.0, result['temp'][0]['last'])
+
+        # archived values are aggregated together with the stored ones
+        result = self.DM.get_aggregated_data(device.id, 30)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.DM.archive = Archive(directory.name)
+        self.DM.archive_values(datetime(2021, 1, 1, 10, 0, 15))
+        self.assertEqual(result, self.DM.get_aggregated_data(device.id, 30))
+
+        # invalid bucket width
+        self.assertRaises(SyntaxError, self.DM.get_aggregated_data, device.id, 0)
+
+    def test_rollups(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        values = [Value(time=datetime(2021, 1, 1, 10, 0, 10), value=1.0, dev_id='dev_id_23', var_id='od'),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 50), value=4.0, dev_id='dev_id_23', var_id='od'),
+                  Value(time=datetime(2021, 1, 1, 10, 0, 30), value=2.0, dev_id='dev_id_23', var_id='od'),
+                  Value(time=datetime(2021, 1, 1, 11, 0, 10), value=3.0, dev_id='dev_id_23', var_id='od', attribute=1)]
+
+        for value in values:
+            self.DM.save_value(value)
+
+        # rollups are maintained on write
+        rollup = MinuteRollup.query.filter_by(dev_id='dev_id_23', var_id='od', attribute=-1).one()
+        self.assertEqual((datetime(2021, 1, 1, 10), 3, 7.0, 1.0, 4.0, 4.0, values[1].time),
+                         (rollup.time, rollup.count, rollup.sum, rollup.min, rollup.max, rollup.last,
+                          rollup.last_time))
+        self.assertEqual(2, HourRollup.query.count())
+        self.assertEqual([], self.DM.check_rollups(until=datetime(2021, 1, 2)))
+
+        # inconsistency is detected and repaired by rebuild
+        MinuteRollup.query.filter_by(attribute=1).delete()
+        db.session.commit()
+        mismatches = self.DM.check_rollups(until=datetime(2021, 1, 2))
+        self.assertEqual([{'table': 'values_minute', 'dev_id': 'dev_id_23', 'var_id': 'od', 'attribute': 1,
+                           'time': '20210101110000000000', 'expected': 1, 'actual': 0}], mismatches)
+        self.assertEqual(4, self.DM.rebuild_rollups(until=datetime(2021, 1, 2)))
+        self.assertEqual([], self.DM.check_rollups(until=datetime(2021, 1, 2)))
+        self.assertEqual(2, MinuteRollup.query.count())
+
+    def test_get_events(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        events = [Event(dev_id='dev_id_23', event_type=1, time=datetime(2021, 1, 1, 10), args=[1, 0.5],
+                        command='set-pump', response={'success': True}),
+                  Event(dev_id='dev_id_23', event_type=2, time=datetime(2021, 1, 1, 11), args=(),
+                        command='get-od', response=TimeoutError('no reply')),
+                  Event(dev_id='dev_id_23', event_type=1, time=datetime(2021, 1, 1, 12), args=[1, 0.0],
+                        command='set-pump', response={'success': True})]
+        for event in events:
+            self.DM.save_event(event)
+
+        # arguments and responses are stored as JSON
+        result = self.DM.get_events('dev_id_23', event_types=[2])
+        self.assertEqual([([], {'error': 'TimeoutError', 'message': 'no reply'})],
+                         [(event['args'], event['response']) for event in result.values()])
+
+        # filtered by commands and time
+        result = self.DM.get_events('dev_id_23', commands=['set-pump'], start=datetime(2021, 1, 1, 10),
+                                    until=datetime(2021, 1, 1, 12))
+        self.assertEqual([[1, 0.5]], [event['args'] for event in result.values()])
+        self.assertEqual(3, len(self.DM.get_events('dev_id_23')))
+
+    def test_query_cache(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.DM.save_value(Value(time=now(), value=1.0, dev_id='dev_id_23', var_id='od'))
+
+        # the same query is answered from the cache until new data of the device are stored
+        self.assertEqual(self.DM.get_data(0, None, 'dev_id_23'), self.DM.get_data(0, None, 'dev_id_23'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'coalesced': 0, 'size': 1}, self.DM.query_cache.stats())
+        self.DM.save_value(Value(time=now(), value=2.0, dev_id='dev_id_23', var_id='od'))
+        self.assertEqual(2, len(self.DM.get_data(0, None, 'dev_id_23')))
+        self.assertEqual(2, self.DM.query_cache.misses)
+
+        # concurrent identical queries share one load
+        started, release, loads, results = threading.Event(), threading.Event(), [], []
+
+        def load():
+            loads.append(1)
+            started.set()
+            release.wait(5)
+            return {'result': 1}
+
+        threads = [Thread(target=lambda: results.append(self.DM.query_cache.get('key', 'dev_id_23', load)))]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+
+        # the other callers meet at the barrier once they wait for the running load
+        waiting = threading.Barrier(4, timeout=5)
+
+        class Done(threading.Event):
+            def wait(self, timeout=None):
+                waiting.wait()
+                return super().wait(timeout)
+
+        self.DM.query_cache._flights['key'].done = Done()
+        threads += [Thread(target=lambda: results.append(self.DM.query_cache.get('key', 'dev_id_23', load)))
+                    for _ in range(3)]
+        for thread in threads[1:]:
+            thread.start()
+        waiting.wait()
+        self.assertEqual(3, self.DM.query_cache.coalesced)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([1], loads)
+        self.assertEqual([{'result': 1}] * 4, results)
+
+    def test_get_data_of_devices(self):
+        # preparations
+        for device_id in ['dev_id_23', 'dev_id_24', 'dev_id_25']:
+            self.DM.insert(Device(id=device_id, device_class='PSI', device_type='PBR'), Device)
+        self.DM._store_permanent()
+        for i in range(6):
+            self.DM.save_value(Value(time=datetime(2021, 1, 1, 10, i), value=float(i), var_id='od' if i % 3 else 'temp',
+                                     dev_id='dev_id_23' if i % 2 else 'dev_id_24'))
+        data, next_cursor = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24', 'dev_id_25'])
+
+        # grouped by device, every device is present
+        self.assertEqual(['dev_id_23', 'dev_id_24', 'dev_id_25'], list(data))
+        self.assertEqual([1.0, 3.0, 5.0], [row['value'] for row in data['dev_id_23'].values()])
+        self.assertEqual({}, data['dev_id_25'])
+        self.assertIsNone(next_cursor)
+
+        # limited by variables, time range and ID
+        data, _ = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'], variables=['od'],
+                                              last_time=datetime(2021, 1, 1, 10, 1), until=datetime(2021, 1, 1, 10, 4))
+        self.assertEqual({'dev_id_23': [], 'dev_id_24': [2.0, 4.0]},
+                         {device_id: [row['value'] for row in rows.values()] for device_id, rows in data.items()})
+        last_id = max(self.DM.get_data_of_devices(['dev_id_24'])[0]['dev_id_24'])
+        self.assertEqual([5.0], [row['value'] for rows in self.DM.get_data_of_devices(
+            ['dev_id_23', 'dev_id_24'], log_id=last_id)[0].values() for row in rows.values()])
+
+        # limited number of items of each device, the following ones by the cursor
+        data, next_cursor = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'], limit=1)
+        self.assertEqual([[1.0], [0.0]], [[row['value'] for row in rows.values()] for rows in data.values()])
+        data, _ = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'], limit=1, cursor=next_cursor)
+        self.assertEqual([[3.0], [2.0]], [[row['value'] for row in rows.values()] for rows in data.values()])
+
+        # at most DATA_PAGE_SIZE_MAX items of each device
+        self.app.config['DATA_PAGE_SIZE_MAX'] = 2
+        pages = []
+        for last_time in [None, datetime(2021, 1, 1, 9)]:
+            data, next_cursor = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'], last_time=last_time)
+            pages.append([[row['value'] for row in rows.values()] for rows in data.values()])
+            while next_cursor is not None:
+                data, next_cursor = self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'], cursor=next_cursor)
+                pages.append([[row['value'] for row in rows.values()] for rows in data.values()])
+        self.assertEqual([[[1.0, 3.0], [0.0, 2.0]], [[5.0], [4.0]]] * 2, pages)
+
+        # the cursor belongs to the devices
+        self.assertRaises(SyntaxError, self.DM.get_data_of_devices, ['dev_id_25'],
+                          cursor=self.DM.get_data_of_devices(['dev_id_23', 'dev_id_24'])[1])
+
+    def test_save_values(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.app.config['BULK_BATCH_SIZE'] = 2
+        rows = [{'dev_id': 'dev_id_23', 'var_id': 'od' if i % 2 else 'new_variable',
+                 'time': datetime(2021, 1, 1, 10, i), 'value': float(i), 'attribute': None, 'note': None}
+                for i in range(5)]
+
+        # unknown variables are registered, values are written immediately
+        self.assertEqual(5, self.DM.save_values(rows))
+        self.assertIn('new_variable', self.DM.load_variables())
+        self.assertEqual([float(i) for i in range(5)], [value.value for value in Value.query.order_by(Value.time)])
+        self.assertEqual(4.0, self.DM.get_latest_data('dev_id_23').value)
+        self.assertEqual(5, MinuteRollup.query.count())
+
+        # devices must exist
+        self.assertRaises(IdError, self.DM.save_values, [dict(rows[0], dev_id='dev_id_unknown')])
+        self.assertEqual(5, Value.query.count())
+
+        # either all values are saved or none
+        error = IntegrityError('INSERT', [], Exception('failed'))
+        with mock.patch.object(DataManager, '_update_rollups', side_effect=[None, error]):
+            self.assertRaises(IntegrityError, self.DM.save_values, rows)
+        self.assertEqual(5, Value.query.count())
+
+    def test_surrogate_keys(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        for var_id in ['od', 'new_variable']:
+            self.DM.save_value(Value(time=now(), value=1.0, dev_id='dev_id_23', var_id=var_id))
+
+        # values store the numbers of the device and variables
+        numbers = dict(db.session.query(Variable.id, Variable.number))
+        self.assertEqual(len(numbers), len(set(numbers.values())))
+        self.assertEqual([(device.number, numbers['od']), (device.number, numbers['new_variable'])],
+                         db.session.query(cast(Value.dev_id, db.Integer), cast(Value.var_id, db.Integer))
+                         .order_by(Value.id).all())
+
+        # but their IDs are read and written
+        self.assertEqual(['od', 'new_variable'],
+                         [row['var_id'] for row in self.DM.get_data(0, None, 'dev_id_23').values()])
+        self.assertRaises(IdError, self.DM.get_data, 0, None, 'dev_id_unknown')
+
+        # values of unknown devices are refused
+        self.assertRaises(IdError, self.DM._insert_values, [{'time': now(), 'value': 1.0, 'dev_id': 'dev_id_unknown',
+                                                              'var_id': 'od', 'attribute': None, 'note': None}])
+
+        # unknown IDs load the mapping again at most once per interval
+        load = mock.Mock(return_value=[('od', 1)])
+        keys = SurrogateKeys('Variable', load, reload_interval=60)
+        keys.load()
+        for _ in range(3):
+            self.assertIsNone(keys.number('unknown'))
+        self.assertEqual(1, load.call_count)
+        keys.reload_interval = 0
+        self.assertIsNone(keys.name(2))
+        self.assertEqual(2, load.call_count)
+
+    def test_archive_values(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.DM.archive = Archive(directory.name)
+        self.app.config['ARCHIVE_CHUNK_SIZE'] = 2
+        values = [Value(time=datetime(2021, 1, 1, 10, 0, i), value=20.0 + i / 10, dev_id='dev_id_23',
+                        var_id='od' if i % 2 else 'temp', attribute=i if i % 3 else None, note='n' if i == 1 else None)
+                  for i in range(1, 8)]
+        for value in values:
+            self.DM.save_value(value)
+        data = self.DM.get_data(0, None, 'dev_id_23')
+        ids = sorted(data, key=int)
+        aggregated = self.DM.get_aggregated_data('dev_id_23', 60)
+        self.assertEqual(values[6].time, self.DM.get_latest_data('dev_id_23').time)
+
+        # values before the time are moved into chunks of the archive
+        self.assertEqual(6, self.DM.archive_values(datetime(2021, 1, 1, 10, 0, 7)))
+        self.assertFalse(self.DM.latest['values'].is_loaded('dev_id_23'))
+        self.assertEqual([values[6].time], [value.time for value in Value.query.all()])
+        self.assertEqual(4, len(self.DM.archive._index('dev_id_23')))
+
+        # and are still read transparently
+        self.assertEqual(data, self.DM.get_data(0, None, 'dev_id_23'))
+        self.assertEqual({ids[6]}, set(self.DM.get_data(int(ids[5]), None, 'dev_id_23')))
+        self.assertEqual({ids[5], ids[6]},
+                         set(self.DM.get_data(None, values[4].time, 'dev_id_23')))
+        self.assertEqual([20.1, 20.3, 20.5, 20.7], list(self.DM.export_values('dev_id_23')['od/value']))
+        self.assertEqual(ids, [row['id'] for row in self.DM.iter_data(0, None, 'dev_id_23')])
+        page, cursor = self.DM.get_data_page(0, None, 'dev_id_23', limit=4)
+        self.assertEqual(ids[:4], list(page))
+        self.assertEqual(ids[4:], list(self.DM.get_data_page(None, None, 'dev_id_23', cursor=cursor)[0]))
+        page, cursor = self.DM.get_data_page(None, datetime(2021, 1, 1), 'dev_id_23', limit=3)
+        self.assertEqual(ids[:3], list(page))
+        self.assertEqual(ids[3:], list(self.DM.get_data_page(None, None, 'dev_id_23', cursor=cursor)[0]))
+        self.assertEqual(7, self.DM.rebuild_rollups(until=datetime(2021, 1, 2)))
+        self.assertEqual(aggregated, self.DM.get_aggregated_data('dev_id_23', 60))
+
+        # values of a finished experiment
+        experiment = Experiment(dev_id='dev_id_23', start=datetime(2021, 1, 1, 10), end=datetime(2021, 1, 1, 11))
+        self.DM.insert(experiment, Experiment)
+        self.assertEqual(1, self.DM.archive_values(experiment_id=experiment.id))
+        self.assertEqual(0, Value.query.count())
+        self.assertEqual(data, self.DM.get_data(0, None, 'dev_id_23'))
+
+    def test_maintain_partitions(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        self.app.config['PARTITION_PREMAKE_MONTHS'] = 2
+
+        # future partitions are created
+        result = self.DM.maintain_partitions(datetime(2021, 1, 15))
+        self.assertEqual({'created': ['p202101', 'p202102', 'p202103'], 'removed': []}, result['values'])
+        self.assertEqual({'created': [], 'removed': []},
+                         self.DM.maintain_partitions(datetime(2021, 1, 20))['values'])
+
+        for time in [datetime(2021, 1, 10), datetime(2021, 3, 10)]:
+            self.DM.save_value(Value(time=time, value=1.0, dev_id='dev_id_23', var_id='od'))
+        self.assertEqual(2, len(self.DM.get_data(0, None, device.id)))
+        self.DM.get_latest_data(device.id)
+
+        # expired partitions are dropped with their values, the rollups are kept
+        self.app.config['PARTITION_RETENTION_MONTHS'] = 1
+        result = self.DM.maintain_partitions(datetime(2021, 3, 1))
+        self.assertEqual({'created': ['p202104', 'p202105'], 'removed': ['p202101']}, result['values'])
+        self.assertEqual([datetime(2021, 3, 10)], [value.time for value in Value.query.all()])
+        self.assertEqual(2, MinuteRollup.query.count())
+
+        # cached data of the device are invalidated
+        self.assertEqual(1, len(self.DM.get_data(0, None, device.id)))
+        self.assertFalse(self.DM.latest['values'].is_loaded(device.id))
+
+    def test_export_values(self):
+        # preparations
+        device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
+        self.DM.insert(device, Device)
+        self.DM._store_permanent()
+        # store some values
+        values = [Value(time=now(), value=20.0 + i, dev_id='dev_id_23', var_id='od' if i % 2 else 'temp',
+                        attribute=i if i % 2 else None, note=None)
+                  for i in range(1, 6)]
+
+        for value in values:
+            self.DM.save_value(value)
+
+        # all variables
+        result = self.DM.export_values(device.id)
+        self.assertEqual({'od/time', 'od/value', 'od/attribute', 'temp/time', 'temp/value', 'temp/attribute'},
+                         set(result))
+        self.assertEqual([time_to_microseconds(obj.time) for obj in values[0::2]], list(result['od/time']))
+        self.assertEqual([obj.value for obj in values[0::2]], list(result['od/value']))
+        self.assertEqual([1, 3, 5], list(result['od/attribute']))
+        self.assertEqual([-1, -1], list(result['temp/attribute']))
+
+        # time range and variables
+        result = self.DM.export_values(device.id, values[0].time, values[4].time, ['od'])
+        self.assertEqual([21.0, 23.0], list(result['od/value']))
+        self.assertNotIn('temp/value', result)
+
     def test_get_latest_data(self):
         # preparations
         device = Device(id='dev_id_23', device_class='PSI', device_type='PBR')
@@ -212,3 +874,28 @@ class DataManagerTestCases(unittest.TestCase):
         # get last value
         result = self.DM.get_latest_data(device.id, 'values')
         self.assertEqual(values[4], result)
+
+        expected_result = {'id': 5, 'time': time_to_string(values[4].time), 'value': 27.0, 'dev_id': 'dev_id_23',
+                           'var_id': 'od', 'attribute': 1, 'note': None}
+
+        # last value of every variable
+        self.DM.save_value(Value(id=6, time=values[3].time, value=30.0, dev_id='dev_id_23', var_id='temp'))
+        self.DM.save_value(Value(id=7, time=values[4].time, value=28.0, dev_id='dev_id_23', var_id='od'))
+        result = self.DM.get_latest_data(device.id, 'values', True)
+        self.assertEqual(['od', 'temp'], sorted(result))
+        self.assertEqual([28.0, 27.0], [row['value'] for row in result['od']])
+        self.assertEqual([30.0], [row['value'] for row in self.DM.get_latest_data(device.id, 'values', True,
+                                                                                   ['temp'])['temp']])
+
+        # newest data are loaded from persistent storage
+        DM = DataManager()
+        self.assertEqual(expected_result, DM.get_latest_data(device.id, 'values', True)['od'][1])
+        self.assertEqual(7, DM.get_latest_data(device.id, 'values').id)
+        self.assertIsNone(DM.get_latest_data(device.id, 'events'))
+
+        # the newest data are published once written
+        self.DM.values_buffer.size = 2
+        self.DM.save_value(Value(time=now(), value=29.0, dev_id='dev_id_23', var_id='od', attribute=1))
+        self.assertEqual(28.0, self.DM.get_latest_data(device.id, 'values').value)
+        self.DM.flush()
+        self.assertEqual(29.0, self.DM.get_latest_data(device.id, 'values').value)
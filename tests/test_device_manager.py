@@ -1,9 +1,13 @@
+import threading
 import unittest
 from unittest import mock
 
+from app.command import Command
 from app.src.device_manager import DeviceManager
 from app import create_app, db
+from app.src.utils.abstract_device import PriorityQueue
 from app.src.utils.errors import IdError
+from app.src.utils.workflow import WorkflowProvider
 from app.workspace.devices.PSI import test
 
 
@@ -85,3 +89,174 @@ class DeviceManagerTestCases(unittest.TestCase):
 
         self.assertEqual(self.DM.ping(), result)
         device.end()
+
+    def test_priority_queue(self):
+        queue = PriorityQueue()
+        for i, priority in enumerate([2, 0, 2, 1, 0, 2]):
+            queue.put('command {}'.format(i), priority)
+
+        # by priority, the same priorities in FIFO order
+        self.assertEqual(6, len(queue))
+        self.assertEqual(['command 1', 'command 4', 'command 3', 'command 0', 'command 2', 'command 5'],
+                         [queue.get() for _ in range(6)])
+        self.assertFalse(queue.has_items())
+
+    def test_command_worker(self):
+        config = {"device_class": 'PSI', "device_type": 'PBR', "device_id": 'my_id_23'}
+        device = test.PBR(config)
+        self.assertIsNone(device._worker)
+
+        commands = [Command(None, "2", [], 'test') for _ in range(40)]
+        posters = [threading.Thread(target=device.post_command, args=[command]) for command in commands]
+        for poster in posters:
+            poster.start()
+        for poster in posters:
+            poster.join()
+        for command in commands:
+            self.assertTrue(command.await_cmd(5))
+            self.assertTrue(command.is_valid)
+
+        # all commands were executed by one worker thread
+        worker = device._worker
+        workers = [thread for thread in threading.enumerate() if thread.name == 'my_id_23 command worker']
+        self.assertEqual(1, len(workers))
+
+        device.end()
+        self.assertFalse(worker.is_alive())
+
+        # commands posted after the end are not executed
+        command = Command(None, "2", [], 'test')
+        device.post_command(command)
+        self.assertTrue(command.await_cmd(5))
+        self.assertFalse(command.is_valid)
+
+    def test_shared_scheduler(self):
+        threads = threading.active_count()
+        devices = [test.PBR({"device_class": 'PSI', "device_type": 'PBR', "device_id": 'my_id_{}'.format(i)})
+                   for i in range(10)]
+        self.assertEqual(threads, threading.active_count())
+
+        # the scheduler is shared and started when it is used
+        self.assertIs(devices[0].scheduler, devices[9].scheduler)
+        command = Command(None, "2", [], 'test')
+        devices[0]._post_command(command)
+        self.assertTrue(command.await_cmd(5))
+        self.assertTrue(command.is_valid)
+
+        for device in devices:
+            device.end()
+        scheduler = devices[0].scheduler
+        self.assertTrue(scheduler.is_alive())
+
+        # stopped when the application exits
+        WorkflowProvider.stop()
+        scheduler.join(5)
+        self.assertFalse(scheduler.is_alive())
+
+    def test_coalesce_reads(self):
+        config = {"device_class": 'PSI', "device_type": 'PBR', "device_id": 'my_id_23'}
+        device = test.PBR(config)
+        self.DM._devices[config["device_id"]] = device
+
+        # the worker is kept busy while the other commands are queued
+        started, busy = threading.Event(), threading.Event()
+        device.interpreter["1"] = lambda: started.set() or busy.wait(5)
+        device.post_command(Command(None, "1", [], 'test'))
+        self.assertTrue(started.wait(5))
+
+        state = {'temp': 25}
+        device.interpreter["2"] = mock.Mock(side_effect=lambda: dict(state))
+        device.interpreter["3"] = mock.Mock(side_effect=lambda temp: state.update(temp=temp) or True)
+        reads = [Command(None, "2", [], 'test') for _ in range(3)]
+        for command in reads:
+            device.post_command(command)
+        # a more urgent read is not delayed by the identical queued one
+        urgent = Command(None, "2", [], 'test')
+        device.post_command(urgent, 0)
+        # and is followed by a command which keeps the worker busy again
+        paused, pause = threading.Event(), threading.Event()
+        device.interpreter["4"] = lambda: paused.set() or pause.wait(5)
+        device.post_command(Command(None, "4", [], 'test'), 1)
+        self.assertEqual({'my_id_23': {'queued': 3, 'saved_calls': 2, 'fused_commands': 0}}, self.DM.command_stats())
+
+        # a read posted after the urgent one was executed still joins the queued reads
+        busy.set()
+        self.assertTrue(paused.wait(5))
+        late = Command(None, "2", [], 'test')
+        device.post_command(late)
+        self.assertEqual(3, device.saved_calls)
+
+        # but a read posted after a write does not get the response of a read queued before the write
+        writes = [Command(None, "3", [30], 'test') for _ in range(2)]
+        for command in writes:
+            device.post_command(command)
+        after_write = Command(None, "2", [], 'test')
+        device.post_command(after_write)
+        self.assertEqual(3, device.saved_calls)
+
+        pause.set()
+        for command in reads + [urgent, late] + writes + [after_write]:
+            self.assertTrue(command.await_cmd(5))
+            self.assertTrue(command.is_valid)
+        self.assertEqual(3, device.interpreter["2"].call_count)
+        self.assertEqual(2, device.interpreter["3"].call_count)
+        self.assertEqual([{'temp': 25}] * 3, [command.response for command in reads])
+        self.assertIsNot(reads[0].response, reads[1].response)
+        self.assertEqual({'temp': 30}, after_write.response)
+        device.end()
+
+    def test_fuse_reads(self):
+        config = {"device_class": 'PSI', "device_type": 'PBR', "device_id": 'my_id_23'}
+        device = test.PBR(config)
+
+        started, busy = threading.Event(), threading.Event()
+        device.interpreter["1"] = lambda: started.set() or busy.wait(5)
+        device.post_command(Command(None, "1", [], 'test'))
+        self.assertTrue(started.wait(5))
+
+        device.interpreter["19"] = mock.Mock(return_value={'pwm_settings': (True, {'pwm_on': True}),
+                                                           'light_0': (True, {'light_intensity': 100}),
+                                                           'temp': (True, {'temp': 25}),
+                                                           'pump': (False, 'Cannot get pump')})
+        device.interpreter["3"] = mock.Mock(return_value=True)
+        # a read of every field of the composite command
+        reads = [Command(None, command_id, args, 'test') for command_id, args in
+                 [("12", []), ("9", [0]), ("9", [1]), ("5", [0]), ("5", [1]), ("4", []), ("2", []), ("6", [5]),
+                  ("14", [])]]
+        write = Command(None, "3", [30], 'test')
+        device.post_commands(reads + [write], 1)
+
+        busy.set()
+        for command in reads + [write]:
+            self.assertTrue(command.await_cmd(5))
+        self.assertEqual(1, device.interpreter["19"].call_count)
+        self.assertEqual(1, device.interpreter["3"].call_count)
+        self.assertEqual(9, device.fused_commands)
+        self.assertEqual([True, True, False, False, False, False, True, False, False],
+                         [command.is_valid for command in reads])
+        self.assertEqual({'temp': 25}, reads[6].response)
+        self.assertIsInstance(reads[7].response, Exception)
+
+        # a single read is not replaced by the composite command
+        command = Command(None, "2", [], 'test')
+        device.post_command(command)
+        self.assertTrue(command.await_cmd(5))
+        self.assertEqual({'temp': 25}, command.response)
+        self.assertEqual(1, device.interpreter["19"].call_count)
+
+        # a read queued behind a write is not fused with the reads before it
+        started.clear()
+        busy.clear()
+        device.post_command(Command(None, "1", [], 'test'))
+        self.assertTrue(started.wait(5))
+        reads = [Command(None, command.command_id, command.args, 'test') for command in reads]
+        write = Command(None, "3", [30], 'test')
+        device.post_commands(reads[:-1] + [write] + reads[-1:], 1)
+
+        busy.set()
+        for command in reads + [write]:
+            self.assertTrue(command.await_cmd(5))
+        self.assertEqual(1, device.interpreter["19"].call_count)
+        self.assertEqual(2, device.interpreter["3"].call_count)
+        self.assertEqual(9, device.fused_commands)
+        device.end()